@@ -1,24 +1,94 @@
 import base64
 import os
-from anthropic import Anthropic
+import threading
 import logging
-from src.content_provider import get_full_paths, encode_image_with_type, get_html_content
-from anthropic import APIError
+from src.content_provider import get_full_paths, encode_llm_image, get_html_content
+from src.singleflight import single_flight, content_digest
+from src.resilience import get_provider
+from src.token_usage import record_anthropic_usage
+from src.metrics import span
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-if not ANTHROPIC_API_KEY:
-    logger.error("❌ Configuration error: ANTHROPIC_API_KEY not found in environment or .env file.")
-    raise RuntimeError(
-        "Configuration error: ANTHROPIC_API_KEY not found. "
-        "Please set it as an environment variable or in your .env file."
-    )
+# The SDK is imported and the key checked when Claude is first called, so workers that never use it skip both
+_llm_client = None
+_llm_client_lock = threading.Lock()
 
-# Initialize Claude client
-llm_client = Anthropic(api_key=ANTHROPIC_API_KEY)
+
+def is_configured():
+    return bool(os.getenv("ANTHROPIC_API_KEY"))
+
+
+def get_llm_client():
+    """The process's Claude client; retries, timeouts and rate limits are left to src/resilience.py."""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                api_key = os.getenv("ANTHROPIC_API_KEY")
+                if not api_key:
+                    logger.error("❌ Configuration error: ANTHROPIC_API_KEY not found in environment or .env file.")
+                    raise RuntimeError(
+                        "Configuration error: ANTHROPIC_API_KEY not found. "
+                        "Please set it as an environment variable or in your .env file."
+                    )
+                from anthropic import Anthropic
+                _llm_client = Anthropic(api_key=api_key, max_retries=0)
+    return _llm_client
+
+
+def reset_llm_client():
+    """Drop the client, and with it its connection pool; the next call creates a new one."""
+    global _llm_client, _llm_client_lock
+    _llm_client = None
+    _llm_client_lock = threading.Lock()
+
+
+# Pooled connections inherited through fork would be shared with the parent
+os.register_at_fork(after_in_child=reset_llm_client)
+
+
+def is_api_error(e):
+    from anthropic import APIError
+    return isinstance(e, APIError)
+
+
+def is_transient_error(e):
+    from anthropic import APIConnectionError, APIStatusError, RateLimitError
+    if isinstance(e, (APIConnectionError, RateLimitError)):
+        return True
+    # 5xx including 529 overloaded
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+# Coalesced here, where failures still raise: the ask_* helpers turn them into reply strings, which would
+# otherwise be handed to every waiting worker as a result
+@single_flight("anthropic", key=lambda content, model: f"{model}:{content_digest(content)}")
+def create_message(content, model):
+    # Resolved outside the provider call: a missing key is a configuration error, not an outage
+    client = get_llm_client()
+    with span("llm", "anthropic"):
+        response = get_provider("anthropic").call(lambda timeout: client.messages.create(
+            model=model,
+            max_tokens=4000,
+            messages=[{"role": "user", "content": content}],
+            timeout=timeout
+        ), is_transient=is_transient_error)
+    record_anthropic_usage(model, response.usage)
+    return response
+
+
+def mark_cache_prefix(content):
+    """
+    Mark everything before the final question block as a cacheable prefix. Claude then reuses the processed
+    instructions and context of a recent identical prefix for a fraction of the input price and latency;
+    prefixes below the model's minimum length (1024 tokens for Sonnet) are simply not cached.
+    """
+    if len(content) > 1:
+        content[-2] = {**content[-2], "cache_control": {"type": "ephemeral"}}
+    return content
 
 
 def get_image_description_from_file(image_path, question="Describe this image", model="claude-sonnet-4-20250514"):
@@ -33,9 +103,11 @@ def get_image_description_from_file(image_path, question="Describe this image",
 
         base64_image = encode_image(image_path)
 
+        client = get_llm_client()
         # Claude API call with multimodal input
-        response = llm_client.messages.create(
+        response = get_provider("anthropic").call(lambda timeout: client.messages.create(
             model=model,
+            timeout=timeout,
             max_tokens=4000,
             messages=[
                 {
@@ -53,7 +125,7 @@ def get_image_description_from_file(image_path, question="Describe this image",
                     ],
                 }
             ],
-        )
+        ), is_transient=is_transient_error)
 
         # Return Claude’s textual output
         return response.content[0].text
@@ -62,16 +134,16 @@ def get_image_description_from_file(image_path, question="Describe this image",
         return str(e)
 
 
-def ask_anthropic_llm(question, image_paths, prompt, model="claude-sonnet-4-20250514"):
+def build_image_content(question, image_paths, prompt, cache_prefix=False):
     full_paths = get_full_paths(image_paths)
     if not full_paths:
-        return "Error: No images could be loaded. Please check the image paths."
+        return None
 
     content = [
         {"type": "text", "text": prompt},
     ]
 
-    image_inputs = [encode_image_with_type(path) for path in full_paths]
+    image_inputs = [encode_llm_image(path) for path in full_paths]
 
     for img in image_inputs:
         content.append({
@@ -85,34 +157,10 @@ def ask_anthropic_llm(question, image_paths, prompt, model="claude-sonnet-4-2025
 
     # Add the main question
     content.append({"type": "text", "text": f"Question: {question}"})
-
-    # Send to Claude API
-    try:
-        response = llm_client.messages.create(
-            model=model,
-            max_tokens=4000,
-            messages=[{"role": "user", "content": content}],
-            timeout=120
-        )
-
-        # Extract text blocks from response
-        return "".join(
-            block.text for block in response.content if block.type == "text"
-        )
-
-    except APIError as e:
-        print(f"⚠️ Anthropic API error: {e}")
-        return "LLM request failed due to an Anthropic API error."
-
-    except Exception as e:
-        print(f"⚠️ Unexpected error in Claude request: {e}")
-        return "LLM request failed: service temporarily unavailable or timed out."
+    return mark_cache_prefix(content) if cache_prefix else content
 
 
-def ask_anthropic_llm_html(question, html_paths, prompt, model="claude-sonnet-4-20250514"):
-    if not html_paths:
-        return "Error: No HTML paths provided."
-
+def build_html_content(question, html_paths, prompt, cache_prefix=False):
     html_pages = get_html_content(html_paths)
 
     # Build content blocks for Claude API
@@ -129,16 +177,41 @@ def ask_anthropic_llm_html(question, html_paths, prompt, model="claude-sonnet-4-
 
     # Add user question
     content_blocks.append({"type": "text", "text": f"Question: {question}"})
+    return mark_cache_prefix(content_blocks) if cache_prefix else content_blocks
 
-    # Call Anthropic API
+
+def ask_anthropic_llm(question, image_paths, prompt, model="claude-sonnet-4-20250514", cache_prefix=False):
+    content = build_image_content(question, image_paths, prompt, cache_prefix)
+    if not content:
+        return "Error: No images could be loaded. Please check the image paths."
+
+    # Send to Claude API
     try:
-        response = llm_client.messages.create(
-            model=model,
-            max_tokens=4000,
-            messages=[{"role": "user", "content": content_blocks}],
-            timeout=120
+        response = create_message(content, model)
+
+        # Extract text blocks from response
+        return "".join(
+            block.text for block in response.content if block.type == "text"
         )
 
+    except Exception as e:
+        if is_api_error(e):
+            print(f"⚠️ Anthropic API error: {e}")
+            return "LLM request failed due to an Anthropic API error."
+        print(f"⚠️ Unexpected error in Claude request: {e}")
+        return "LLM request failed: service temporarily unavailable or timed out."
+
+
+def ask_anthropic_llm_html(question, html_paths, prompt, model="claude-sonnet-4-20250514", cache_prefix=False):
+    if not html_paths:
+        return "Error: No HTML paths provided."
+
+    content_blocks = build_html_content(question, html_paths, prompt, cache_prefix)
+
+    # Call Anthropic API
+    try:
+        response = create_message(content_blocks, model)
+
         # Extract only text blocks from the output
         resp = "".join(
             block.text for block in response.content if block.type == "text"
@@ -147,10 +220,38 @@ def ask_anthropic_llm_html(question, html_paths, prompt, model="claude-sonnet-4-
         # print("Prompt", content)
         return resp
 
-    except APIError as e:
-        print(f"⚠️ Anthropic API error: {e}")
-        return "LLM request failed due to an Anthropic API error."
-
     except Exception as e:
+        if is_api_error(e):
+            print(f"⚠️ Anthropic API error: {e}")
+            return "LLM request failed due to an Anthropic API error."
         print(f"⚠️ Unexpected error in Claude request: {e}")
         return "LLM request failed: service temporarily unavailable or timed out."
+
+
+def stream_content(content, model):
+    """Yield the text of Claude's reply as it is generated; errors propagate to the caller."""
+    client = get_llm_client()
+    # A stream that already produced text cannot be retried transparently, so it gets a single attempt
+    with span("llm", "anthropic"), get_provider("anthropic").attempt(is_transient_error) as timeout:
+        with client.messages.stream(
+            model=model,
+            max_tokens=4000,
+            messages=[{"role": "user", "content": content}],
+            timeout=timeout
+        ) as stream:
+            for text in stream.text_stream:
+                yield text
+            record_anthropic_usage(model, stream.get_final_message().usage)
+
+
+def stream_anthropic_llm(question, image_paths, prompt, model="claude-sonnet-4-20250514", cache_prefix=False):
+    content = build_image_content(question, image_paths, prompt, cache_prefix)
+    if not content:
+        raise RuntimeError("No images could be loaded. Please check the image paths.")
+    yield from stream_content(content, model)
+
+
+def stream_anthropic_llm_html(question, html_paths, prompt, model="claude-sonnet-4-20250514", cache_prefix=False):
+    if not html_paths:
+        raise RuntimeError("No HTML paths provided.")
+    yield from stream_content(build_html_content(question, html_paths, prompt, cache_prefix), model)
@@ -0,0 +1,83 @@
+import hashlib
+import math
+import os
+import random
+import re
+import time
+from src.metrics import span
+
+# Local stand-in for the Anthropic/OpenAI clients, enabled with BAGATELLE_FAKE_LLM=1.
+# It answers without network access or API keys after a configurable delay, so the streaming and refinement
+# paths can be exercised and timed locally.
+
+FAKE_LLM = os.getenv("BAGATELLE_FAKE_LLM", "").strip().lower() in ("1", "true", "yes")
+# Seconds before the reply (or its first streamed chunk) is available: a number, or a distribution
+# "uniform:<low>,<high>" or "lognormal:<median>,<sigma>" (long-tailed, like real LLM latencies).
+# BAGATELLE_FAKE_LLM_LATENCY_ANTHROPIC / _OPENAI override it for the fake stand-in of one provider.
+FAKE_LLM_LATENCY = os.getenv("BAGATELLE_FAKE_LLM_LATENCY", "1.0")
+# Seconds between streamed chunks
+FAKE_LLM_CHUNK_DELAY = float(os.getenv("BAGATELLE_FAKE_LLM_CHUNK_DELAY", "0.02"))
+
+PROGRAMME_TEMPLATE = """```html
+<h2>Workshop programme</h2>
+<p>This is a locally generated placeholder programme.</p>
+{DAYS}
+```"""
+
+
+def sample_latency(spec):
+    kind, _, params = spec.partition(":")
+    if not params:
+        return float(kind)
+    values = [float(v) for v in params.split(",")]
+    if kind == "uniform":
+        return random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown fake latency distribution: {spec}")
+
+
+def provider_latency(provider=None):
+    spec = os.getenv(f"BAGATELLE_FAKE_LLM_LATENCY_{provider.upper()}") if provider else None
+    return sample_latency(spec or FAKE_LLM_LATENCY)
+
+
+def _is_verdict_prompt(prompt):
+    return '"Yes" or "No"' in prompt
+
+
+def _fake_verdicts(question, paths):
+    # Deterministic per (question, image), so repeated runs can be compared
+    verdicts = []
+    for path in paths:
+        digest = hashlib.sha256(f"{question}\0{path}".encode("utf-8")).digest()
+        verdicts.append("Yes" if digest[0] % 2 == 0 else "No")
+    return "[" + ", ".join(f'"{v}"' for v in verdicts) + "]"
+
+
+def _fake_programme(question, paths, prompt):
+    match = re.search(r"(\d+)-day", f"{prompt}\n{question}")
+    num_days = int(match.group(1)) if match else 1
+    days = "\n".join(
+        f"<h3>Day {day}</h3>\n<p>Sessions on {len(paths)} selected artworks.</p>" for day in range(1, num_days + 1))
+    return PROGRAMME_TEMPLATE.format(DAYS=days)
+
+
+def fake_reply(question, paths, prompt):
+    if _is_verdict_prompt(prompt):
+        return _fake_verdicts(question, paths)
+    return _fake_programme(question, paths, prompt)
+
+
+def ask_fake_llm(question, paths, prompt, model="fake", provider=None, cache_prefix=False):
+    with span("llm", "fake"):
+        time.sleep(provider_latency(provider))
+        return fake_reply(question, paths, prompt)
+
+
+def stream_fake_llm(question, paths, prompt, model="fake", provider=None, cache_prefix=False):
+    with span("llm", "fake"):
+        time.sleep(provider_latency(provider))
+        for chunk in re.findall(r"\S+\s*", fake_reply(question, paths, prompt)):
+            yield chunk
+            time.sleep(FAKE_LLM_CHUNK_DELAY)
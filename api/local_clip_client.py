@@ -0,0 +1,89 @@
+import os
+import threading
+import logging
+
+# Drop-in replacement for api.replicate_client.get_clip_embedding that runs only the CLIP text tower on CPU.
+# Needs the packages from requirements-local-clip.txt. Point BAGATELLE_CLIP_ONNX_PATH at a model produced by
+# scripts/export_clip_text_onnx.py to run it with onnxruntime (optionally int8-quantized) instead of PyTorch.
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CLIP_MODEL_NAME = os.getenv("BAGATELLE_CLIP_MODEL", "openai/clip-vit-large-patch14")
+CLIP_ONNX_PATH = os.getenv("BAGATELLE_CLIP_ONNX_PATH")
+CLIP_THREADS = int(os.getenv("BAGATELLE_CLIP_THREADS", "0"))
+# Identifies the embedding space in cache keys
+CLIP_MODEL = "local/" + CLIP_MODEL_NAME + ("+onnx:" + os.path.basename(CLIP_ONNX_PATH) if CLIP_ONNX_PATH else "")
+
+# CLIP was trained with a 77-token context
+MAX_TOKENS = 77
+
+_encoder = None
+_encoder_lock = threading.Lock()
+# Fast tokenizers are not safe for concurrent calls, and CPU inference already uses all intra-op threads
+_inference_lock = threading.Lock()
+
+
+class TorchClipTextEncoder:
+    def __init__(self, model_name):
+        import torch
+        from transformers import CLIPTokenizerFast, CLIPTextModelWithProjection
+        if CLIP_THREADS > 0:
+            torch.set_num_threads(CLIP_THREADS)
+        self.torch = torch
+        self.tokenizer = CLIPTokenizerFast.from_pretrained(model_name)
+        self.model = CLIPTextModelWithProjection.from_pretrained(model_name).eval()
+
+    def encode(self, text):
+        tokens = self.tokenizer([text], padding=True, truncation=True, max_length=MAX_TOKENS, return_tensors="pt")
+        with self.torch.inference_mode():
+            emb = self.model(input_ids=tokens["input_ids"], attention_mask=tokens["attention_mask"]).text_embeds[0]
+        emb = emb / emb.norm()
+        return emb.tolist()
+
+
+class OnnxClipTextEncoder:
+    def __init__(self, model_name, onnx_path):
+        import numpy as np
+        import onnxruntime as ort
+        from transformers import CLIPTokenizerFast
+        options = ort.SessionOptions()
+        if CLIP_THREADS > 0:
+            options.intra_op_num_threads = CLIP_THREADS
+        self.np = np
+        self.tokenizer = CLIPTokenizerFast.from_pretrained(model_name)
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def encode(self, text):
+        tokens = self.tokenizer([text], padding=True, truncation=True, max_length=MAX_TOKENS, return_tensors="np")
+        emb = self.session.run(["text_embeds"], {
+            "input_ids": tokens["input_ids"].astype(self.np.int64),
+            "attention_mask": tokens["attention_mask"].astype(self.np.int64),
+        })[0][0]
+        emb = emb / self.np.linalg.norm(emb)
+        return emb.tolist()
+
+
+def load_encoder():
+    """Load the encoder once per process; call before forking to share its weights copy-on-write."""
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                if CLIP_ONNX_PATH:
+                    logger.info(f"🧠 Loading ONNX CLIP text encoder from {CLIP_ONNX_PATH}")
+                    _encoder = OnnxClipTextEncoder(CLIP_MODEL_NAME, CLIP_ONNX_PATH)
+                else:
+                    logger.info(f"🧠 Loading CLIP text encoder {CLIP_MODEL_NAME}")
+                    _encoder = TorchClipTextEncoder(CLIP_MODEL_NAME)
+    return _encoder
+
+
+def get_clip_embedding(input):
+    # Same input/output shape as the Replicate openai/clip model: {"text": ...} -> {"embedding": [...]}
+    text = input.get("text")
+    if text is None:
+        raise ValueError("Local CLIP encoder only supports text input")
+    encoder = load_encoder()
+    with _inference_lock:
+        return {"embedding": encoder.encode(text)}
@@ -1,20 +1,93 @@
+import hashlib
+import json
 import os
-from openai import OpenAI
+import threading
 import logging
-from src.content_provider import get_full_paths, get_html_content, encode_image
+from src.content_provider import get_full_paths, get_html_content, encode_image, encode_llm_image
+from src.singleflight import single_flight, content_digest
+from src.resilience import get_provider
+from src.token_usage import record_openai_usage
+from src.metrics import span
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.error("❌ Configuration error: OPENAI_API_KEY not found in environment or .env file.")
-    raise RuntimeError(
-        "Configuration error: OPENAI_API_KEY not found. "
-        "Please set it as an environment variable or in your .env file."
-    )
-
-llm_client = OpenAI(api_key=OPENAI_API_KEY)
+# The SDK is imported and the key checked when GPT is first called, so workers that never use it skip both
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def is_configured():
+    return bool(os.getenv("OPENAI_API_KEY"))
+
+
+def get_llm_client():
+    """The process's OpenAI client; retries, timeouts and rate limits are left to src/resilience.py."""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    logger.error("❌ Configuration error: OPENAI_API_KEY not found in environment or .env file.")
+                    raise RuntimeError(
+                        "Configuration error: OPENAI_API_KEY not found. "
+                        "Please set it as an environment variable or in your .env file."
+                    )
+                from openai import OpenAI
+                _llm_client = OpenAI(api_key=api_key, max_retries=0)
+    return _llm_client
+
+
+def reset_llm_client():
+    """Drop the client, and with it its connection pool; the next call creates a new one."""
+    global _llm_client, _llm_client_lock
+    _llm_client = None
+    _llm_client_lock = threading.Lock()
+
+
+# Pooled connections inherited through fork would be shared with the parent
+os.register_at_fork(after_in_child=reset_llm_client)
+
+
+def is_transient_error(e):
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+    if isinstance(e, (APIConnectionError, RateLimitError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+def prefix_cache_options(content, cache_prefix):
+    """
+    OpenAI caches prompt prefixes of 1024+ tokens automatically; a prompt_cache_key derived from the static part
+    (everything before the final question block) routes requests sharing it to the same cache.
+    """
+    if not cache_prefix:
+        return {}
+    prefix = json.dumps(content[:-1], sort_keys=True).encode("utf-8")
+    return {"prompt_cache_key": "bagatelle-" + hashlib.sha256(prefix).hexdigest()[:32]}
+
+
+@single_flight("openai", key=lambda content, model, cache_prefix=False:
+               f"{model}:{int(cache_prefix)}:{content_digest(content)}")
+def create_completion(content, model, cache_prefix=False):
+    options = prefix_cache_options(content, cache_prefix)
+    # Resolved outside the provider call: a missing key is a configuration error, not an outage
+    client = get_llm_client()
+    with span("llm", "openai"):
+        response = get_provider("openai").call(lambda timeout: client.chat.completions.create(
+            model=model,
+            timeout=timeout,
+            messages=[
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            **options
+        ), is_transient=is_transient_error)
+    record_openai_usage(model, response.usage)
+    return response
 
 
 def get_image_description_from_file(image_path, question, model="gpt-5"):
@@ -22,8 +95,10 @@ def get_image_description_from_file(image_path, question, model="gpt-5"):
         # Getting the base64 string
         base64_image = encode_image(image_path)
 
-        response = llm_client.chat.completions.create(
+        client = get_llm_client()
+        response = get_provider("openai").call(lambda timeout: client.chat.completions.create(
             model=model,
+            timeout=timeout,
             messages=[
                 {
                     "role": "user",
@@ -35,55 +110,38 @@ def get_image_description_from_file(image_path, question, model="gpt-5"):
                         }
                     ],
                 }
-            ])
+            ]), is_transient=is_transient_error)
         return response.choices[0].message.content
     except Exception as e:
         return str(e)
 
 
-def ask_openai_llm(question, image_paths, prompt, model="gpt-5"):
+def build_image_content(question, image_paths, prompt):
     full_paths = get_full_paths(image_paths)
     if not full_paths:
-        return "Error: No images could be loaded. Please check the image paths."
+        return None
 
-    image_inputs = [encode_image(path) for path in full_paths]
+    image_inputs = [encode_llm_image(path) for path in full_paths]
 
-    try:
-        resp = llm_client.chat.completions.create(
-            model=model,
-            timeout=120,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        *[
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{image}"
-                                }
-                            }
-                            for image in image_inputs
-                        ],
-                        {"type": "text", "text": f"Question: {question}"}
-                    ]
+    return [
+        {
+            "type": "text",
+            "text": prompt
+        },
+        *[
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{image['type']};base64,{image['data']}"
                 }
-            ]
-        )
-        return resp.choices[0].message.content
-    except Exception as e:
-        print(f"⚠️ LLM request failed: {e}")
-        return "LLM request failed: service temporarily unavailable or timed out"
-
+            }
+            for image in image_inputs
+        ],
+        {"type": "text", "text": f"Question: {question}"}
+    ]
 
-def ask_openai_llm_html(question, html_paths, prompt, model="gpt-5"):
-    if not html_paths:
-        return "Error: No HTML paths provided."
 
+def build_html_content(question, html_paths, prompt):
     html_pages = get_html_content(html_paths)
 
     # Build message content
@@ -101,18 +159,30 @@ def ask_openai_llm_html(question, html_paths, prompt, model="gpt-5"):
         "type": "text",
         "text": f"Question: {question}"
     })
+    return content_blocks
+
+
+def ask_openai_llm(question, image_paths, prompt, model="gpt-5", cache_prefix=False):
+    content = build_image_content(question, image_paths, prompt)
+    if not content:
+        return "Error: No images could be loaded. Please check the image paths."
 
     try:
-        resp = llm_client.chat.completions.create(
-            model=model,
-            timeout=120,
-            messages=[
-                {
-                    "role": "user",
-                    "content": content_blocks
-                }
-            ]
-        )
+        resp = create_completion(content, model, cache_prefix)
+        return resp.choices[0].message.content
+    except Exception as e:
+        print(f"⚠️ LLM request failed: {e}")
+        return "LLM request failed: service temporarily unavailable or timed out"
+
+
+def ask_openai_llm_html(question, html_paths, prompt, model="gpt-5", cache_prefix=False):
+    if not html_paths:
+        return "Error: No HTML paths provided."
+
+    content_blocks = build_html_content(question, html_paths, prompt)
+
+    try:
+        resp = create_completion(content_blocks, model, cache_prefix)
         # content = '\n'.join(content_blocks)
         # print("Prompt", content)
         return resp.choices[0].message.content
@@ -120,3 +190,46 @@ def ask_openai_llm_html(question, html_paths, prompt, model="gpt-5"):
     except Exception as e:
         print(f"⚠️ LLM request failed: {e}")
         return "LLM request failed: service temporarily unavailable or timed out"
+
+
+def stream_content(content, model, cache_prefix=False):
+    """Yield the text of the reply as it is generated; errors propagate to the caller."""
+    options = prefix_cache_options(content, cache_prefix)
+    client = get_llm_client()
+    # A stream that already produced text cannot be retried transparently, so it gets a single attempt
+    with span("llm", "openai"), get_provider("openai").attempt(is_transient_error) as timeout:
+        stream = client.chat.completions.create(
+            model=model,
+            timeout=timeout,
+            stream=True,
+            # The final chunk then carries the token usage
+            stream_options={"include_usage": True},
+            messages=[
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            **options
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.usage is not None:
+                    record_openai_usage(model, chunk.usage)
+        finally:
+            stream.close()
+
+
+def stream_openai_llm(question, image_paths, prompt, model="gpt-5", cache_prefix=False):
+    content = build_image_content(question, image_paths, prompt)
+    if not content:
+        raise RuntimeError("No images could be loaded. Please check the image paths.")
+    yield from stream_content(content, model, cache_prefix)
+
+
+def stream_openai_llm_html(question, html_paths, prompt, model="gpt-5", cache_prefix=False):
+    if not html_paths:
+        raise RuntimeError("No HTML paths provided.")
+    yield from stream_content(build_html_content(question, html_paths, prompt), model, cache_prefix)
@@ -1,25 +1,109 @@
+import math
 import os
-from qdrant_client import QdrantClient
+import threading
 import logging
 from importlib.metadata import version
-
-print("Qdrant client version:", version("qdrant-client"))
+from src.resilience import get_provider
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-QDRANT_URL = os.getenv("QDRANT_URL")
-QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
-if not (QDRANT_URL and QDRANT_API_KEY):
-    logger.error("❌ Configuration error: QDRANT_URL or QDRANT_API_KEY not found in environment or .env file.")
-    raise RuntimeError(
-        "Configuration error: QDRANT_URL or QDRANT_API_KEY not found. "
-        "Please set it as an environment variable or in your .env file."
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").strip().lower() in ("1", "true", "yes")
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "10"))
+
+# One client per process: its HTTP (or gRPC) connections stay open between searches, so only the first
+# request of a worker pays for the TLS handshake.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def is_configured():
+    return bool(os.getenv("QDRANT_URL") and os.getenv("QDRANT_API_KEY"))
+
+
+def _create_client():
+    # qdrant_client (and grpc) are only imported by processes that search the remote collections
+    if not is_configured():
+        logger.error("❌ Configuration error: QDRANT_URL or QDRANT_API_KEY not found in environment or .env file.")
+        raise RuntimeError(
+            "Configuration error: QDRANT_URL or QDRANT_API_KEY not found. "
+            "Please set it as an environment variable or in your .env file."
+        )
+    from qdrant_client import QdrantClient
+    logger.info(f"🔌 Connecting to Qdrant with qdrant-client {version('qdrant-client')} "
+                f"(grpc={QDRANT_PREFER_GRPC}, timeout={QDRANT_TIMEOUT}s)")
+    return QdrantClient(
+        url=os.getenv("QDRANT_URL"),
+        api_key=os.getenv("QDRANT_API_KEY"),
+        https=True,
+        prefer_grpc=QDRANT_PREFER_GRPC,
+        timeout=QDRANT_TIMEOUT
     )
 
+
 def get_remote_client():
-    return QdrantClient(
-        url=QDRANT_URL,
-        api_key=QDRANT_API_KEY,
-        https=True
-)
+    global _client, _client_pid
+    pid = os.getpid()
+    client = _client
+    if client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = _create_client()
+                _client_pid = pid
+            client = _client
+    return client
+
+
+def reset_remote_client():
+    """Drop the pooled client so that the next call reconnects."""
+    global _client, _client_pid
+    with _client_lock:
+        client, owner = _client, _client_pid
+        _client, _client_pid = None, None
+    # A client inherited through fork shares its sockets with the parent, closing it here would break them
+    if client is not None and owner == os.getpid():
+        try:
+            client.close()
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to close Qdrant client: {e}")
+
+
+def _forget_client_after_fork():
+    global _client, _client_pid, _client_lock
+    _client, _client_pid = None, None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_client_after_fork)
+
+
+def _is_connection_error(e):
+    import grpc
+    from qdrant_client.http.exceptions import ResponseHandlingException
+    if isinstance(e, ResponseHandlingException):
+        return True
+    return isinstance(e, grpc.RpcError) and e.code() in (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.CANCELLED,
+                                                         grpc.StatusCode.DEADLINE_EXCEEDED)
+
+
+def _is_transient_error(e):
+    from qdrant_client.http.exceptions import UnexpectedResponse
+    if _is_connection_error(e):
+        return True
+    return isinstance(e, UnexpectedResponse) and (e.status_code == 429 or e.status_code >= 500)
+
+
+def _reconnect_after(e):
+    if _is_connection_error(e):
+        reset_remote_client()
+
+
+def call_remote_client(operation):
+    """
+    Run operation(client, timeout) on the pooled client, rate limited and retried under the "qdrant" policy.
+    timeout is what the attempt may take in whole seconds, bounded by the request deadline; QDRANT_TIMEOUT only
+    caps the connection. A dropped keep-alive connection surfaces as a transport error; the retry then reconnects.
+    """
+    return get_provider("qdrant").call(lambda timeout: operation(get_remote_client(), max(1, math.ceil(timeout))),
+                                       is_transient=_is_transient_error, on_retry=_reconnect_after)
@@ -1,24 +1,91 @@
-import replicate
 import os
+import threading
+import time
 import logging
+import httpx
+from src.resilience import get_provider
 
 # openai/clip, lucataco/clip-vit-base-patch32 expects os.environ["REPLICATE_API_TOKEN"]
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
-if not REPLICATE_API_TOKEN:
-    logger.error("❌ Configuration error: REPLICATE_API_TOKEN not found in environment or .env file.")
-    raise RuntimeError(
-        "Configuration error: REPLICATE_API_TOKEN not found. "
-        "Please set it as an environment variable or in your .env file."
-    )
+# Identifies the embedding space in cache keys
+CLIP_MODEL = "openai/clip"
+
+# Bounds every HTTP call to Replicate; the default client has no timeout at all
+REPLICATE_TIMEOUT = float(os.getenv("BAGATELLE_REPLICATE_TIMEOUT", "30"))
+# Longest "Prefer: wait" Replicate honours before answering with a prediction still running
+PREFER_WAIT_MAX = 60
+
+# Created on the first embedding, so a server embedding queries locally never needs the token
+_replicate_client = None
+_replicate_client_lock = threading.Lock()
+
+
+def is_configured():
+    return bool(os.getenv("REPLICATE_API_TOKEN"))
+
+
+def get_replicate_client():
+    global _replicate_client
+    if _replicate_client is None:
+        with _replicate_client_lock:
+            if _replicate_client is None:
+                api_token = os.getenv("REPLICATE_API_TOKEN")
+                if not api_token:
+                    logger.error("❌ Configuration error: REPLICATE_API_TOKEN not found in environment or .env file.")
+                    raise RuntimeError(
+                        "Configuration error: REPLICATE_API_TOKEN not found. "
+                        "Please set it as an environment variable or in your .env file."
+                    )
+                import replicate
+                _replicate_client = replicate.Client(api_token=api_token, timeout=httpx.Timeout(REPLICATE_TIMEOUT))
+    return _replicate_client
+
+
+def reset_replicate_client():
+    """Drop the client, and with it its connection pool; the next call creates a new one."""
+    global _replicate_client, _replicate_client_lock
+    _replicate_client = None
+    _replicate_client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_replicate_client)
+
+
+def is_transient_error(e):
+    from replicate.exceptions import ReplicateError
+    if isinstance(e, httpx.TransportError):
+        return True
+    return isinstance(e, ReplicateError) and e.status is not None and (e.status == 429 or e.status >= 500)
+
+
+def run_prediction(client, model, input, timeout):
+    """
+    client.run bounded by timeout: the prediction is awaited with "Prefer: wait" (at most 60 s server side) and then
+    polled; past the timeout it is canceled and an httpx timeout, which is transient, is raised.
+    """
+    from replicate.exceptions import ModelError
+    give_up = time.monotonic() + timeout
+    prediction = client.models.predictions.create(model=model, input=input,
+                                                  wait=max(1, min(PREFER_WAIT_MAX, int(timeout))))
+    while prediction.status not in ("succeeded", "failed", "canceled"):
+        if time.monotonic() + client.poll_interval >= give_up:
+            try:
+                prediction.cancel()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not cancel Replicate prediction {prediction.id}: {e}")
+            raise httpx.TimeoutException(f"Replicate prediction {prediction.id} not done after {timeout:.1f}s")
+        time.sleep(client.poll_interval)
+        prediction.reload()
+    if prediction.status != "succeeded":
+        raise ModelError(prediction)
+    return prediction.output
+
 
 def get_clip_embedding(input):
-    output = replicate.run(
-        "openai/clip",
-        input=input
-    )
+    client = get_replicate_client()
+    output = get_provider("replicate").call(lambda timeout: run_prediction(client, CLIP_MODEL, input, timeout),
+                                            is_transient=is_transient_error)
     return output
-
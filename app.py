@@ -1,16 +1,37 @@
-import csv
+import gzip
+import hashlib
+import functools
 import json
-from flask import Flask, render_template, request, redirect, jsonify, session
+import time
+import uuid
+from flask import (
+    Flask, render_template, request, redirect, jsonify, session, Response, stream_with_context, send_from_directory,
+    send_file, abort, g)
+from werkzeug.security import safe_join
 from datetime import timedelta
 from flask_toastr import Toastr
 from src.qdrant_bagatelle_store_client import (
-    query_image_collection, query_text_collection, query_image_and_text_collection)
-from api.openai_client import ask_openai_llm, ask_openai_llm_html
-from api.anthropic_client import ask_anthropic_llm, ask_anthropic_llm_html
+    query_image_collection, query_text_collection, query_image_and_text_collection, embed_query, embedding_cache)
+from src.response_cache import ResponseCache, response_cache_key
+from src.refinement import refine_images, hedging_stats, verdict_cache
+from src.program_builder import build_program_request, build_program_prompt, ask_program_llm, stream_program_llm
+from src.token_usage import usage_stats
+from src.catalog import get_catalog
+from src.thumbnails import THUMBS_DIR, get_thumbnail_manifest
+from src.writeups import WRITEUP_DIR, WRITEUP_SETS, get_writeup_manifest, select_encoding
+from src.jobs import (
+    job_queue, JobLimitError, JobQueueBusyError, JobCancelled, BUSY_RETRY_AFTER, ProgressReporter, check_cancelled)
+from src.resilience import REQUEST_BUDGET, JOB_BUDGET, deadline, provider_stats
+from src.singleflight import single_flight_stats
+from src.metrics import (
+    start_spans, reset_spans, span_totals, server_timing, observe_request, count_cache, render_metrics)
+from src.profiler import (
+    PROFILING_ENABLED, start_profile, clear_profile, finish_profile, list_profiles, profile_path)
+from src.query_log import QUERY_LOG_DIR, REPLAY_HEADER, log_query
+from src.warmup import warm_up, readiness
 import os
 import logging
 from dotenv import load_dotenv
-import re
 
 # log = logging.getLogger('werkzeug')
 # log.setLevel(logging.ERROR)
@@ -40,43 +61,125 @@ def create_app():
 app = create_app()
 toastr = Toastr(app)
 
+CATALOG_MAX_PAGE_SIZE = 200
+
+# With BAGATELLE_PROFILING=1, logged-in users get a sampling profile of a request by sending this header with "1",
+# or of every /retrieve and /generate_program request after enabling it for their session with POST /profile
+PROFILE_HEADER = "X-Bagatelle-Profile"
+PROFILED_ENDPOINTS = ("retrieve", "generate_program")
+# Endpoints recorded in the query log when BAGATELLE_QUERY_LOG_DIR is set
+LOGGED_ENDPOINTS = ("retrieve", "generate_program")
+
+# Finished /retrieve responses; BAGATELLE_RESPONSE_CACHE_SIMILARITY (e.g. 0.97) also reuses near-duplicate queries
+retrieve_cache = ResponseCache(
+    max_size=int(os.getenv("BAGATELLE_RESPONSE_CACHE_SIZE", "512")),
+    ttl=int(os.getenv("BAGATELLE_RESPONSE_CACHE_TTL", "3600")),
+    semantic_threshold=float(os.getenv("BAGATELLE_RESPONSE_CACHE_SIMILARITY", "0"))
+)
+
+# In the gunicorn master with preload_app; a no-op in workers forked from a master that already ran it
+warm_up(app.root_path)
+
+
+def profiling_requested():
+    if not PROFILING_ENABLED:
+        return False
+    by_header = request.headers.get(PROFILE_HEADER) == "1"
+    if not by_header and request.endpoint not in PROFILED_ENDPOINTS:
+        return False
+    # Only read now: reading the session makes the response vary on the cookie
+    return bool(session.get("logged_in")) and (by_header or bool(session.get("profile")))
+
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    start_spans()
+    g.profiler = start_profile(uuid.uuid4().hex[:12], request.endpoint or "unmatched") \
+        if profiling_requested() else None
+    if g.profiler is None:
+        clear_profile()
+
+
+@app.after_request
+def finish_request_timing(response):
+    """Per-stage durations go to the browser's devtools as Server-Timing, the total to the request histogram."""
+    timing = server_timing()
+    if timing:
+        response.headers["Server-Timing"] = timing
+    elapsed = time.perf_counter() - g.request_started
+    observe_request(request.url_rule.rule if request.url_rule else None, request.method, response.status_code,
+                    elapsed)
+    if QUERY_LOG_DIR and request.endpoint in LOGGED_ENDPOINTS and REPLAY_HEADER not in request.headers:
+        log_request(response, elapsed)
+    profiler = g.get("profiler")
+    if profiler is not None:
+        # Streamed bodies are still being generated here, the profile ends once the response is closed
+        response.headers["X-Profile-Id"] = profiler.profile_id
+        response.call_on_close(functools.partial(finish_profile, profiler))
+    return response
+
+
+def log_request(response, elapsed):
+    results = None
+    if request.endpoint == "retrieve" and response.status_code == 200 and response.is_json:
+        results = (response.get_json(silent=True) or {}).get("response")
+    log_query(request.endpoint, request.get_json(silent=True), response.status_code, elapsed, span_totals(),
+              results=results, cache_hit=g.get("cache_hit"))
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the worker answers requests."""
+    return jsonify({"status": "ok"})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: shared data loaded and the retrieval providers configured; 503 with the details otherwise."""
+    ready, details = readiness()
+    return jsonify({"ready": ready, **details}), 200 if ready else 503
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of all workers: stage latencies, request durations, cache hits, tokens, upstream calls."""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+@app.route('/profile', methods=['POST'])
+def set_profiling():
+    """Profile every /retrieve and /generate_program request of this session: {"enabled": true}."""
+    if not session.get("logged_in"):
+        return jsonify({"error": "Not logged in"}), 401
+    data = request.get_json(silent=True) or {}
+    session["profile"] = bool(data.get("enabled"))
+    return jsonify({"enabled": session["profile"], "available": PROFILING_ENABLED})
+
+
+@app.route('/profiles')
+def profiles():
+    """Recently written profiles of this worker's host, newest first."""
+    if not session.get("logged_in"):
+        return jsonify({"error": "Not logged in"}), 401
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    return jsonify({"profiles": list_profiles()})
 
-def load_bagatelle_file_list():
-    file_name = os.path.join('static', 'data', 'file_list_html.csv')
-    images = []
-    with open(file_name, 'r') as csv_file:
-        reader = csv.reader(csv_file, delimiter=',')
-        next(reader, None)
-        for row in reader:
-            images.append({"name": row[0], "category": row[1], "link": row[2]})
-    return images
-
-
-def refine_response(question, image_paths, llm_model):
-    if not image_paths or len(image_paths) == 0:
-        return image_paths
-    if len(image_paths) > 10:
-        print("Cannot process more than 10 images!")
-        return image_paths
-
-    prompt = f"""
-You are an expert image analyst. Examine each of the following {len(image_paths)} images and determine 
-whether it match the search query. Answer strictly with a JSON array of "Yes" or "No" values, one per image, 
-in the same order as given.
-Example:
-["No", "Yes", "No"]    
-    """
-    if llm_model == "gpt-5":
-        answer = ask_openai_llm(question, image_paths, prompt)
-    else:
-        # Default LLM - claude-sonnet-4-20250514
-        answer = ask_anthropic_llm(question, image_paths, prompt)
 
-    answers = re.findall(r"\b(?:Image\s*\d+\s*[:\-]?\s*)?(Yes|No)\b", answer, flags=re.IGNORECASE)
-    print("LLM response: ", answer)
-    print("LLM filter:", answers)
-    filtered = [s for s, m in zip(image_paths, answers) if "yes" in m.lower()]
-    return filtered
+@app.route('/profiles/<profile_id>')
+def get_profile(profile_id):
+    """A speedscope file, to open at https://www.speedscope.app"""
+    if not session.get("logged_in"):
+        return jsonify({"error": "Not logged in"}), 401
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    path = profile_path(profile_id)
+    if path is None:
+        return jsonify({"error": "Unknown profile"}), 404
+    return send_file(os.path.abspath(path), mimetype="application/json", as_attachment=True,
+                     download_name=os.path.basename(path))
 
 
 @app.route('/')
@@ -94,8 +197,97 @@ def gallery():
     # If logged in but this is a direct navigation, redirect to home where SPA loads it properly
     if not is_ajax:
         return redirect('/')
-    bagatelle_data = load_bagatelle_file_list()
-    return render_template("gallery.html", bagatelle_data=json.dumps(bagatelle_data))
+    return render_template("gallery.html")
+
+
+@app.route("/api/catalog")
+def api_catalog():
+    """
+    Page of gallery entries, optionally restricted to the given categories:
+    /api/catalog?category=Plague&category=Leprosy&page=1&page_size=100
+    Entries carry the responsive thumbnail variants under "thumbs" when scripts/generate_thumbnails.py has run,
+    and the content hashes of their write-ups under "versions" when scripts/precompress_writeups.py has.
+    Responses carry an ETag derived from the catalog and manifest versions and are gzipped when accepted.
+    """
+    if not session.get("logged_in"):
+        return jsonify({"error": "Not logged in"}), 401
+
+    catalog = get_catalog()
+    thumbnails = get_thumbnail_manifest()
+    writeups = get_writeup_manifest()
+    categories = sorted(set(request.args.getlist("category")))
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+        page_size = max(1, min(CATALOG_MAX_PAGE_SIZE, int(request.args.get("page_size", CATALOG_MAX_PAGE_SIZE))))
+    except ValueError:
+        return jsonify({"error": "Invalid page or page_size"}), 400
+
+    gzipped = "gzip" in request.accept_encodings
+    query_hash = hashlib.sha1(json.dumps([categories, page, page_size]).encode("utf-8")).hexdigest()[:12]
+    etag = f"{catalog.version}-{thumbnails.version}-{writeups.version}-{query_hash}" + ("-gz" if gzipped else "")
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Accept-Encoding, Cookie"}
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    images = catalog.filter(categories)
+    pages = max(1, (len(images) + page_size - 1) // page_size)
+    items = [dict(image, thumbs=thumbnails.variants(image["name"]), versions=writeups.versions(image["link"]))
+             for image in images[(page - 1) * page_size: page * page_size]]
+    body = json.dumps({
+        "items": items,
+        "page": page,
+        "page_size": page_size,
+        "pages": pages,
+        "total": len(images),
+        "categories": catalog.categories,
+    }).encode("utf-8")
+    if gzipped:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    response = Response(body, mimetype="application/json", headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+@app.route("/thumbs/<path:filename>")
+def thumbs(filename):
+    """Thumbnails have content-hashed names, so browsers may keep them for good."""
+    if filename not in get_thumbnail_manifest().files:
+        abort(404)
+    response = send_from_directory(os.path.join(app.root_path, THUMBS_DIR), filename, max_age=31536000)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+@app.route(f"/static/data/<any({', '.join(map(repr, WRITEUP_SETS))}):writeup_set>/<path:filename>")
+def writeup(writeup_set, filename):
+    """
+    Write-up pages, precompressed when scripts/precompress_writeups.py has run. The strong ETag is the content
+    hash; links carrying the current hash as ?v= may be cached for good, others are revalidated.
+    """
+    path = safe_join(os.path.join(app.root_path, WRITEUP_DIR, writeup_set), filename)
+    if path is None or not filename.endswith(".html") or not os.path.isfile(path):
+        abort(404)
+    content_hash = get_writeup_manifest().content_hash(writeup_set, filename, path)
+    encoding, file_path = select_encoding(path, request.accept_encodings)
+    etag = content_hash + ("-" + encoding if encoding else "")
+
+    headers = {"Vary": "Accept-Encoding"}
+    if request.args.get("v") == content_hash:
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        headers["Cache-Control"] = "public, no-cache"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        response = send_file(file_path, mimetype="text/html", conditional=False, etag=False, max_age=None)
+        response.headers.update(headers)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/login', methods=['POST'])
@@ -110,8 +302,55 @@ def login():
     return jsonify({"success": False, "error": "Invalid password"}), 401
 
 
+def get_session_id():
+    """Identifies the browser session that owns background jobs."""
+    if "sid" not in session:
+        session["sid"] = uuid.uuid4().hex
+    return session["sid"]
+
+
+def run_in_app_context(fn, *args):
+    # The job's spans would otherwise be added to the request that submitted it
+    token = start_spans()
+    try:
+        with app.app_context(), deadline(JOB_BUDGET):
+            return fn(*args)
+    finally:
+        reset_spans(token)
+
+
+def with_request_deadline(view):
+    """Upstream calls made while handling the request, retries included, end within REQUEST_BUDGET."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with deadline(REQUEST_BUDGET):
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+def submit_job(kind, fn, *args):
+    """
+    Queue fn as a background job of this session; 202 with the job id, 429 over the session's limit, or 503 while
+    the jobs database is locked by other workers.
+    """
+    try:
+        job_id = job_queue.submit(get_session_id(), kind, run_in_app_context, fn, *args)
+    except JobLimitError as e:
+        return jsonify({"error": str(e)}), 429
+    except JobQueueBusyError as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(BUSY_RETRY_AFTER)}
+    return jsonify({"job_id": job_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+
 @app.route('/retrieve', methods=['POST'])
+@with_request_deadline
 def retrieve():
+    """
+    Search for images; with an LLM for refinement and "async": true the work runs as a background job
+    and the response is 202 with its id, see /jobs/<job_id>.
+    """
     data = request.get_json(silent=True)
     if not data:
         return jsonify({"error": "No JSON payload received"}), 400
@@ -133,33 +372,69 @@ def retrieve():
     raw_weight = data.get("weight")
     try:
         weight = float(raw_weight)
-    except ValueError:
+    except (TypeError, ValueError):
         weight = 0
 
+    if not question:
+        return jsonify({"response": [], "error": "Invalid request!"})
+    try:
+        cache_key = response_cache_key(question, top_k, weight, llm_model)
+        cached = retrieve_cache.get(cache_key)
+        q_emb = None
+        if cached is None and retrieve_cache.semantic_threshold > 0:
+            # Handed on to the search, so the semantic lookup costs no extra model call
+            q_emb = embed_query(question)
+            cached = retrieve_cache.get_similar(cache_key, q_emb)
+    except Exception as e:
+        print(e)
+        return jsonify({"response": [], "error": "Model failed to run!"})
+    count_cache("response", hits=int(cached is not None), misses=int(cached is None))
+    g.cache_hit = cached is not None
+    if cached is not None:
+        logger.info("Response cache hit")
+        return jsonify({"response": list(cached)})
+
+    if llm_model and data.get("async"):
+        return submit_job("retrieve", retrieve_images, question, top_k, weight, llm_model, cache_key, q_emb)
+    return jsonify(retrieve_images(question, top_k, weight, llm_model, cache_key, q_emb))
+
+
+def retrieve_images(question, top_k, weight, llm_model, cache_key, q_emb):
+    """Search, refine and cache; returns the /retrieve response body."""
     image_paths = []
-    if question:
-        try:
-            if weight > 0:
-                if weight == 1:
-                    logger.info("Text search")
-                    image_paths = query_text_collection(question, top_k)
-                else:
-                    logger.info("Combined image and text search: ", weight)
-                    image_paths = query_image_and_text_collection(question, top_k, weight, 1 - weight)
+    try:
+        if weight > 0:
+            if weight == 1:
+                logger.info("Text search")
+                image_paths = query_text_collection(question, top_k, q_emb)
             else:
-                logger.info("Image search")
-                image_paths = query_image_collection(question, top_k)
-            if llm_model:
-                image_paths = refine_response(question, image_paths, llm_model)
-            return jsonify({"response": image_paths})
-        except Exception as e:
-            print(e)
-            return jsonify({"response": image_paths, "error": "Model failed to run!"})
-    return jsonify({"response": image_paths, "error": "Invalid request!"})
+                logger.info("Combined image and text search: %s", weight)
+                image_paths = query_image_and_text_collection(question, top_k, weight, 1 - weight, q_emb)
+        else:
+            logger.info("Image search")
+            image_paths = query_image_collection(question, top_k, q_emb)
+        complete = True
+        if llm_model:
+            check_cancelled()
+            image_paths, complete = refine_images(question, image_paths, llm_model)
+        # Do not keep results that a failed refinement chunk left partly unfiltered
+        if complete:
+            retrieve_cache.put(cache_key, list(image_paths), q_emb)
+        return {"response": image_paths}
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(e)
+        return {"response": image_paths, "error": "Model failed to run!"}
 
 
 @app.route('/generate_program', methods=['POST'])
+@with_request_deadline
 def generate_program():
+    """
+    Generate a workshop programme: as JSON, as Server-Sent Events ("stream": true), or as a background job
+    ("async": true, 202 with the job id) whose progress carries the partial text.
+    """
     if not session.get("logged_in"):
         return jsonify({"error": "Not logged in"}), 401
 
@@ -178,46 +453,86 @@ def generate_program():
     if not theme or not audience:
         return jsonify({"error": "Missing theme or audience"}), 400
 
+    context_paths = (context or "").strip().splitlines()
+    program_request = build_program_request(num_days, theme, audience)
+    content = build_program_prompt(program_request)
+    program_args = (llm_model, context_type, context_paths, program_request, content)
+
+    if data.get("async"):
+        return submit_job("generate_program", generate_program_job, *program_args)
+
+    if data.get("stream") or request.accept_mimetypes.best == "text/event-stream":
+        return Response(stream_with_context(stream_program_events(*program_args)),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
     try:
         logger.info("Generating program...")
-        context_paths = context.strip().splitlines()
-        # Build the instruction prompt
-        prompt_template = """
-Using only the selected set of artworks as educational and illustrative material, create a nicely formatted 500-word programme 
-for {NUM_DAYS}-day workshop on art in medicine with the theme “{THEME}” aimed at {AUDIENCE}. 
-"""
-        prompt = prompt_template.format(NUM_DAYS=num_days, THEME=theme, AUDIENCE=audience)
-        print("Parameterized prompt:", prompt, "...")
-        prompt += """
-The cross-cutting topics discussed in this workshop should prioritize commonalities between the artists who created these 
-works as well as the overlap in medical/historical/artistic aspects of their artifacts. Before you describe the workshop 
-programme in any detail, first provide a 100-word introduction that explains why the chosen theme of the art-in-medicine 
-workshop is relevant to the type of audience the workshop is aimed at, and why the selected artworks provide very apt 
-and fitting case-studies for the theme of the workshop. Create a programme that is focused on the chosen theme, in the 
-style of an academic syllabus, introducing each day with a short overview and set of learning objectives, and specifying 
-the educational goals for each session and the artworks and corresponding topics that are explored. Please make sure that 
-each workshop day has sessions covering the typical 9am-to-5pm span (with appropriate breaks for coffee, lunch etc) - 
-also propose break-out sessions for small-group discussions that combine the chosen artworks and workshop theme. 
-In the programme, mention the artworks by name and explicitly point out in which sessions they will 
-be discussed and why. Provide response in HTML format. Do not refer to instructions or ask questions in response.
-""".strip()
-        content = prompt
-        if context_type == "images":
-            if llm_model == "gpt-5":
-                llm_resp = ask_openai_llm("", context_paths, prompt)
-            else:
-                llm_resp = ask_anthropic_llm("", context_paths, prompt)
-        else:
-            if llm_model == "gpt-5":
-                llm_resp = ask_openai_llm_html("", context_paths, prompt)
-            else:
-                llm_resp = ask_anthropic_llm_html("", context_paths, prompt)
+        llm_resp = ask_program_llm(llm_model, context_type, context_paths, program_request)
         return jsonify({"response": llm_resp, "content": content})
     except Exception as e:
         print(e)
         return jsonify({"error": "Model failed to run!", "details": str(e)}), 500
 
 
+def sse_event(data, event=None):
+    """Format one Server-Sent Event; data is JSON-encoded so that newlines in HTML survive the framing."""
+    lines = f"event: {event}\n" if event else ""
+    return lines + f"data: {json.dumps(data)}\n\n"
+
+
+def stream_program_events(llm_model, context_type, context_paths, program_request, content):
+    logger.info("Streaming program...")
+    yield sse_event({"content": content}, event="start")
+    # Runs after the view (and with_request_deadline) returned, so the stream gets a request budget of its own
+    with deadline(REQUEST_BUDGET):
+        try:
+            for chunk in stream_program_llm(llm_model, context_type, context_paths, program_request):
+                yield sse_event(chunk)
+            yield sse_event({}, event="done")
+        except Exception as e:
+            print(e)
+            yield sse_event({"error": "Model failed to run!", "details": str(e)}, event="error")
+
+
+def generate_program_job(llm_model, context_type, context_paths, program_request, content):
+    logger.info("Generating program in the background...")
+    progress = ProgressReporter()
+    program = ""
+    for chunk in stream_program_llm(llm_model, context_type, context_paths, program_request):
+        program += chunk
+        progress.report({"text": program})
+    return {"response": program, "content": content}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a background job of this session; "result" holds the response body once it is done."""
+    job = job_queue.get(job_id, get_session_id())
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if not job_queue.cancel(job_id, get_session_id()):
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_queue.get(job_id, get_session_id()))
+
+
+@app.route('/status/upstreams')
+def upstream_status():
+    """
+    Circuit breaker state and call counters per upstream provider, coalesced and hedged calls, token usage
+    including the prompt-cache hits, and the caches in front of the upstreams, of this worker.
+    """
+    return jsonify({"providers": provider_stats(), "single_flight": single_flight_stats(),
+                    "hedging": hedging_stats(), "token_usage": usage_stats(),
+                    "caches": {"embedding": embedding_cache.stats(), "retrieve": retrieve_cache.stats(),
+                               "verdicts": verdict_cache.stats()}})
+
+
 @app.route('/session')
 def session_status():
     """Return JSON with current login status."""
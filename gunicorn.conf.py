@@ -1 +1,97 @@
-timeout = 120
\ No newline at end of file
+import multiprocessing
+import os
+import shutil
+
+# Worker profiles, chosen with BAGATELLE_GUNICORN_PROFILE:
+#   gthread (default): few processes with many threads. Requests spend nearly all their time waiting on Qdrant,
+#       Replicate and the LLMs, which releases the GIL, so threads serve concurrent requests for the memory of one
+#       process.
+#   gevent: greenlets, for many concurrent (streamed) requests per process; needs `pip install gevent`. Work that
+#       does not yield (local CLIP inference, searching the local index, SQLite) stalls every request of its worker,
+#       so it suits the remote backends best.
+#   sync: one request per process, gunicorn's default; a 120 s LLM call holds a whole process.
+PROFILE = os.getenv("BAGATELLE_GUNICORN_PROFILE", "gthread").strip().lower()
+if PROFILE not in ("gthread", "gevent", "sync"):
+    raise RuntimeError(f"Configuration error: unknown BAGATELLE_GUNICORN_PROFILE {PROFILE!r}, "
+                       "expected gthread, gevent or sync.")
+
+if PROFILE == "gevent":
+    # Before anything imports socket, ssl or threading: with preload_app the master imports the app, and locks or
+    # connections created unpatched there would block the workers' event loops. The provider clients are created
+    # on first use in the workers, so they get patched sockets.
+    from gevent import monkey
+    monkey.patch_all()
+    if os.getenv("QDRANT_PREFER_GRPC", "false").strip().lower() in ("1", "true", "yes"):
+        from grpc.experimental import gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+
+# prometheus_client reads this when it is imported: workers then write their metrics to files in this directory
+# and /metrics aggregates them, so every scrape sees all workers and not just the one that answered it
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join("data", "metrics"))
+# Samples of a previous run would be added to the new ones. Cleared here, before a preloaded app opens its metric
+# files; a reload (HUP) reads this file again in the same master and keeps the running workers' samples
+if os.environ.get("BAGATELLE_METRICS_CLEARED_BY") != str(os.getpid()):
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    os.environ["BAGATELLE_METRICS_CLEARED_BY"] = str(os.getpid())
+
+from src.resilience import REQUEST_BUDGET, JOB_BUDGET
+
+CPUS = multiprocessing.cpu_count()
+DEFAULT_WORKERS = {"gthread": CPUS + 1, "gevent": CPUS, "sync": 2 * CPUS + 1}
+
+worker_class = PROFILE
+workers = int(os.getenv("BAGATELLE_GUNICORN_WORKERS", str(DEFAULT_WORKERS[PROFILE])))
+# gthread: requests each worker handles at once; past the provider rate limits (src/resilience.py) more threads
+# only queue for tokens
+threads = int(os.getenv("BAGATELLE_GUNICORN_THREADS", "16")) if PROFILE == "gthread" else 1
+# gevent: concurrent connections per worker
+worker_connections = int(os.getenv("BAGATELLE_GUNICORN_CONNECTIONS", "256"))
+
+# Import the app, which warms it up (src/warmup.py), in the master: workers fork with the catalog, manifests, local
+# index and CLIP model already loaded and share those pages copy-on-write, and a recycled worker is back in seconds
+preload_app = os.getenv("BAGATELLE_GUNICORN_PRELOAD", "1").strip().lower() in ("1", "true", "yes")
+
+# Recycle workers to bound slow growth (fragmentation, caches); the jitter keeps them from restarting together.
+# Each recycled worker leaves its metric files behind, which /metrics keeps adding up
+max_requests = int(os.getenv("BAGATELLE_GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("BAGATELLE_GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+
+# A sync worker is silent while it serves a request, so it must outlive the request budget of the upstream calls;
+# gthread and gevent workers keep reporting in, and this only catches hung processes
+timeout = int(os.getenv("BAGATELLE_GUNICORN_TIMEOUT", str(int(REQUEST_BUDGET) + 30 if PROFILE == "sync" else 60)))
+# Restarts and recycling let requests and background jobs (up to JOB_BUDGET) finish before killing the worker
+graceful_timeout = int(os.getenv("BAGATELLE_GUNICORN_GRACEFUL_TIMEOUT", str(int(JOB_BUDGET) + 30)))
+
+
+def on_starting(server):
+    # Without preload_app the workers import the app themselves. Warming up the modules it uses here still loads
+    # the shared data once, before the fork, instead of once per worker on its first requests
+    if not preload_app:
+        from src.warmup import warm_up
+        warm_up(os.path.dirname(os.path.abspath(__file__)))
+
+
+def when_ready(server):
+    server.log.info(f"🚀 {PROFILE} profile: {workers} workers" +
+                    (f" x {threads} threads" if PROFILE == "gthread" else "") +
+                    (f" x {worker_connections} connections" if PROFILE == "gevent" else "") +
+                    f", preload={preload_app}, max_requests={max_requests}±{max_requests_jitter}, "
+                    f"timeout={timeout}s, graceful_timeout={graceful_timeout}s")
+
+
+def post_fork(server, worker):
+    # Pooled connections opened by the master (or a preloaded app) must not be shared with the parent
+    from api.qdrant_remote_client import reset_remote_client
+    from api.anthropic_client import reset_llm_client as reset_anthropic_client
+    from api.openai_client import reset_llm_client as reset_openai_client
+    from api.replicate_client import reset_replicate_client
+    reset_remote_client()
+    reset_anthropic_client()
+    reset_openai_client()
+    reset_replicate_client()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import random
+import re
+import time
+from types import SimpleNamespace
+import httpx
+import numpy as np
+import anthropic
+import openai
+from qdrant_client.http.exceptions import ResponseHandlingException
+from api.fake_llm_client import sample_latency, fake_reply
+from src.catalog import get_catalog
+from src.local_vector_index import LocalCollection
+from src.resilience import get_provider
+
+# Local stand-ins for the network clients, used by run_benchmark.py. Only the network call is replaced:
+# request handling, content building, caches, coalescing, retries and circuit breakers run as in production.
+# Latencies use the specs of api/fake_llm_client.py (a number, "uniform:<low>,<high>", "lognormal:<median>,<sigma>"),
+# error rates are the share of calls failing with the provider's transient error.
+
+# ---------------- CONFIG ----------------
+LATENCY = {
+    "qdrant": os.getenv("BAGATELLE_BENCH_LATENCY_QDRANT", "lognormal:0.03,0.4"),
+    "replicate": os.getenv("BAGATELLE_BENCH_LATENCY_REPLICATE", "lognormal:0.25,0.5"),
+    "anthropic": os.getenv("BAGATELLE_BENCH_LATENCY_ANTHROPIC", "lognormal:0.6,0.5"),
+    "openai": os.getenv("BAGATELLE_BENCH_LATENCY_OPENAI", "lognormal:0.6,0.5"),
+}
+ERROR_RATE = {provider: float(os.getenv(f"BAGATELLE_BENCH_ERROR_RATE_{provider.upper()}", "0"))
+              for provider in LATENCY}
+# Seconds between streamed chunks of fake LLM replies
+CHUNK_DELAY = float(os.getenv("BAGATELLE_BENCH_CHUNK_DELAY", "0.01"))
+# CLIP ViT-L/14 vector size
+DIMENSIONS = 768
+IMAGES_DIR = os.path.join("..", "static", "data", "images")
+
+IMAGE_COLLECTION = "bagatelle_image_CLIP-L14"
+TEXT_COLLECTION = "bagatelle_text_CLIP-L14"
+
+
+def environment(work_dir, caches="off"):
+    """
+    Settings of an app serving the stand-ins: dummy keys, the remote backends and throwaway databases in work_dir.
+    With caches "off" the response, embedding and verdict caches are disabled, so every request is a cold one.
+    """
+    env = {
+        "BAGATELLE_SECRET_KEY": "benchmark",
+        "QDRANT_URL": "http://qdrant.invalid", "QDRANT_API_KEY": "benchmark",
+        "ANTHROPIC_API_KEY": "benchmark", "OPENAI_API_KEY": "benchmark", "REPLICATE_API_TOKEN": "benchmark",
+        "BAGATELLE_VECTOR_BACKEND": "qdrant", "BAGATELLE_EMBEDDING_PROVIDER": "replicate", "BAGATELLE_FAKE_LLM": "0",
+        "BAGATELLE_VERDICT_CACHE_DB": os.path.join(work_dir, "verdicts.sqlite"),
+        "BAGATELLE_JOBS_DB": os.path.join(work_dir, "jobs.sqlite"),
+        "BAGATELLE_SINGLEFLIGHT_DIR": os.path.join(work_dir, "singleflight"),
+        "BAGATELLE_HTML_TEXT_DB": os.path.join(work_dir, "html_text.sqlite"),
+        "BAGATELLE_PROFILING": "0",
+    }
+    if caches == "off":
+        env.update({"BAGATELLE_RESPONSE_CACHE_SIZE": "0", "BAGATELLE_EMBEDDING_CACHE_SIZE": "0",
+                    "BAGATELLE_EMBEDDING_CACHE_DB": "", "BAGATELLE_VERDICT_CACHE_TTL": "0"})
+    # The fakes are not rate limited; the token buckets would otherwise dominate the measured latencies
+    for provider in LATENCY:
+        env[f"BAGATELLE_{provider.upper()}_RATE"] = "10000"
+        env[f"BAGATELLE_{provider.upper()}_BURST"] = "10000"
+    return env
+
+
+def words(text):
+    """Lower-case words of free text and of CamelCase file names."""
+    text = re.sub(r"\.[a-z]+$", "", text)
+    return [w.lower() for w in re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", text)]
+
+
+def hash_embedding(text):
+    """Deterministic stand-in for a CLIP text embedding: texts sharing words get similar unit vectors."""
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for word in words(text) or [text]:
+        digest = hashlib.sha256(word.encode("utf-8")).digest()
+        for i in range(0, 12, 3):
+            index = int.from_bytes(digest[i:i + 2], "big") % DIMENSIONS
+            vector[index] += 1.0 if digest[i + 2] % 2 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def simulate(provider, transient_error):
+    time.sleep(sample_latency(LATENCY[provider]))
+    if random.random() < ERROR_RATE[provider]:
+        raise transient_error()
+
+
+def estimate_tokens(content):
+    """Rough prompt size: 4 characters per token, a fixed amount per image."""
+    tokens = 0
+    for block in content:
+        if block.get("type") in ("image", "image_url"):
+            tokens += 1000
+        else:
+            tokens += len(block.get("text", "")) // 4
+    return tokens
+
+
+def reply_for(content):
+    """The fake LLM reply to the content blocks built by the Anthropic and OpenAI clients."""
+    prompt = content[0]["text"]
+    question = content[-1]["text"].removeprefix("Question: ")
+    # Verdicts of api/fake_llm_client.py depend on the image identities, here the digests of their data
+    items = []
+    for block in content[1:-1]:
+        data = block.get("source", {}).get("data") or block.get("image_url", {}).get("url") or block.get("text", "")
+        items.append(hashlib.sha256(data.encode("utf-8")).hexdigest()[:16])
+    return fake_reply(question, items, prompt)
+
+
+# ---------------- Qdrant ----------------
+
+class FakeQdrantClient:
+    """In-memory image and text collections seeded from the gallery catalog."""
+
+    def __init__(self):
+        images = get_catalog(os.path.join("static", "data", "file_list_html.csv")).images
+        image_payloads, text_payloads = [], []
+        for image in images:
+            image_path = os.path.join(IMAGES_DIR, image["name"])
+            title = " ".join(words(image["name"]))
+            image_payloads.append({"image_path": image_path, "title": title})
+            # Several sections per image, as in the real text collection
+            for text in (title, image["category"], f"{image['category']}: {title}"):
+                text_payloads.append({"image_path": image_path, "section_text": text})
+        self.collections = {
+            IMAGE_COLLECTION: self._collection(IMAGE_COLLECTION, "image_vector", image_payloads, "title"),
+            TEXT_COLLECTION: self._collection(TEXT_COLLECTION, "text_vector", text_payloads, "section_text"),
+        }
+
+    @staticmethod
+    def _collection(name, vector_name, payloads, text_field):
+        vectors = np.stack([hash_embedding(payload[text_field]) for payload in payloads])
+        return LocalCollection(name, vector_name, vectors, list(range(len(payloads))), payloads)
+
+    def search(self, collection_name, query_vector, limit, with_payload=None, **kwargs):
+        simulate("qdrant", lambda: ResponseHandlingException(ConnectionError("Fake Qdrant connection error")))
+        _, vector = query_vector
+        return self.collections[collection_name].search(vector, limit, with_payload=with_payload)
+
+
+# ---------------- Replicate ----------------
+
+def fake_clip_embedding(input):
+    def run(timeout):
+        simulate("replicate", lambda: httpx.ConnectError("Fake Replicate connection error"))
+        return {"embedding": hash_embedding(input["text"]).tolist()}
+
+    return get_provider("replicate").call(run, is_transient=lambda e: isinstance(e, httpx.TransportError))
+
+
+# ---------------- Anthropic ----------------
+
+def _anthropic_error():
+    return anthropic.APIConnectionError(request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+
+
+def _anthropic_usage(content, text):
+    return SimpleNamespace(input_tokens=estimate_tokens(content), output_tokens=len(text) // 4,
+                           cache_read_input_tokens=0, cache_creation_input_tokens=0)
+
+
+class _FakeAnthropicStream:
+    def __init__(self, content):
+        self.content = content
+        self.text = reply_for(content)
+
+    def __enter__(self):
+        simulate("anthropic", _anthropic_error)
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        for chunk in re.findall(r"\S+\s*", self.text):
+            yield chunk
+            time.sleep(CHUNK_DELAY)
+
+    def get_final_message(self):
+        return SimpleNamespace(usage=_anthropic_usage(self.content, self.text))
+
+
+class _FakeAnthropicMessages:
+    def create(self, model, messages, **kwargs):
+        simulate("anthropic", _anthropic_error)
+        content = messages[0]["content"]
+        text = reply_for(content)
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)],
+                               usage=_anthropic_usage(content, text))
+
+    def stream(self, model, messages, **kwargs):
+        return _FakeAnthropicStream(messages[0]["content"])
+
+
+class FakeAnthropic:
+    def __init__(self):
+        self.messages = _FakeAnthropicMessages()
+
+
+# ---------------- OpenAI ----------------
+
+def _openai_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+def _openai_usage(content, text):
+    return SimpleNamespace(prompt_tokens=estimate_tokens(content), completion_tokens=len(text) // 4,
+                           prompt_tokens_details=None)
+
+
+class _FakeOpenAIStream:
+    def __init__(self, content):
+        self.content = content
+        self.text = reply_for(content)
+
+    def __iter__(self):
+        for chunk in re.findall(r"\S+\s*", self.text):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))], usage=None)
+            time.sleep(CHUNK_DELAY)
+        yield SimpleNamespace(choices=[], usage=_openai_usage(self.content, self.text))
+
+    def close(self):
+        pass
+
+
+class _FakeOpenAICompletions:
+    def create(self, model, messages, stream=False, **kwargs):
+        simulate("openai", _openai_error)
+        content = messages[0]["content"]
+        if stream:
+            return _FakeOpenAIStream(content)
+        text = reply_for(content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+                               usage=_openai_usage(content, text))
+
+
+class FakeOpenAI:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_FakeOpenAICompletions())
+
+
+def install():
+    """Replace the network clients of the imported app modules with the fakes."""
+    import api.qdrant_remote_client
+    import api.anthropic_client
+    import api.openai_client
+    import src.qdrant_bagatelle_store_client
+
+    qdrant = FakeQdrantClient()
+    api.qdrant_remote_client.get_remote_client = lambda: qdrant
+    src.qdrant_bagatelle_store_client.get_clip_embedding = fake_clip_embedding
+    anthropic_client, openai_client = FakeAnthropic(), FakeOpenAI()
+    api.anthropic_client.get_llm_client = lambda: anthropic_client
+    api.openai_client.get_llm_client = lambda: openai_client
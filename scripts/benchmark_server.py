@@ -0,0 +1,20 @@
+import os
+import tempfile
+import benchmark_fakes
+
+# gunicorn entry point serving the app with the stand-ins of benchmark_fakes.py, to load test the worker profiles
+# of gunicorn.conf.py over HTTP with run_benchmark.py (BAGATELLE_BENCH_TARGET=http://127.0.0.1:8000). From the
+# repository root:
+#   BAGATELLE_GUNICORN_PROFILE=gthread gunicorn -c gunicorn.conf.py --pythonpath scripts benchmark_server:app
+# Relies on preload_app (the default): the master then imports this module, and sets the settings below, before
+# it warms up the app modules.
+
+# ---------------- CONFIG ----------------
+CACHES = os.getenv("BAGATELLE_BENCH_CACHES", "off").strip().lower()
+
+for key, value in benchmark_fakes.environment(tempfile.mkdtemp(prefix="bagatelle-bench-"), CACHES).items():
+    os.environ.setdefault(key, value)
+
+from app import app  # noqa: F401  (the entry point gunicorn loads)
+
+benchmark_fakes.install()
@@ -0,0 +1,48 @@
+import csv
+import os
+import sys
+import time
+import numpy as np
+from api.replicate_client import get_clip_embedding as replicate_embedding
+from api.local_clip_client import get_clip_embedding as local_embedding, CLIP_MODEL
+
+# Compares the local CLIP text encoder with the Replicate openai/clip vectors the collections are queried with.
+# Exits non-zero if any query drops below MIN_COSINE, so it can gate a switch of BAGATELLE_EMBEDDING_PROVIDER.
+
+# ---------------- CONFIG ----------------
+CATALOG_FILE = os.path.join("..", "static", "data", "file_list_html.csv")
+# Full precision matches to ~1e-6; int8-quantized ONNX models typically stay above 0.99
+MIN_COSINE = float(os.getenv("BAGATELLE_PARITY_MIN_COSINE", "0.99"))
+QUERIES = [
+    "plague doctor",
+    "a woman suffering from melancholy",
+    "anatomy lesson with a dissected arm",
+    "Tooth extraction in a village square",
+    "children with smallpox",
+]
+
+# Category names make realistic gallery queries
+with open(CATALOG_FILE, "r", encoding="utf8") as f:
+    reader = csv.reader(f, delimiter=",")
+    next(reader, None)
+    QUERIES += sorted({row[1] for row in reader if len(row) > 1 and row[1].strip()})
+
+print(f"Comparing {CLIP_MODEL} with Replicate openai/clip on {len(QUERIES)} queries")
+cosines = []
+local_time = 0.0
+for query in QUERIES:
+    remote = np.asarray(replicate_embedding({"text": query})["embedding"], dtype=np.float64)
+    start = time.perf_counter()
+    local = np.asarray(local_embedding({"text": query})["embedding"], dtype=np.float64)
+    local_time += time.perf_counter() - start
+
+    cosine = float(remote @ local / (np.linalg.norm(remote) * np.linalg.norm(local)))
+    cosines.append(cosine)
+    print(f"{cosine:.6f}  {query}")
+
+print(f"\nmin cosine {min(cosines):.6f}, mean {np.mean(cosines):.6f}, "
+      f"mean local latency {local_time / len(QUERIES) * 1000:.1f} ms")
+if min(cosines) < MIN_COSINE:
+    print(f"❌ Local encoder diverges from Replicate (min cosine below {MIN_COSINE})")
+    sys.exit(1)
+print("✅ Local encoder matches Replicate")
@@ -0,0 +1,51 @@
+import os
+import torch
+from transformers import CLIPTextModelWithProjection, CLIPTokenizerFast
+
+# Exports the CLIP text tower used by api/local_clip_client.py to ONNX, plus a dynamically int8-quantized copy.
+# Serve either file with BAGATELLE_EMBEDDING_PROVIDER=local BAGATELLE_CLIP_ONNX_PATH=<file>, and run
+# scripts/check_embedding_parity.py against it before switching production over.
+
+# ---------------- CONFIG ----------------
+MODEL_NAME = os.getenv("BAGATELLE_CLIP_MODEL", "openai/clip-vit-large-patch14")
+OUTPUT_DIR = os.path.join("..", "data", "models")
+ONNX_FILE = os.path.join(OUTPUT_DIR, "clip_text.onnx")
+ONNX_INT8_FILE = os.path.join(OUTPUT_DIR, "clip_text_int8.onnx")
+QUANTIZE = True
+
+
+class TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).text_embeds
+
+
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+print("Loading CLIP text model...")
+tokenizer = CLIPTokenizerFast.from_pretrained(MODEL_NAME)
+model = CLIPTextModelWithProjection.from_pretrained(MODEL_NAME).eval()
+
+sample = tokenizer(["a painting of a plague doctor"], padding=True, return_tensors="pt")
+torch.onnx.export(
+    TextTower(model),
+    (sample["input_ids"], sample["attention_mask"]),
+    ONNX_FILE,
+    input_names=["input_ids", "attention_mask"],
+    output_names=["text_embeds"],
+    dynamic_axes={
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "sequence"},
+        "text_embeds": {0: "batch"},
+    },
+    opset_version=17,
+)
+print(f"✅ Exported {ONNX_FILE}")
+
+if QUANTIZE:
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(ONNX_FILE, ONNX_INT8_FILE, weight_type=QuantType.QInt8)
+    print(f"✅ Quantized {ONNX_INT8_FILE}")
@@ -0,0 +1,47 @@
+from api.qdrant_remote_client import get_remote_client
+from src.local_vector_index import write_local_collection, INDEX_DIR
+
+# Copies the Qdrant collections into the memory-mapped format read by src/local_vector_index.py.
+# Writes to the INDEX_DIR of that module (BAGATELLE_INDEX_DIR, a relative path is taken from the repository root),
+# where the server finds it; set BAGATELLE_VECTOR_BACKEND=local to search it in-process.
+
+# ---------------- CONFIG ----------------
+COLLECTIONS = [
+    ("bagatelle_image_CLIP-L14", "image_vector"),
+    ("bagatelle_text_CLIP-L14", "text_vector"),
+]
+BATCH_SIZE = 256
+
+client = get_remote_client()
+
+
+def export_collection(collection_name, vector_name):
+    ids, vectors, payloads = [], [], []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=BATCH_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=[vector_name],
+        )
+        for p in points:
+            vector = p.vector[vector_name] if isinstance(p.vector, dict) else p.vector
+            ids.append(p.id)
+            vectors.append(vector)
+            payloads.append(p.payload or {})
+        print(f"{collection_name}: fetched {len(ids)} points")
+        if offset is None:
+            break
+
+    if not ids:
+        print(f"⚠️ Collection {collection_name} is empty, nothing exported")
+        return
+    vectors_path, meta_path = write_local_collection(
+        collection_name, vector_name, ids, vectors, payloads, index_dir=INDEX_DIR)
+    print(f"✅ Exported {len(ids)} points to {vectors_path} and {meta_path}")
+
+
+for name, vector in COLLECTIONS:
+    export_collection(name, vector)
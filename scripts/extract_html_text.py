@@ -0,0 +1,25 @@
+import glob
+import os
+import time
+from src.html_text_store import get_html_text_store
+
+# Pre-extracts the plain text, sections and token counts of all HTML write-ups into the store read by
+# src/content_provider.get_html_content, so requests never parse HTML. Pages whose content has not changed
+# since the last run are skipped; the server re-extracts stale pages on first use either way.
+
+# ---------------- CONFIG ----------------
+APP_ROOT = ".."
+HTML_DIRS = sorted(glob.glob(os.path.join(APP_ROOT, "static", "data", "html_*")))
+
+store = get_html_text_store(APP_ROOT)
+
+start = time.perf_counter()
+pages, tokens = 0, 0
+for html_dir in HTML_DIRS:
+    for path in sorted(glob.glob(os.path.join(html_dir, "*.html"))):
+        page = store.get(path)
+        pages += 1
+        tokens += page["token_count"]
+    print(f"Processed {html_dir}")
+
+print(f"✅ {pages} pages, ~{tokens} tokens in {time.perf_counter() - start:.1f}s")
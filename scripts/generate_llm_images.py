@@ -0,0 +1,56 @@
+import glob
+import math
+import os
+import shutil
+from PIL import Image, ImageOps
+
+# Writes the downscaled JPEG copies that src/content_provider.encode_llm_image sends to the LLMs instead of
+# the originals. Anthropic resizes anything above ~1568 px on the long edge or ~1.15 megapixels (and bills
+# vision tokens by pixel count), OpenAI's high-detail mode scales images to fit 2048 x 768, so larger uploads
+# only add request size, cost and latency. Re-run after adding images; variants newer than their original
+# are skipped. Needs the packages from requirements-images.txt.
+
+# ---------------- CONFIG ----------------
+IMAGES_DIR = os.path.join("..", "static", "data", "images")
+# Relative to the repository root, like src/content_provider.py reads it
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_DIR = os.path.join(ROOT_DIR, os.getenv("BAGATELLE_LLM_IMAGES_DIR", os.path.join("static", "data", "images_llm")))
+MAX_EDGE = 1568
+MAX_PIXELS = 1_150_000
+JPEG_QUALITY = 85
+
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+created, skipped, failed = 0, 0, 0
+bytes_before, bytes_after = 0, 0
+for path in sorted(glob.glob(os.path.join(IMAGES_DIR, "*.*"))):
+    # Keep the full original name, stems alone are not unique (e.g. scurvy.jpg and scurvy.png)
+    variant = os.path.join(OUTPUT_DIR, os.path.basename(path) + ".jpg")
+    if os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(path):
+        skipped += 1
+        continue
+    try:
+        with Image.open(path) as image:
+            original_format = image.format
+            original_size = image.size
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail((MAX_EDGE, MAX_EDGE), Image.LANCZOS)
+            if image.width * image.height > MAX_PIXELS:
+                scale = math.sqrt(MAX_PIXELS / (image.width * image.height))
+                image = image.resize((int(image.width * scale), int(image.height * scale)), Image.LANCZOS)
+            image.save(variant, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        # Re-encoding a JPEG that needed no resizing can make it bigger, keep the original bytes in that case
+        if (original_format == "JPEG" and image.size == original_size
+                and os.path.getsize(variant) >= os.path.getsize(path)):
+            shutil.copyfile(path, variant)
+    except Exception as e:
+        print(f"⚠️ Failed to convert {path}: {e}")
+        failed += 1
+        continue
+    created += 1
+    bytes_before += os.path.getsize(path)
+    bytes_after += os.path.getsize(variant)
+    print(created, os.path.basename(path))
+
+print(f"✅ Created {created} variants ({bytes_before / 1e6:.1f} MB -> {bytes_after / 1e6:.1f} MB), "
+      f"skipped {skipped} up-to-date, {failed} failed")
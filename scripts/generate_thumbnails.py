@@ -0,0 +1,80 @@
+import glob
+import hashlib
+import json
+import os
+from PIL import Image, ImageOps
+
+# Pre-generates the gallery thumbnails in several widths as WebP and JPEG. File names carry a hash of the
+# original, so the server can mark them immutable; a changed original gets new names. The manifest maps each
+# original file name to its variants and is read by src/thumbnails.py. Re-run after adding or changing images,
+# existing files are reused and files no longer referenced are removed. Needs the packages from
+# requirements-images.txt.
+
+# ---------------- CONFIG ----------------
+IMAGES_DIR = os.path.join("..", "static", "data", "images")
+THUMBS_DIR = os.path.join("..", "static", "data", "thumbs")
+MANIFEST_FILE = os.path.join(THUMBS_DIR, "manifest.json")
+WIDTHS = [160, 320, 800]
+FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 6}), "jpeg": ("JPEG", {"quality": 82, "optimize": True})}
+
+os.makedirs(THUMBS_DIR, exist_ok=True)
+
+
+def thumbnail_widths(original_width):
+    """Requested widths that do not upscale, plus the original width when it is well above the largest of them."""
+    widths = [w for w in WIDTHS if w < original_width]
+    if len(widths) < len(WIDTHS) and (not widths or original_width > widths[-1] * 1.25):
+        widths.append(original_width)
+    return widths
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:10]
+
+
+manifest = {"widths": WIDTHS, "images": {}}
+written = set()
+created = 0
+for count, path in enumerate(sorted(glob.glob(os.path.join(IMAGES_DIR, "*.*"))), start=1):
+    name = os.path.basename(path)
+    # The extension is part of the prefix because stems alone are not unique (e.g. scurvy.jpg and scurvy.png)
+    prefix = f"{name.replace('.', '_')}-{file_hash(path)}"
+    try:
+        with Image.open(path) as original:
+            image = ImageOps.exif_transpose(original).convert("RGB")
+    except Exception as e:
+        print(f"⚠️ Failed to open {path}: {e}")
+        continue
+
+    entry = {"width": image.width, "height": image.height}
+    for fmt, (pil_format, options) in FORMATS.items():
+        variants = {}
+        for width in thumbnail_widths(image.width):
+            file_name = f"{prefix}-{width}.{'jpg' if fmt == 'jpeg' else fmt}"
+            file_path = os.path.join(THUMBS_DIR, file_name)
+            if not os.path.exists(file_path):
+                height = max(1, round(image.height * width / image.width))
+                image.resize((width, height), Image.LANCZOS).save(file_path, pil_format, **options)
+                created += 1
+            variants[str(width)] = file_name
+            written.add(file_name)
+        entry[fmt] = variants
+    manifest["images"][name] = entry
+    if count % 50 == 0:
+        print(f"Processed {count} images")
+
+removed = 0
+for file_path in glob.glob(os.path.join(THUMBS_DIR, "*.*")):
+    file_name = os.path.basename(file_path)
+    if file_name not in written and file_path != MANIFEST_FILE:
+        os.remove(file_path)
+        removed += 1
+
+tmp_manifest = MANIFEST_FILE + ".tmp"
+with open(tmp_manifest, "w", encoding="utf8") as f:
+    json.dump(manifest, f, ensure_ascii=False)
+os.replace(tmp_manifest, MANIFEST_FILE)
+
+total = sum(os.path.getsize(os.path.join(THUMBS_DIR, f)) for f in written)
+print(f"✅ {len(manifest['images'])} images, {created} new and {removed} stale thumbnails, {total / 1e6:.1f} MB in total")
@@ -0,0 +1,72 @@
+import gzip
+import hashlib
+import json
+import os
+from src.writeups import WRITEUP_SETS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Writes .gz and .br siblings of every write-up page (served by app.py according to Accept-Encoding) and a
+# manifest with the content hash of each page, used for ?v= cache busting and strong ETags.
+# Re-run after regenerating write-ups; siblings newer than their page are kept. Brotli needs the optional
+# package from requirements-writeups.txt, without it only gzip siblings are written.
+
+# ---------------- CONFIG ----------------
+WRITEUP_DIR = os.path.join("..", "static", "data")
+MANIFEST_FILE = os.path.join(WRITEUP_DIR, "writeups_manifest.json")
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+def write_sibling(path, suffix, content, compress):
+    sibling = path + suffix
+    if os.path.exists(sibling) and os.path.getmtime(sibling) >= os.path.getmtime(path):
+        return 0, os.path.getsize(sibling)
+    compressed = compress(content)
+    tmp_path = sibling + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp_path, sibling)
+    return 1, len(compressed)
+
+
+if brotli is None:
+    print("⚠️ brotli is not installed, writing gzip siblings only")
+
+pages = {}
+created = 0
+bytes_total, bytes_gz, bytes_br = 0, 0, 0
+for writeup_set in WRITEUP_SETS:
+    set_dir = os.path.join(WRITEUP_DIR, writeup_set)
+    pages[writeup_set] = {}
+    for file_name in sorted(os.listdir(set_dir)):
+        if not file_name.endswith(".html"):
+            continue
+        path = os.path.join(set_dir, file_name)
+        with open(path, "rb") as f:
+            content = f.read()
+        st = os.stat(path)
+        pages[writeup_set][file_name] = {
+            "hash": hashlib.sha256(content).hexdigest()[:16], "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+        new, size = write_sibling(path, ".gz", content, lambda c: gzip.compress(c, compresslevel=GZIP_LEVEL, mtime=0))
+        created += new
+        bytes_gz += size
+        if brotli is not None:
+            new, size = write_sibling(path, ".br", content, lambda c: brotli.compress(c, quality=BROTLI_QUALITY))
+            created += new
+            bytes_br += size
+        bytes_total += len(content)
+    print(f"{writeup_set}: {len(pages[writeup_set])} pages")
+
+version = hashlib.sha256(json.dumps(pages, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+tmp_manifest = MANIFEST_FILE + ".tmp"
+with open(tmp_manifest, "w", encoding="utf-8") as f:
+    json.dump({"version": version, "pages": pages}, f)
+os.replace(tmp_manifest, MANIFEST_FILE)
+
+print(f"✅ {created} new compressed files; {bytes_total / 1e6:.1f} MB -> gzip {bytes_gz / 1e6:.1f} MB"
+      + (f", brotli {bytes_br / 1e6:.1f} MB" if brotli is not None else ""))
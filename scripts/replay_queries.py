@@ -0,0 +1,251 @@
+import csv
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+# Replays the query log written with BAGATELLE_QUERY_LOG_DIR (src/query_log.py) against a running server and reports
+# latency histograms per endpoint and how the /retrieve results differ from the logged ones.
+# "open" mode starts every request at its original time offset divided by SPEED, however long earlier ones take,
+# which reproduces the production arrival pattern; "closed" mode keeps CONCURRENCY requests in flight back to back.
+# Hashed questions, themes and audiences are replaced by stand-ins chosen by their hash, so repeated queries stay
+# repeated (and cacheable) in the replay; their results are not compared, as the stand-ins ask something else.
+# Replaying refinement and programme requests calls the target's LLM providers.
+
+# ---------------- CONFIG ----------------
+LOG_DIR = os.getenv("BAGATELLE_REPLAY_LOG_DIR", os.path.join("..", "data", "query_log"))
+TARGET_URL = os.getenv("BAGATELLE_REPLAY_TARGET", "http://localhost:5000").rstrip("/")
+# Refinement and programme requests need a logged-in session
+PASSWORD = os.getenv("BAGATELLE_REPLAY_PASSWORD", "")
+MODE = os.getenv("BAGATELLE_REPLAY_MODE", "open").strip().lower()
+SPEED = float(os.getenv("BAGATELLE_REPLAY_SPEED", "1"))
+CONCURRENCY = int(os.getenv("BAGATELLE_REPLAY_CONCURRENCY", "8"))
+# Upper bound of requests in flight in open mode
+MAX_IN_FLIGHT = int(os.getenv("BAGATELLE_REPLAY_MAX_IN_FLIGHT", "64"))
+# 0 replays every record
+LIMIT = int(os.getenv("BAGATELLE_REPLAY_LIMIT", "0"))
+ENDPOINTS = [e for e in os.getenv("BAGATELLE_REPLAY_ENDPOINTS", "retrieve,generate_program").split(",") if e]
+REQUEST_TIMEOUT = 600
+JOB_POLL_INTERVAL = 0.5
+OUTPUT_FILE = os.getenv("BAGATELLE_REPLAY_OUTPUT",
+                        os.path.join("..", "data", "benchmarks", f"replay-{time.strftime('%Y%m%dT%H%M%S')}.json"))
+CATALOG_FILE = os.path.join("..", "static", "data", "file_list_html.csv")
+# Seconds, as in src/metrics.py
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 90, 120, 180, 300)
+MAX_DIFF_EXAMPLES = 20
+
+STAND_IN_THEMES = ["Contagion and quarantine", "The anatomist's eye", "Madness and melancholy", "Healing hands",
+                   "Pain and its depiction", "Doctors and patients"]
+STAND_IN_AUDIENCES = ["medical students", "nursing students", "pathohistology residents", "museum educators",
+                      "general practitioners"]
+
+with open(CATALOG_FILE, "r", encoding="utf8") as f:
+    reader = csv.reader(f, delimiter=",")
+    next(reader, None)
+    STAND_IN_QUESTIONS = sorted({row[1] for row in reader if len(row) > 1 and row[1].strip()})
+
+
+def load_records():
+    records = []
+    for path in glob.glob(os.path.join(LOG_DIR, "query-*.log*")):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("endpoint") in ENDPOINTS:
+                    records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records[:LIMIT] if LIMIT else records
+
+
+def text_value(field, stand_ins):
+    """The logged text, or the stand-in picked by its hash; and whether it is the original."""
+    if isinstance(field, dict):
+        return stand_ins[int(field["hash"], 16) % len(stand_ins)], False
+    return field or "", True
+
+
+def request_body(record):
+    params = record["params"]
+    if record["endpoint"] == "retrieve":
+        question, original = text_value(params["question"], STAND_IN_QUESTIONS)
+        body = {"question": question, "k": params.get("k"), "weight": params.get("weight"), "llm": params.get("llm"),
+                "async": params.get("async")}
+        return body, original
+    theme, _ = text_value(params["theme"], STAND_IN_THEMES)
+    audience, _ = text_value(params["audience"], STAND_IN_AUDIENCES)
+    body = {"num_days": params.get("num_days"), "theme": theme, "audience": audience,
+            "context": "\n".join(params.get("context") or []), "context_type": params.get("context_type"),
+            "llm": params.get("llm"), "async": params.get("async"), "stream": params.get("stream")}
+    return body, False
+
+
+_sessions = threading.local()
+
+
+def get_session():
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+        # Keeps the replayed requests out of the target's own query log
+        session.headers["X-Bagatelle-Replay"] = "1"
+        if PASSWORD:
+            session.post(f"{TARGET_URL}/login", json={"password": PASSWORD}, timeout=30).raise_for_status()
+    return session
+
+
+def wait_for_job(session, job_id):
+    while True:
+        job = session.get(f"{TARGET_URL}/jobs/{job_id}", timeout=30).json()
+        if job.get("status") in ("done", "failed", "cancelled"):
+            return job
+        time.sleep(JOB_POLL_INTERVAL)
+
+
+def send(record, scheduled=None):
+    """Issue one logged request; jobs are polled until they finish, streams read to the end."""
+    body, comparable = request_body(record)
+    session = get_session()
+    started = time.perf_counter()
+    lag = None if scheduled is None else started - scheduled
+    results = None
+    try:
+        response = session.post(f"{TARGET_URL}/{record['endpoint']}", json=body, stream=bool(body.get("stream")),
+                                timeout=REQUEST_TIMEOUT)
+        status = response.status_code
+        if body.get("stream"):
+            for _ in response.iter_content(chunk_size=None):
+                pass
+        elif status == 202:
+            job = wait_for_job(session, response.json()["job_id"])
+            status = 200 if job["status"] == "done" else job["status"]
+            results = (job.get("result") or {}).get("response")
+        else:
+            data = response.json()
+            results = data.get("response")
+            if "error" in data:
+                status = f"{status} error"
+    except (requests.RequestException, ValueError) as e:
+        status = type(e).__name__
+    latency = time.perf_counter() - started
+    if record["endpoint"] != "retrieve" or not comparable:
+        results = None
+    return {"record": record, "status": status, "latency": latency, "lag": lag, "results": results}
+
+
+def replay(records):
+    started = time.perf_counter()
+    if MODE == "closed" or SPEED <= 0:
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            return list(pool.map(send, records)), time.perf_counter() - started
+
+    first_ts = records[0]["ts"]
+    futures = []
+    with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as pool:
+        for record in records:
+            scheduled = started + (record["ts"] - first_ts) / SPEED
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, record, scheduled))
+        replayed = [future.result() for future in futures]
+    return replayed, time.perf_counter() - started
+
+
+def group_name(record):
+    if record["endpoint"] == "retrieve":
+        return "retrieve (refined)" if record["params"].get("llm") else "retrieve"
+    return "generate_program"
+
+
+def latency_summary(seconds):
+    values = np.array(seconds) * 1000
+    return {f"p{p}": round(float(np.percentile(values, p)), 1) for p in (50, 90, 95, 99)} | \
+        {"mean": round(float(values.mean()), 1), "max": round(float(values.max()), 1)}
+
+
+def histogram(seconds):
+    """Cumulative counts per upper bound in seconds, like a Prometheus histogram."""
+    return {**{str(bound): int(sum(s <= bound for s in seconds)) for bound in HISTOGRAM_BUCKETS},
+            "+Inf": len(seconds)}
+
+
+def result_diffs(replayed):
+    compared = identical = reordered = changed = 0
+    overlaps = []
+    examples = []
+    for result in replayed:
+        before = result["record"].get("results")
+        after = result["results"]
+        if before is None or after is None:
+            continue
+        compared += 1
+        if before == after:
+            identical += 1
+        elif set(before) == set(after):
+            reordered += 1
+        else:
+            changed += 1
+            if len(examples) < MAX_DIFF_EXAMPLES:
+                examples.append({"question": result["record"]["params"]["question"], "logged": before,
+                                 "replayed": after})
+        union = set(before) | set(after)
+        overlaps.append(len(set(before) & set(after)) / len(union) if union else 1.0)
+    return {"compared": compared, "identical": identical, "reordered": reordered, "changed": changed,
+            "mean_jaccard": round(float(np.mean(overlaps)), 4) if overlaps else None, "examples": examples}
+
+
+def summarize(replayed, elapsed):
+    groups = {}
+    for result in replayed:
+        groups.setdefault(group_name(result["record"]), []).append(result)
+    report = {"target": TARGET_URL, "mode": MODE, "speed": SPEED, "requests": len(replayed),
+              "elapsed_s": round(elapsed, 2), "throughput_rps": round(len(replayed) / elapsed, 2), "groups": {}}
+    lags = [result["lag"] for result in replayed if result["lag"] is not None]
+    if lags:
+        # A growing lag means this machine could not issue the requests on schedule
+        report["start_lag_ms"] = latency_summary(lags)
+    for name, results in sorted(groups.items()):
+        statuses = {}
+        for result in results:
+            statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+        latencies = [result["latency"] for result in results]
+        report["groups"][name] = {
+            "requests": len(results),
+            "statuses": statuses,
+            "latency_ms": latency_summary(latencies),
+            # Logged latencies of asynchronous requests only cover submitting the job
+            "logged_latency_ms": latency_summary([result["record"]["latency_ms"] / 1000 for result in results]),
+            "histogram": histogram(latencies),
+        }
+    report["result_diffs"] = result_diffs(replayed)
+    return report
+
+
+records = load_records()
+if not records:
+    print(f"❌ No query log records in {LOG_DIR}")
+    raise SystemExit(1)
+if not PASSWORD:
+    print("⚠️ BAGATELLE_REPLAY_PASSWORD not set, refinement and programme requests will be rejected")
+span = records[-1]["ts"] - records[0]["ts"]
+print(f"🔁 Replaying {len(records)} requests logged over {span:.0f}s against {TARGET_URL} "
+      f"({MODE} mode, speed {SPEED:g}, concurrency {CONCURRENCY if MODE == 'closed' else MAX_IN_FLIGHT})")
+replayed, elapsed = replay(records)
+report = summarize(replayed, elapsed)
+
+for name, group in report["groups"].items():
+    print(f"   {name}: {group['requests']} requests, {group['statuses']}, latency {group['latency_ms']}")
+diffs = report["result_diffs"]
+print(f"   results: {diffs['compared']} compared, {diffs['identical']} identical, {diffs['reordered']} reordered, "
+      f"{diffs['changed']} changed")
+os.makedirs(os.path.dirname(OUTPUT_FILE) or ".", exist_ok=True)
+with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+    json.dump(report, f, indent=2)
+print(f"✅ Report written to {OUTPUT_FILE}")
@@ -0,0 +1,213 @@
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Benchmarks /retrieve and /generate_program in-process with the Flask test client, against the local stand-ins
+# of benchmark_fakes.py, so it needs no network access or API keys. Every scenario runs REQUESTS requests at a fixed
+# CONCURRENCY and reports throughput, latency percentiles and the per-stage times from the Server-Timing header.
+# With BAGATELLE_BENCH_TARGET set the requests go over HTTP to a server started with benchmark_server.py instead,
+# which measures the gunicorn worker profiles of gunicorn.conf.py; the cache setting is then the server's.
+# Stage times of a request add up the spans of all its threads, so they can exceed the request's latency.
+# With BAGATELLE_BENCH_BASELINE set to the results of an earlier run the script exits non-zero when a scenario's
+# p95 latency or throughput got worse by more than TOLERANCE, which lets CI catch performance regressions.
+
+# ---------------- CONFIG ----------------
+ROOT_DIR = ".."
+REQUESTS = int(os.getenv("BAGATELLE_BENCH_REQUESTS", "100"))
+CONCURRENCY = int(os.getenv("BAGATELLE_BENCH_CONCURRENCY", "8"))
+TARGET = os.getenv("BAGATELLE_BENCH_TARGET", "").rstrip("/")
+# Requests per scenario before measuring, they fill connection pools and lazily loaded state
+WARMUP = int(os.getenv("BAGATELLE_BENCH_WARMUP", "5"))
+# "off" benchmarks cold requests (response, embedding and verdict caches disabled), "on" keeps the caches
+CACHES = os.getenv("BAGATELLE_BENCH_CACHES", "off").strip().lower()
+# Comma-separated scenario names, empty runs all
+ONLY = [s for s in os.getenv("BAGATELLE_BENCH_SCENARIOS", "").split(",") if s]
+SEED = int(os.getenv("BAGATELLE_BENCH_SEED", "42"))
+OUTPUT_FILE = os.path.abspath(
+    os.getenv("BAGATELLE_BENCH_OUTPUT", os.path.join(ROOT_DIR, "data", "benchmarks", "latest.json")))
+BASELINE_FILE = os.getenv("BAGATELLE_BENCH_BASELINE")
+BASELINE_FILE = os.path.abspath(BASELINE_FILE) if BASELINE_FILE else None
+TOLERANCE = float(os.getenv("BAGATELLE_BENCH_TOLERANCE", "0.25"))
+
+K_VALUES = [3, 5, 10]
+WORKSHOP = {"num_days": 2, "theme": "Contagion and quarantine", "audience": "medical students"}
+
+# name: (endpoint, request body without the varying query parameters)
+SCENARIOS = {
+    "retrieve_image": ("/retrieve", {"weight": 0}),
+    "retrieve_hybrid": ("/retrieve", {"weight": 0.5}),
+    "retrieve_text": ("/retrieve", {"weight": 1}),
+    "retrieve_image_refine_claude": ("/retrieve", {"weight": 0, "llm": "claude-sonnet-4"}),
+    "retrieve_hybrid_refine_claude": ("/retrieve", {"weight": 0.5, "llm": "claude-sonnet-4"}),
+    "retrieve_text_refine_claude": ("/retrieve", {"weight": 1, "llm": "claude-sonnet-4"}),
+    "retrieve_image_refine_gpt5": ("/retrieve", {"weight": 0, "llm": "gpt-5"}),
+    "retrieve_hybrid_refine_gpt5": ("/retrieve", {"weight": 0.5, "llm": "gpt-5"}),
+    "retrieve_text_refine_gpt5": ("/retrieve", {"weight": 1, "llm": "gpt-5"}),
+    "program_images_claude": ("/generate_program", {"context_type": "images", "llm": "claude-sonnet-4"}),
+    "program_html_gpt5": ("/generate_program", {"context_type": "html", "llm": "gpt-5"}),
+}
+
+# The app reads its settings when imported and resolves data paths relative to the working directory
+os.chdir(ROOT_DIR)
+sys.path.insert(0, os.getcwd())
+
+import benchmark_fakes
+from src.catalog import get_catalog
+
+if TARGET:
+    import requests
+else:
+    for key, value in benchmark_fakes.environment(tempfile.mkdtemp(prefix="bagatelle-bench-"), CACHES).items():
+        os.environ.setdefault(key, value)
+    from app import app
+    from src.refinement import hedging_stats
+    from src.resilience import provider_stats
+
+    benchmark_fakes.install()
+
+catalog = get_catalog()
+# Realistic gallery queries: categories and artwork titles
+QUERIES = sorted({image["category"] for image in catalog.images}) + \
+          [" ".join(benchmark_fakes.words(image["name"])) for image in catalog.images[::10]]
+IMAGE_PATHS = [os.path.join("static", "data", "images", image["name"]) for image in catalog.images]
+HTML_PATHS = [os.path.join("static", "data", "html_gpt-5", image["link"]) for image in catalog.images
+              if os.path.isfile(os.path.join("static", "data", "html_gpt-5", image["link"]))]
+
+
+def request_body(endpoint, params, rng):
+    if endpoint == "/retrieve":
+        return {"question": rng.choice(QUERIES), "k": rng.choice(K_VALUES), **params}
+    paths = IMAGE_PATHS if params["context_type"] == "images" else HTML_PATHS
+    return {**WORKSHOP, "context": "\n".join(rng.sample(paths, rng.choice([3, 5]))), **params}
+
+
+def parse_server_timing(header):
+    """{stage: milliseconds} of a Server-Timing header, stages of several providers added up."""
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, *params = entry.split(";")
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                stages[name] = stages.get(name, 0.0) + float(value)
+    return stages
+
+
+_clients = threading.local()
+
+
+def get_client():
+    client = getattr(_clients, "client", None)
+    if client is None:
+        if TARGET:
+            client = _clients.client = requests.Session()
+            client.post(f"{TARGET}/login", json={"password": "show-demo"}, timeout=30).raise_for_status()
+        else:
+            client = _clients.client = app.test_client()
+            with client.session_transaction() as session:
+                session["logged_in"] = True
+    return client
+
+
+def send(endpoint, body):
+    started = time.perf_counter()
+    if TARGET:
+        try:
+            response = get_client().post(TARGET + endpoint, json=body, timeout=600)
+        except requests.RequestException:
+            return {"latency": time.perf_counter() - started, "ok": False, "stages": {}}
+        data = response.json() if response.headers.get("Content-Type") == "application/json" else {}
+    else:
+        response = get_client().post(endpoint, json=body)
+        data = response.get_json(silent=True) or {}
+    latency = time.perf_counter() - started
+    return {
+        "latency": latency,
+        "ok": response.status_code == 200 and "error" not in data,
+        "stages": parse_server_timing(response.headers.get("Server-Timing")),
+    }
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    return {f"p{p}": round(float(np.percentile(values, p)), 2) for p in (50, 95, 99)} | \
+        {"mean": round(float(np.mean(values)), 2), "max": round(float(np.max(values)), 2)}
+
+
+def run_scenario(name, endpoint, params):
+    rng = random.Random(f"{SEED}:{name}")
+    bodies = [request_body(endpoint, params, rng) for _ in range(WARMUP + REQUESTS)]
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        list(pool.map(lambda body: send(endpoint, body), bodies[:WARMUP]))
+        started = time.perf_counter()
+        results = list(pool.map(lambda body: send(endpoint, body), bodies[WARMUP:]))
+        elapsed = time.perf_counter() - started
+
+    stage_names = sorted({stage for result in results for stage in result["stages"]})
+    return {
+        "requests": len(results),
+        "errors": sum(not result["ok"] for result in results),
+        "throughput_rps": round(len(results) / elapsed, 2),
+        "latency_ms": percentiles([result["latency"] * 1000 for result in results]),
+        "stages_ms": {stage: percentiles([result["stages"][stage] for result in results if stage in result["stages"]])
+                      for stage in stage_names},
+    }
+
+
+def compare(results, baseline):
+    """Regressions of p95 latency and throughput beyond TOLERANCE against the baseline's scenarios."""
+    regressions = []
+    for name, result in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        p95, p95_before = result["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        if p95 > p95_before * (1 + TOLERANCE):
+            regressions.append(f"{name}: p95 {p95_before} ms -> {p95} ms")
+        rps, rps_before = result["throughput_rps"], before["throughput_rps"]
+        if rps < rps_before * (1 - TOLERANCE):
+            regressions.append(f"{name}: throughput {rps_before} -> {rps} requests/s")
+    return regressions
+
+
+results = {
+    "config": {"requests": REQUESTS, "concurrency": CONCURRENCY, "warmup": WARMUP, "caches": CACHES, "seed": SEED,
+               "target": TARGET or "in-process", "latency": benchmark_fakes.LATENCY,
+               "error_rate": benchmark_fakes.ERROR_RATE},
+    "scenarios": {},
+}
+for name, (endpoint, params) in SCENARIOS.items():
+    if ONLY and name not in ONLY:
+        continue
+    print(f"⏱️ {name}: {REQUESTS} requests at concurrency {CONCURRENCY}")
+    results["scenarios"][name] = run_scenario(name, endpoint, params)
+    scenario = results["scenarios"][name]
+    print(f"   {scenario['throughput_rps']} requests/s, latency {scenario['latency_ms']}, {scenario['errors']} errors")
+if TARGET:
+    # Counters of whichever worker answers
+    results["upstreams"] = get_client().get(f"{TARGET}/status/upstreams", timeout=30).json()
+else:
+    results["upstreams"] = provider_stats()
+    results["hedging"] = hedging_stats()
+
+os.makedirs(os.path.dirname(OUTPUT_FILE) or ".", exist_ok=True)
+with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+    json.dump(results, f, indent=2)
+print(f"✅ Results written to {OUTPUT_FILE}")
+
+if BASELINE_FILE:
+    with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+        regressions = compare(results, json.load(f))
+    if regressions:
+        print(f"❌ Performance regressions against {BASELINE_FILE} (tolerance {TOLERANCE:.0%}):")
+        for regression in regressions:
+            print("   " + regression)
+        sys.exit(1)
+    print(f"✅ No regressions against {BASELINE_FILE}")
@@ -0,0 +1,61 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = os.path.join("static", "data", "file_list_html.csv")
+
+
+class Catalog:
+    """Gallery entries parsed once; version is the content hash of the CSV and changes with it."""
+
+    def __init__(self, images, version, stamp):
+        self.images = images
+        self.version = version
+        self.stamp = stamp
+        self.categories = {}
+        for image in images:
+            self.categories[image["category"]] = self.categories.get(image["category"], 0) + 1
+        self.categories = dict(sorted(self.categories.items()))
+
+    @classmethod
+    def load(cls, file_name):
+        st = os.stat(file_name)
+        with open(file_name, "rb") as f:
+            content = f.read()
+        images = []
+        reader = csv.reader(io.StringIO(content.decode("utf-8")), delimiter=",")
+        next(reader, None)
+        for row in reader:
+            images.append({"name": row[0], "category": row[1], "link": row[2]})
+        logger.info(f"📚 Loaded catalog with {len(images)} images")
+        return cls(images, hashlib.sha256(content).hexdigest()[:16], (st.st_size, st.st_mtime_ns))
+
+    def filter(self, categories=None):
+        if not categories:
+            return self.images
+        return [image for image in self.images if image["category"] in categories]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(file_name=CATALOG_FILE):
+    """The process-wide catalog, reloaded when the CSV file changes on disk."""
+    global _catalog
+    st = os.stat(file_name)
+    stamp = (st.st_size, st.st_mtime_ns)
+    catalog = _catalog
+    if catalog is None or catalog.stamp != stamp:
+        with _catalog_lock:
+            if _catalog is None or _catalog.stamp != stamp:
+                _catalog = Catalog.load(file_name)
+            catalog = _catalog
+    return catalog
+
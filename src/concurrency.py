@@ -0,0 +1,48 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.profiler import profiled_thread
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name, max_workers):
+    """
+    Named thread pool owned by the current process.
+    Pools are created lazily and re-created after fork: threads do not survive fork, and a pool inherited
+    from a preloading gunicorn master would never run its queued work.
+    """
+    key = (name, os.getpid())
+    executor = _executors.get(key)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(key)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"bagatelle-{name}")
+                _executors[key] = executor
+    return executor
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    Submit fn with a copy of the caller's context variables, which carry Flask's current_app,
+    and the profile of the caller's request if it is being profiled.
+    """
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, _run_profiled, fn, *args, **kwargs)
+
+
+def _run_profiled(fn, *args, **kwargs):
+    with profiled_thread():
+        return fn(*args, **kwargs)
+
+
+def _reset_after_fork():
+    global _executors_lock
+    _executors.clear()
+    _executors_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,8 +1,21 @@
-from bs4 import BeautifulSoup
 import os
 import re, base64
+import threading
+from collections import OrderedDict
 from flask import current_app
 import mimetypes
+from src.html_text_store import get_html_text_store
+from src.metrics import timed
+
+# Downscaled copies of the gallery images produced by scripts/generate_llm_images.py, named <original file>.jpg.
+# A relative BAGATELLE_LLM_IMAGES_DIR is taken from the repository root, by the script as well
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LLM_IMAGES_DIR = os.path.join(
+    ROOT_DIR, os.getenv("BAGATELLE_LLM_IMAGES_DIR", os.path.join("static", "data", "images_llm")))
+LLM_IMAGE_CACHE_SIZE = int(os.getenv("BAGATELLE_LLM_IMAGE_CACHE_SIZE", "128"))
+
+_llm_images = OrderedDict()
+_llm_images_lock = threading.Lock()
 
 def encode_image(path):
     with open(path, "rb") as f:
@@ -18,6 +31,40 @@ def encode_image_with_type(path):
     return {"data": b64data, "type": mime_type}
 
 
+def get_llm_image_path(path):
+    """Path of the provider-sized variant of an image, or the image itself if no up-to-date variant exists."""
+    variant = os.path.join(LLM_IMAGES_DIR, os.path.basename(path) + ".jpg")
+    try:
+        if os.path.getmtime(variant) >= os.path.getmtime(path):
+            return variant
+    except OSError:
+        pass
+    return path
+
+
+@timed("image_encoding")
+def encode_llm_image(path):
+    """
+    Base64 payload for sending an image to an LLM: the downscaled variant when available,
+    kept in a bounded in-memory cache keyed on the file's size and mtime.
+    """
+    source = get_llm_image_path(path)
+    st = os.stat(source)
+    key = (source, st.st_size, st.st_mtime_ns)
+    with _llm_images_lock:
+        encoded = _llm_images.get(key)
+        if encoded is not None:
+            _llm_images.move_to_end(key)
+            return encoded
+
+    encoded = encode_image_with_type(source)
+    with _llm_images_lock:
+        _llm_images[key] = encoded
+        while len(_llm_images) > LLM_IMAGE_CACHE_SIZE:
+            _llm_images.popitem(last=False)
+    return encoded
+
+
 def get_full_paths(context_paths: str):
     root_dir = current_app.root_path
     file_paths = []
@@ -42,8 +89,10 @@ def get_full_paths(context_paths: str):
     return file_paths
 
 
+@timed("html_extraction")
 def get_html_content(html_paths: str):
     full_paths = get_full_paths(html_paths)
+    store = get_html_text_store(current_app.root_path)
     extracted_pages = []
 
     for path in full_paths:
@@ -51,17 +100,6 @@ def get_html_content(html_paths: str):
             print(f"⚠️ File not found: {path}")
             continue
 
-        with open(path, "r", encoding="utf-8", errors="replace") as f:
-            html = f.read()
-
-        soup = BeautifulSoup(html, "html.parser")
-
-        # Remove unwanted elements such as scripts/styles/nav/footers
-        for tag in soup(["script", "style", "nav", "footer", "header"]):
-            tag.decompose()
-
-        text = soup.get_text(separator=" ", strip=True)
-
-        extracted_pages.append(text)
+        extracted_pages.append(store.get(path)["text"])
 
     return extracted_pages
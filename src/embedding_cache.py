@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+import time
+import logging
+from array import array
+from collections import OrderedDict
+from src.sqlite_store import SQLiteStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    """CLIP's tokenizer lowercases and ignores extra whitespace, so such variants share an embedding."""
+    return " ".join((text or "").split()).lower()
+
+
+class EmbeddingCache:
+    """
+    Bounded in-memory LRU of query embeddings with an optional SQLite store behind it,
+    which all gunicorn workers on a host can share.
+    """
+
+    def __init__(self, max_size=1024, db_path=None):
+        self.max_size = max_size
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._store = SQLiteStore(db_path, [
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, embedding BLOB NOT NULL, created REAL NOT NULL)"
+        ]) if db_path else None
+
+    def _remember(self, key, embedding):
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key, count=True):
+        """The cached embedding or None; count=False leaves the hit and miss counters alone, for a second look."""
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += count
+                return embedding
+
+        if self._store is not None:
+            try:
+                row = self._store.execute(
+                    "SELECT embedding FROM embeddings WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Embedding cache read failed: {e}")
+                row = None
+            if row is not None:
+                embedding = array("f", row[0]).tolist()
+                self._remember(key, embedding)
+                with self._lock:
+                    self.disk_hits += count
+                return embedding
+
+        with self._lock:
+            self.misses += count
+        return None
+
+    def put(self, key, embedding):
+        embedding = list(embedding)
+        self._remember(key, embedding)
+        if self._store is not None:
+            try:
+                self._store.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, embedding, created) VALUES (?, ?, ?)",
+                    (key, array("f", embedding).tobytes(), time.time()))
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Embedding cache write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "persistent": bool(self.db_path),
+            }
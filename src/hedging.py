@@ -0,0 +1,76 @@
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from src.concurrency import submit
+
+
+class LatencyTracker:
+    """Durations of the most recent successful calls, for percentile-based hedging delays."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p, min_samples=20):
+        """The p-th percentile (0-100) of the recorded durations, None until min_samples were recorded."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        index = min(len(samples) - 1, max(0, round(p / 100 * len(samples)) - 1))
+        return samples[index]
+
+
+class HedgeStats:
+    def __init__(self):
+        self.counters = {
+            # calls made, calls where the backup was started, wins per side, calls where neither was valid
+            "calls": 0, "hedged": 0, "primary_wins": 0, "backup_wins": 0, "failed": 0,
+            # backup calls that were started but lost: their cost bought nothing
+            "wasted_backups": 0,
+            # images sent to the backup provider, the added cost of hedging
+            "backup_images": 0,
+        }
+        self._lock = threading.Lock()
+
+    def add(self, **increments):
+        with self._lock:
+            for counter, increment in increments.items():
+                self.counters[counter] += increment
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+def hedged_call(executor, primary, backup, delay, is_valid):
+    """
+    Run primary(); if it has no valid result after delay seconds (or fails sooner), also run backup().
+    The first valid result wins. A loser still queued is cancelled; one already running cannot be interrupted,
+    its result is discarded. Returns (result, winner, hedged) with winner "primary", "backup" or None.
+    """
+    futures = {submit(executor, primary): "primary"}
+    pending = set(futures)
+    hedged = False
+    while pending:
+        done, pending = wait(pending, timeout=None if hedged else delay, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"⚠️ {futures[future]} call failed: {e}")
+                continue
+            if is_valid(result):
+                for other in pending:
+                    other.cancel()
+                return result, futures[future], hedged
+        if not hedged:
+            hedged = True
+            future = submit(executor, backup)
+            futures[future] = "backup"
+            pending.add(future)
+    return None, None, hedged
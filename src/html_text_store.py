@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import logging
+from src.sqlite_store import SQLiteStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Plain text of the HTML write-ups, extracted once by scripts/extract_html_text.py (or on first use) and
+# re-extracted only when a page's content changes. Relative paths are resolved against the app root.
+HTML_TEXT_DB = os.getenv("BAGATELLE_HTML_TEXT_DB", os.path.join("data", "cache", "html_text.sqlite"))
+
+# Never appears in the write-ups; marks section starts (with the index of their <h2>) while the page is
+# flattened to text
+_SECTION_MARKER = "␞SECTION{}␞"
+_SECTION_PATTERN = re.compile(r"␞SECTION(\d+)␞")
+# Stored with the content hash; bumped when extract_html_page changes, so pages kept by an older version are
+# extracted again
+_EXTRACT_VERSION = "2"
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def extract_html_page(html):
+    """
+    Flatten an HTML write-up to the text sent to the LLMs, with the character offsets of its <h2> sections.
+    token_count is an estimate (words and punctuation marks), good enough for context budgeting.
+    """
+    # Only needed for pages missing from the store
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+
+    # Remove unwanted elements such as scripts/styles/nav/footers
+    for tag in soup(["script", "style", "nav", "footer", "header"]):
+        tag.decompose()
+
+    titles = []
+    for h2 in soup.find_all("h2"):
+        h2.insert_before(soup.new_string(_SECTION_MARKER.format(len(titles))))
+        titles.append(h2.get_text(" ", strip=True))
+    raw = soup.get_text(separator=" ", strip=True)
+
+    # split() alternates the pieces with the <h2> index of the marker before them: the text before the first
+    # section, then (index, section text) pairs. Joining the non-empty pieces with single spaces reproduces
+    # get_text() of the page without markers
+    pieces = _SECTION_PATTERN.split(raw)
+    parts, sections, offset = [], [], 0
+    for i, piece in enumerate(pieces[::2]):
+        piece = piece.strip()
+        if not piece:
+            continue
+        if parts:
+            offset += 1
+        if i > 0:
+            sections.append({"start": offset, "end": offset + len(piece), "title": titles[int(pieces[2 * i - 1])]})
+        parts.append(piece)
+        offset += len(piece)
+    text = " ".join(parts)
+    return {"text": text, "sections": sections, "token_count": len(_TOKEN_PATTERN.findall(text))}
+
+
+class HtmlTextStore:
+    def __init__(self, db_path, root_dir):
+        self.root_dir = root_dir
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(root_dir, db_path)
+        self._store = SQLiteStore(db_path, [
+            "CREATE TABLE IF NOT EXISTS pages (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL, text TEXT NOT NULL, sections TEXT NOT NULL, "
+            "token_count INTEGER NOT NULL)"
+        ])
+        # Pages already validated by this process, keyed on relative path
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.root_dir)).replace("\\", "/")
+
+    def get(self, path):
+        """Text, sections and token count of the page at path; stale or missing entries are re-extracted."""
+        key = self._key(path)
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._pages.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        row = None
+        try:
+            row = self._store.execute(
+                "SELECT size, mtime_ns, sha256, text, sections, token_count FROM pages WHERE path = ?",
+                (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ HTML text store read failed: {e}")
+
+        if row is not None and (row[0], row[1]) == stamp and _is_current(row[2]):
+            page = {"text": row[3], "sections": json.loads(row[4]), "token_count": row[5]}
+        else:
+            with open(path, "rb") as f:
+                content = f.read()
+            content_hash = f"{_EXTRACT_VERSION}:{hashlib.sha256(content).hexdigest()}"
+            # A touched but unchanged file only needs its stamp refreshed
+            if row is not None and row[2] == content_hash:
+                page = {"text": row[3], "sections": json.loads(row[4]), "token_count": row[5]}
+            else:
+                # Same newline handling as reading the file in text mode
+                html = content.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+                page = extract_html_page(html)
+            self._save(key, stamp, content_hash, page)
+
+        with self._lock:
+            self._pages[key] = (stamp, page)
+        return page
+
+    def preload(self):
+        """Read every stored page that is still current into memory; returns how many were loaded."""
+        try:
+            rows = self._store.execute(
+                "SELECT path, size, mtime_ns, sha256, text, sections, token_count FROM pages").fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ HTML text store read failed: {e}")
+            return 0
+        pages = {}
+        for key, size, mtime_ns, content_hash, text, sections, token_count in rows:
+            if not _is_current(content_hash):
+                continue
+            try:
+                st = os.stat(os.path.join(self.root_dir, key))
+            except OSError:
+                continue
+            if (st.st_size, st.st_mtime_ns) == (size, mtime_ns):
+                pages[key] = ((size, mtime_ns), {"text": text, "sections": json.loads(sections),
+                                                 "token_count": token_count})
+        with self._lock:
+            self._pages.update(pages)
+        return len(pages)
+
+    def _save(self, key, stamp, content_hash, page):
+        try:
+            self._store.execute(
+                "INSERT OR REPLACE INTO pages (path, size, mtime_ns, sha256, text, sections, token_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, stamp[0], stamp[1], content_hash, page["text"], json.dumps(page["sections"]),
+                 page["token_count"]))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ HTML text store write failed: {e}")
+
+
+def _is_current(content_hash):
+    return content_hash.startswith(_EXTRACT_VERSION + ":")
+
+
+def get_html_text_store(root_dir):
+    store = _stores.get(root_dir)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(root_dir)
+            if store is None:
+                store = HtmlTextStore(HTML_TEXT_DB, root_dir)
+                _stores[root_dir] = store
+    return store
@@ -0,0 +1,207 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from src.concurrency import get_executor
+from src.sqlite_store import SQLiteStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Background jobs for the LLM-heavy requests: the request returns a job id at once, a bounded pool per worker
+# process runs the job and the result lands in a SQLite file shared by all workers, so any of them can answer
+# the polls. No broker involved.
+JOBS_DB = os.getenv("BAGATELLE_JOBS_DB", os.path.join("data", "cache", "jobs.sqlite"))
+JOB_WORKERS = int(os.getenv("BAGATELLE_JOB_WORKERS", "4"))
+# Finished jobs are kept this long for the client to collect
+JOB_TTL = int(os.getenv("BAGATELLE_JOB_TTL", "3600"))
+# Jobs still queued or running after this long are given up (e.g. their worker process was restarted)
+JOB_TIMEOUT = int(os.getenv("BAGATELLE_JOB_TIMEOUT", "600"))
+JOBS_PER_SESSION = int(os.getenv("BAGATELLE_JOBS_PER_SESSION", "2"))
+# Minimum interval between progress writes of a running job
+PROGRESS_INTERVAL = 0.5
+# Seconds a client is asked to wait (Retry-After) when the jobs database stayed locked past SQLite's busy timeout
+BUSY_RETRY_AFTER = 5
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+ACTIVE = (QUEUED, RUNNING)
+
+_current_job = contextvars.ContextVar("bagatelle_current_job", default=None)
+
+
+class JobLimitError(Exception):
+    pass
+
+
+class JobQueueBusyError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, db_path, max_workers, ttl, timeout, per_session):
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.timeout = timeout
+        self.per_session = per_session
+        self._store = SQLiteStore(db_path, [
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, session TEXT NOT NULL, kind TEXT NOT NULL, "
+            "status TEXT NOT NULL, progress TEXT, result TEXT, error TEXT, created REAL NOT NULL, "
+            "updated REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session, status)",
+        ])
+        # Futures of the jobs queued in this process, to drop cancelled ones before they start
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, kind, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) and return the job id; its return value must be JSON-serializable.
+        Raises JobLimitError when the session already has its maximum of unfinished jobs, JobQueueBusyError when
+        other workers kept the database locked for too long.
+        """
+        self.expire()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._store.connection()
+        # The check and the insert must not interleave with another worker's
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            raise JobQueueBusyError("The job queue is busy, try again shortly") from e
+        try:
+            active = conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE session = ? AND status IN ({','.join('?' * len(ACTIVE))})",
+                (session_id, *ACTIVE)).fetchone()[0]
+            if active >= self.per_session:
+                raise JobLimitError(f"At most {self.per_session} jobs may run at a time")
+            conn.execute("INSERT INTO jobs (id, session, kind, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                         (job_id, session_id, kind, QUEUED, now, now))
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            conn.execute("ROLLBACK")
+            raise JobQueueBusyError("The job queue is busy, try again shortly") from e
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        future = get_executor("jobs", self.max_workers).submit(self._run, job_id, fn, args, kwargs)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._forget(job_id))
+        logger.info(f"🧾 Queued {kind} job {job_id}")
+        return job_id
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _run(self, job_id, fn, args, kwargs):
+        if not self._transition(job_id, QUEUED, RUNNING):
+            return
+        token = _current_job.set((self, job_id))
+        try:
+            result = fn(*args, **kwargs)
+            self._finish(job_id, DONE, result=json.dumps(result))
+        except JobCancelled:
+            logger.info(f"🧾 Job {job_id} cancelled")
+        except Exception as e:
+            logger.warning(f"⚠️ Job {job_id} failed: {e}")
+            self._finish(job_id, FAILED, error=str(e))
+        finally:
+            _current_job.reset(token)
+
+    def _transition(self, job_id, from_status, to_status):
+        cursor = self._store.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?",
+                                     (to_status, time.time(), job_id, from_status))
+        return cursor.rowcount == 1
+
+    def _finish(self, job_id, status, result=None, error=None):
+        # A job cancelled meanwhile stays cancelled
+        self._store.execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? "
+                            "WHERE id = ? AND status = ?", (status, result, error, time.time(), job_id, RUNNING))
+
+    def get(self, job_id, session_id):
+        """The job as a dict, or None if it does not exist or belongs to another session."""
+        row = self._store.execute(
+            "SELECT id, kind, status, progress, result, error, created, updated FROM jobs "
+            "WHERE id = ? AND session = ?", (job_id, session_id)).fetchone()
+        if row is None:
+            return None
+        job = {"id": row[0], "kind": row[1], "status": row[2], "created": row[6], "updated": row[7]}
+        if row[3] is not None and row[2] in ACTIVE:
+            job["progress"] = json.loads(row[3])
+        if row[4] is not None:
+            job["result"] = json.loads(row[4])
+        if row[5] is not None:
+            job["error"] = row[5]
+        return job
+
+    def cancel(self, job_id, session_id):
+        """Cancel an unfinished job; running jobs stop at their next check_cancelled(). False if not found."""
+        cursor = self._store.execute(
+            f"UPDATE jobs SET status = ?, progress = NULL, updated = ? WHERE id = ? AND session = ? "
+            f"AND status IN ({','.join('?' * len(ACTIVE))})", (CANCELLED, time.time(), job_id, session_id, *ACTIVE))
+        if cursor.rowcount == 0:
+            return self.get(job_id, session_id) is not None
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.cancel()
+        return True
+
+    def is_cancelled(self, job_id):
+        row = self._store.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is None or row[0] == CANCELLED
+
+    def set_progress(self, job_id, progress):
+        self._store.execute("UPDATE jobs SET progress = ?, updated = ? WHERE id = ? AND status = ?",
+                            (json.dumps(progress), time.time(), job_id, RUNNING))
+
+    def expire(self):
+        """Drop finished jobs after the TTL and fail the ones that outlived the timeout."""
+        now = time.time()
+        try:
+            self._store.execute(
+                f"UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status IN "
+                f"({','.join('?' * len(ACTIVE))}) AND created < ?",
+                (FAILED, "Job expired", now, *ACTIVE, now - self.timeout))
+            self._store.execute(
+                f"DELETE FROM jobs WHERE status NOT IN ({','.join('?' * len(ACTIVE))}) AND updated < ?",
+                (*ACTIVE, now - self.ttl))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Job expiry failed: {e}")
+
+
+def check_cancelled():
+    """Raise JobCancelled if the job running in this context was cancelled; no-op outside jobs."""
+    current = _current_job.get()
+    if current is not None and current[0].is_cancelled(current[1]):
+        raise JobCancelled()
+
+
+class ProgressReporter:
+    """Writes the progress of the job running in this context, at most every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self):
+        self._job = _current_job.get()
+        self._last = 0
+
+    def report(self, progress, force=False):
+        if self._job is None:
+            return
+        now = time.monotonic()
+        if force or now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            self._job[0].set_progress(self._job[1], progress)
+            check_cancelled()
+
+
+job_queue = JobQueue(JOBS_DB, JOB_WORKERS, JOB_TTL, JOB_TIMEOUT, JOBS_PER_SESSION)
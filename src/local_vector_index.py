@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import logging
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Exported collections live next to each other as <collection>.npy (float32 vectors, one row per point,
+# L2-normalized) and <collection>.json (vector name, point ids and payloads in row order).
+# A relative BAGATELLE_INDEX_DIR is taken from the repository root, whichever directory reads or writes the index
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_DIR = os.path.join(ROOT_DIR, os.getenv("BAGATELLE_INDEX_DIR", os.path.join("data", "index")))
+
+_collections = {}
+_collections_lock = threading.Lock()
+
+
+class LocalScoredPoint:
+    """Search hit with the same attributes the query helpers read from Qdrant's ScoredPoint."""
+    __slots__ = ("id", "score", "payload")
+
+    def __init__(self, point_id, score, payload):
+        self.id = point_id
+        self.score = score
+        self.payload = payload
+
+    def __repr__(self):
+        return f"LocalScoredPoint(id={self.id!r}, score={self.score:.4f})"
+
+
+class LocalCollection:
+    def __init__(self, name, vector_name, vectors, ids, payloads):
+        if len(vectors) != len(ids) or len(ids) != len(payloads):
+            raise RuntimeError(f"Local index '{name}' is inconsistent: "
+                               f"{len(vectors)} vectors, {len(ids)} ids, {len(payloads)} payloads")
+        self.name = name
+        self.vector_name = vector_name
+        self.vectors = vectors
+        self.ids = ids
+        self.payloads = payloads
+
+    @classmethod
+    def load(cls, name, index_dir=INDEX_DIR):
+        vectors_path, meta_path = _collection_paths(index_dir, name)
+        if not (os.path.isfile(vectors_path) and os.path.isfile(meta_path)):
+            raise RuntimeError(
+                f"Local index for '{name}' not found in {index_dir}. "
+                "Run scripts/export_local_index.py or switch BAGATELLE_VECTOR_BACKEND back to 'qdrant'."
+            )
+        # Read-only memory map: pages come from the OS page cache, so all gunicorn workers share one copy
+        vectors = np.load(vectors_path, mmap_mode="r")
+        with open(meta_path, "r", encoding="utf8") as f:
+            meta = json.load(f)
+        logger.info(f"📂 Loaded local index '{name}': {vectors.shape[0]} x {vectors.shape[1]}")
+        return cls(name, meta.get("vector_name"), vectors, meta["ids"], meta["payloads"])
+
+    def search(self, query_vector, limit, with_payload=None):
+        """
+        Exact cosine top-k over the whole collection.
+        Stored rows are normalized at export time, so cosine similarity is a single matrix-vector product.
+        """
+        if limit <= 0 or len(self.ids) == 0:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm > 0:
+            q = q / norm
+        scores = self.vectors @ q
+
+        k = min(limit, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        results = []
+        for i in top:
+            payload = self.payloads[i]
+            if with_payload is not None and with_payload is not True:
+                payload = {key: payload[key] for key in with_payload if key in payload}
+            results.append(LocalScoredPoint(self.ids[i], float(scores[i]), payload))
+        return results
+
+
+def has_local_collection(name, index_dir=INDEX_DIR):
+    return all(os.path.isfile(path) for path in _collection_paths(index_dir, name))
+
+
+def _collection_paths(index_dir, name):
+    return os.path.join(index_dir, name + ".npy"), os.path.join(index_dir, name + ".json")
+
+
+def get_local_collection(name):
+    collection = _collections.get(name)
+    if collection is None:
+        with _collections_lock:
+            collection = _collections.get(name)
+            if collection is None:
+                collection = LocalCollection.load(name)
+                _collections[name] = collection
+    return collection
+
+
+def write_local_collection(name, vector_name, ids, vectors, payloads, index_dir=INDEX_DIR):
+    """
+    Persist a collection in the local index format.
+    Files are written under temporary names and swapped in atomically, so running workers keep their
+    current mapping until they are restarted.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    vectors_path, meta_path = _collection_paths(index_dir, name)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+
+    tmp_vectors_path = vectors_path + ".tmp.npy"
+    tmp_meta_path = meta_path + ".tmp"
+    np.save(tmp_vectors_path, matrix)
+    with open(tmp_meta_path, "w", encoding="utf8") as f:
+        json.dump({"collection": name, "vector_name": vector_name, "ids": list(ids), "payloads": list(payloads)},
+                  f, ensure_ascii=False)
+    os.replace(tmp_vectors_path, vectors_path)
+    os.replace(tmp_meta_path, meta_path)
+    return vectors_path, meta_path
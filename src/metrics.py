@@ -0,0 +1,118 @@
+import contextlib
+import contextvars
+import functools
+import os
+import time
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess)
+
+# Set (by gunicorn.conf.py) before prometheus_client is imported: every worker then writes its samples to files
+# in this directory and /metrics aggregates them over all workers
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# From cached lookups (milliseconds) to LLM calls (up to the request and job budgets)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 90, 120, 180, 300)
+
+STAGE_SECONDS = Histogram(
+    "bagatelle_stage_seconds", "Duration of a pipeline stage", ["stage", "provider"], buckets=LATENCY_BUCKETS)
+STAGE_ERRORS = Counter("bagatelle_stage_errors_total", "Pipeline stages that raised", ["stage", "provider"])
+REQUEST_SECONDS = Histogram(
+    "bagatelle_request_seconds", "Duration of HTTP requests until the response (not its streamed body) is ready",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS)
+CACHE_LOOKUPS = Counter("bagatelle_cache_lookups_total", "Cache lookups by result (hit or miss)", ["cache", "result"])
+LLM_TOKENS = Counter(
+    "bagatelle_llm_tokens_total",
+    "LLM tokens by kind: input (every prompt token), cached_input (read from the prompt cache), cache_write, output",
+    ["provider", "model", "kind"])
+UPSTREAM_CALLS = Counter(
+    "bagatelle_upstream_calls_total", "Upstream call outcomes: calls, successes, failures, retries, rejected",
+    ["provider", "outcome"])
+
+# Spans of the current request, for its Server-Timing header; shared with the threads it submits work to
+_spans = contextvars.ContextVar("bagatelle_spans", default=None)
+
+
+@contextlib.contextmanager
+def span(stage, provider=""):
+    """Time the enclosed block as a pipeline stage; provider names the service doing the work, if any."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage, provider).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage, provider).observe(elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, provider, elapsed))
+
+
+def timed(stage, provider=""):
+    """Decorator timing every call of the function as a span."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, provider):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def start_spans():
+    """Collect the spans of the current context from now on; returns the token for reset_spans()."""
+    return _spans.set([])
+
+
+def reset_spans(token):
+    _spans.reset(token)
+
+
+def span_totals():
+    """Seconds spent so far per (stage, provider) in the spans of the current context."""
+    totals = {}
+    for stage, provider, elapsed in list(_spans.get() or []):
+        totals[(stage, provider)] = totals.get((stage, provider), 0) + elapsed
+    return totals
+
+
+def server_timing():
+    """Server-Timing header value of the spans collected so far."""
+    return ", ".join(
+        f'{stage};dur={elapsed * 1000:.1f}' + (f';desc="{provider}"' if provider else "")
+        for (stage, provider), elapsed in span_totals().items())
+
+
+def observe_request(endpoint, method, status, seconds):
+    REQUEST_SECONDS.labels(endpoint or "unmatched", method, str(status)).observe(seconds)
+
+
+def count_cache(cache, hits=0, misses=0):
+    if hits:
+        CACHE_LOOKUPS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, "miss").inc(misses)
+
+
+def count_tokens(provider, model, **tokens):
+    for kind, count in tokens.items():
+        if count:
+            LLM_TOKENS.labels(provider, model, kind).inc(count)
+
+
+def count_upstream_call(provider, outcome):
+    UPSTREAM_CALLS.labels(provider, outcome).inc()
+
+
+def render_metrics():
+    """Exposition of all metrics, aggregated over the gunicorn workers in multiprocess mode."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
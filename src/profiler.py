@@ -0,0 +1,233 @@
+import contextlib
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Sampling profiles of single requests, written as speedscope files (open them at https://www.speedscope.app).
+# Opt-in: profiles reveal the server's source paths to anyone holding the shared login
+PROFILING_ENABLED = os.getenv("BAGATELLE_PROFILING", "0").strip().lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("BAGATELLE_PROFILE_DIR", os.path.join("data", "profiles"))
+# Seconds between samples; every sample walks the stacks of the request's threads only
+PROFILE_INTERVAL = float(os.getenv("BAGATELLE_PROFILE_INTERVAL", "0.005"))
+# Most recent profiles kept on disk, older ones are deleted
+PROFILE_KEEP = int(os.getenv("BAGATELLE_PROFILE_KEEP", "50"))
+# Profiles running at the same time per process; further requests are served unprofiled
+MAX_ACTIVE_PROFILES = int(os.getenv("BAGATELLE_PROFILE_MAX_ACTIVE", "2"))
+# Sampling stops after this long, e.g. for a stream the client never finished reading
+PROFILE_MAX_SECONDS = 300
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{12}$")
+
+_active = contextvars.ContextVar("bagatelle_profiler", default=None)
+_running = 0
+_running_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of a set of threads from a background thread. Threads join while they work for the
+    profiled request (the request thread, and pool threads through src.concurrency.submit) and leave afterwards.
+    """
+
+    def __init__(self, profile_id, name, interval=PROFILE_INTERVAL):
+        self.profile_id = profile_id
+        self.name = name
+        self.interval = interval
+        self._threads = {}
+        self._thread_names = {}
+        self._frames = {}
+        # Per thread: sampled stacks (lists of frame indices, outermost first) and the time each one stands for
+        self._samples = {}
+        self._weights = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"bagatelle-profiler-{profile_id}", daemon=True)
+        self.request_thread = None
+        self.started = None
+        self.duration = None
+
+    def add_thread(self, ident, name):
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+            self._thread_names.setdefault(ident, name)
+
+    def remove_thread(self, ident):
+        with self._lock:
+            self._threads[ident] -= 1
+            if not self._threads[ident]:
+                del self._threads[ident]
+
+    def start(self):
+        self.request_thread = threading.get_ident()
+        self.add_thread(self.request_thread, threading.current_thread().name)
+        self.started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(now - last)
+            last = now
+            if now - self.started > PROFILE_MAX_SECONDS:
+                break
+
+    def _sample(self, weight):
+        frames = sys._current_frames()
+        with self._lock:
+            idents = list(self._threads)
+        for ident in idents:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(self._frame_index(code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self._samples.setdefault(ident, []).append(stack)
+                self._weights.setdefault(ident, []).append(weight)
+
+    def _frame_index(self, name, file, line):
+        key = (name, file, line)
+        index = self._frames.get(key)
+        if index is None:
+            index = self._frames[key] = len(self._frames)
+        return index
+
+    def to_speedscope(self):
+        """The samples in speedscope's file format, one sampled profile per thread."""
+        profiles = []
+        # The thread that started the profile first
+        for ident in sorted(self._samples, key=lambda ident: ident != self.request_thread):
+            samples = self._samples[ident]
+            weights = self._weights[ident]
+            profiles.append({
+                "type": "sampled",
+                "name": self._thread_names[ident],
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            })
+        frames = sorted(self._frames.items(), key=lambda item: item[1])
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": f"{self.name} ({self.profile_id}, {self.duration:.3f}s)",
+            "activeProfileIndex": 0,
+            "exporter": "bagatelle",
+            "shared": {"frames": [{"name": name, "file": file, "line": line} for (name, file, line), _ in frames]},
+            "profiles": profiles,
+        }
+
+
+def start_profile(profile_id, name):
+    """Start profiling the current thread and context; None if too many profiles are already running."""
+    global _running
+    with _running_lock:
+        if _running >= MAX_ACTIVE_PROFILES:
+            return None
+        _running += 1
+    profiler = SamplingProfiler(profile_id, name)
+    profiler.start()
+    _active.set(profiler)
+    return profiler
+
+
+def clear_profile():
+    """Keep work of the current context out of any profile it inherited."""
+    _active.set(None)
+
+
+def finish_profile(profiler):
+    """Stop sampling and write the profile; returns the file path."""
+    global _running
+    try:
+        profiler.stop()
+        return write_profile(profiler)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not write profile {profiler.profile_id}: {e}")
+    finally:
+        with _running_lock:
+            _running -= 1
+
+
+@contextlib.contextmanager
+def profiled_thread():
+    """Sample the current thread as part of the profile of the context it works for, if any."""
+    profiler = _active.get()
+    if profiler is None:
+        yield
+        return
+    ident = threading.get_ident()
+    profiler.add_thread(ident, threading.current_thread().name)
+    try:
+        yield
+    finally:
+        profiler.remove_thread(ident)
+
+
+def profile_path(profile_id, profile_dir=PROFILE_DIR):
+    """Path of a kept profile, None if there is none with that id."""
+    if not PROFILE_ID_PATTERN.match(profile_id or ""):
+        return None
+    try:
+        for entry in os.scandir(profile_dir):
+            if entry.name.endswith(f"-{profile_id}.speedscope.json"):
+                return entry.path
+    except OSError:
+        pass
+    return None
+
+
+def list_profiles(profile_dir=PROFILE_DIR):
+    """Kept profiles, newest first."""
+    try:
+        names = sorted((entry.name for entry in os.scandir(profile_dir) if entry.name.endswith(".speedscope.json")),
+                       reverse=True)
+    except OSError:
+        return []
+    return [{"id": name.split("-")[-1].split(".")[0], "file": name} for name in names]
+
+
+def write_profile(profiler, profile_dir=PROFILE_DIR):
+    os.makedirs(profile_dir, exist_ok=True)
+    # Timestamp first, so names sort by age
+    label = re.sub(r"[^a-z0-9_]+", "_", profiler.name.lower()).strip("_") or "request"
+    name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{label}-{profiler.profile_id}.speedscope.json"
+    path = os.path.join(profile_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiler.to_speedscope(), f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    logger.info(f"🔬 Profile of {profiler.name} written to {path}")
+    for old in list_profiles(profile_dir)[PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(profile_dir, old["file"]))
+        except OSError:
+            pass
+    return path
+
+
+def _reset_after_fork():
+    global _running, _running_lock
+    _running = 0
+    _running_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
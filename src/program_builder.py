@@ -0,0 +1,58 @@
+from api.openai_client import ask_openai_llm, ask_openai_llm_html, stream_openai_llm, stream_openai_llm_html
+from api.anthropic_client import (
+    ask_anthropic_llm, ask_anthropic_llm_html, stream_anthropic_llm, stream_anthropic_llm_html)
+from api.fake_llm_client import FAKE_LLM, ask_fake_llm, stream_fake_llm
+
+PROGRAM_PROMPT_TEMPLATE = """
+Using only the selected set of artworks as educational and illustrative material, create a nicely formatted 500-word programme 
+for {NUM_DAYS}-day workshop on art in medicine with the theme “{THEME}” aimed at {AUDIENCE}. 
+"""
+
+PROGRAM_INSTRUCTIONS = """
+The cross-cutting topics discussed in this workshop should prioritize commonalities between the artists who created these 
+works as well as the overlap in medical/historical/artistic aspects of their artifacts. Before you describe the workshop 
+programme in any detail, first provide a 100-word introduction that explains why the chosen theme of the art-in-medicine 
+workshop is relevant to the type of audience the workshop is aimed at, and why the selected artworks provide very apt 
+and fitting case-studies for the theme of the workshop. Create a programme that is focused on the chosen theme, in the 
+style of an academic syllabus, introducing each day with a short overview and set of learning objectives, and specifying 
+the educational goals for each session and the artworks and corresponding topics that are explored. Please make sure that 
+each workshop day has sessions covering the typical 9am-to-5pm span (with appropriate breaks for coffee, lunch etc) - 
+also propose break-out sessions for small-group discussions that combine the chosen artworks and workshop theme. 
+In the programme, mention the artworks by name and explicitly point out in which sessions they will 
+be discussed and why. Provide response in HTML format. Do not refer to instructions or ask questions in response.
+""".strip()
+
+
+def build_program_request(num_days, theme, audience):
+    request = PROGRAM_PROMPT_TEMPLATE.format(NUM_DAYS=num_days, THEME=theme, AUDIENCE=audience)
+    print("Parameterized prompt:", request, "...")
+    return request
+
+
+def build_program_prompt(request):
+    """The full prompt as shown to the user."""
+    return request + PROGRAM_INSTRUCTIONS
+
+
+def get_program_llm(llm_model, context_type, stream=False):
+    if FAKE_LLM:
+        return stream_fake_llm if stream else ask_fake_llm
+    if context_type == "images":
+        if llm_model == "gpt-5":
+            return stream_openai_llm if stream else ask_openai_llm
+        return stream_anthropic_llm if stream else ask_anthropic_llm
+    if llm_model == "gpt-5":
+        return stream_openai_llm_html if stream else ask_openai_llm_html
+    return stream_anthropic_llm_html if stream else ask_anthropic_llm_html
+
+
+# The fixed instructions and the selected artworks go first and are marked as a cacheable prefix, the
+# parameterized request goes last: changing only the theme or audience reuses the provider's prompt cache.
+def ask_program_llm(llm_model, context_type, context_paths, request):
+    return get_program_llm(llm_model, context_type)(request, context_paths, PROGRAM_INSTRUCTIONS, cache_prefix=True)
+
+
+def stream_program_llm(llm_model, context_type, context_paths, request):
+    """Generator of reply chunks; provider errors are raised from the iteration."""
+    return get_program_llm(llm_model, context_type, stream=True)(
+        request, context_paths, PROGRAM_INSTRUCTIONS, cache_prefix=True)
@@ -1,39 +1,101 @@
-from api.qdrant_remote_client import get_remote_client
-from api.replicate_client import get_clip_embedding
+import hashlib
+import os
+import logging
+from array import array
+from api.qdrant_remote_client import call_remote_client
+from src.local_vector_index import get_local_collection, has_local_collection
+from src.embedding_cache import EmbeddingCache, normalize_query
+from src.concurrency import get_executor, submit
+from src.singleflight import get_single_flight
+from src.metrics import span, timed, count_cache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_COLLECTION = "bagatelle_image_CLIP-L14"
+TEXT_COLLECTION = "bagatelle_text_CLIP-L14"
+
+# "qdrant" searches the remote collections, "local" the in-process copy exported by scripts/export_local_index.py
+VECTOR_BACKEND = os.getenv("BAGATELLE_VECTOR_BACKEND", "qdrant").strip().lower()
+
+# "replicate" calls the hosted openai/clip model, "local" runs the CLIP text tower in-process
+EMBEDDING_PROVIDER = os.getenv("BAGATELLE_EMBEDDING_PROVIDER", "replicate").strip().lower()
+if EMBEDDING_PROVIDER == "local":
+    from api.local_clip_client import get_clip_embedding, CLIP_MODEL
+else:
+    from api.replicate_client import get_clip_embedding, CLIP_MODEL
+
+# Set BAGATELLE_EMBEDDING_CACHE_DB to a file path to share cached embeddings between workers and restarts
+embedding_cache = EmbeddingCache(
+    max_size=int(os.getenv("BAGATELLE_EMBEDDING_CACHE_SIZE", "1024")),
+    db_path=os.getenv("BAGATELLE_EMBEDDING_CACHE_DB") or None
+)
+
+# How hybrid search merges the two collections: "weighted" sums weighted scores, "rrf" uses reciprocal ranks
+HYBRID_FUSION = os.getenv("BAGATELLE_HYBRID_FUSION", "weighted").strip().lower()
+RRF_K = 60
+SEARCH_THREADS = int(os.getenv("BAGATELLE_SEARCH_THREADS", "4"))
 
 
 def embed_query(text):
-    res = get_clip_embedding({
-        "text": text
-    })
-    return res["embedding"]
-
-
-def search_image_collection(question, top_k):
-    q_emb = embed_query(question)
-    client = get_remote_client()
-    IMAGE_COLLECTION = "bagatelle_image_CLIP-L14"
-
-    image_results = client.search(
-        collection_name=IMAGE_COLLECTION,
-        query_vector=("image_vector", q_emb),
-        limit=top_k,
-        with_payload=["title", "image_path"]
-    )
+    key = CLIP_MODEL + ":" + normalize_query(text)
+    embedding = embedding_cache.get(key)
+    count_cache("embedding", hits=int(embedding is not None), misses=int(embedding is None))
+    if embedding is None:
+        embedding = get_single_flight("embedding").do(key, lambda: compute_query_embedding(key, text))
+    return embedding
+
+
+def compute_query_embedding(key, text):
+    # A concurrent call that finished meanwhile may have filled the cache; embed_query already counted the miss
+    embedding = embedding_cache.get(key, count=False)
+    if embedding is None:
+        with span("embed", EMBEDDING_PROVIDER):
+            res = get_clip_embedding({
+                "text": text
+            })
+        embedding = res["embedding"]
+        embedding_cache.put(key, embedding)
+    return embedding
+
+
+def search_collection(collection_name, vector_name, q_emb, top_k, with_payload):
+    if VECTOR_BACKEND == "local":
+        with span("vector_search", "local"):
+            return get_local_collection(collection_name).search(q_emb, top_k, with_payload=with_payload)
+
+    # Identical concurrent searches (the same query from several users) go to Qdrant once
+    vector_digest = hashlib.sha256(array("d", q_emb).tobytes()).hexdigest()
+    key = f"{collection_name}:{vector_name}:{top_k}:{with_payload!r}:{vector_digest}"
+    try:
+        with span("vector_search", "qdrant"):
+            return get_single_flight("qdrant").do(key, lambda: call_remote_client(lambda client, timeout: client.search(
+                collection_name=collection_name,
+                query_vector=(vector_name, q_emb),
+                limit=top_k,
+                with_payload=with_payload,
+                timeout=timeout
+            )))
+    except Exception as e:
+        # With an exported local index the gallery keeps working while Qdrant is down
+        if not has_local_collection(collection_name):
+            raise
+        logger.warning(f"⚠️ Qdrant search failed ({e}), using the local index")
+        with span("vector_search", "local"):
+            return get_local_collection(collection_name).search(q_emb, top_k, with_payload=with_payload)
+
+
+def search_image_collection(question, top_k, q_emb=None):
+    if q_emb is None:
+        q_emb = embed_query(question)
+    image_results = search_collection(IMAGE_COLLECTION, "image_vector", q_emb, top_k, ["title", "image_path"])
     return image_results
 
 
-def search_text_collection(question, top_k):
-    q_emb = embed_query(question)
-    client = get_remote_client()
-    TEXT_COLLECTION = "bagatelle_text_CLIP-L14"
-
-    text_results = client.search(
-        collection_name=TEXT_COLLECTION,
-        query_vector=("text_vector", q_emb),
-        limit=top_k,
-        with_payload=["section_text", "image_path"]
-    )
+def search_text_collection(question, top_k, q_emb=None):
+    if q_emb is None:
+        q_emb = embed_query(question)
+    text_results = search_collection(TEXT_COLLECTION, "text_vector", q_emb, top_k, ["section_text", "image_path"])
     return text_results
 
 
@@ -55,8 +117,8 @@ def prepare_response(question, top_k, sorted_results):
     return response
 
 
-def query_image_collection(question, top_k=5):
-    image_results = search_image_collection(question, top_k=top_k)
+def query_image_collection(question, top_k=5, q_emb=None):
+    image_results = search_image_collection(question, top_k=top_k, q_emb=q_emb)
     image_list = []
     for r in image_results:
         image_list.append({"point": r, "score": r.score})
@@ -64,41 +126,52 @@ def query_image_collection(question, top_k=5):
     return prepare_response(question, top_k, sorted_results)
 
 
-def query_text_collection(question, top_k=5):
-    OVERHIT = 5
-    text_results = search_text_collection(question, top_k * OVERHIT)
-
+@timed("fusion")
+def fuse_results(weighted_results, method="weighted"):
+    """
+    Merge scored points from several searches into per-image entries sorted by descending score.
+    weighted_results is a list of (results, weight) pairs; every result list is ordered by its own score.
+    "weighted" adds up weight * score of all hits of an image (text collections hold several sections per image),
+    "rrf" adds weight / (RRF_K + rank) of the image's best hit in each list, which ignores score scales.
+    """
     combined = {}
-    for r in text_results:
-        img_path = r.payload.get("image_path", "N/A")
-        if img_path in combined:
-            combined[img_path]["score"] += r.score
-            combined[img_path]["point"].append(r)
-        else:
-            combined[img_path] = {"point": [r], "score": r.score}
-
-    sorted_results = sorted(combined.values(), key=lambda x: x["score"], reverse=True)
+    for results, weight in weighted_results:
+        ranked = {}
+        for r in results:
+            img_path = r.payload.get("image_path", "N/A")
+            if method == "rrf":
+                if img_path in ranked:
+                    contribution = 0
+                else:
+                    ranked[img_path] = len(ranked) + 1
+                    contribution = weight / (RRF_K + ranked[img_path])
+            else:
+                contribution = r.score * weight
+            if img_path in combined:
+                combined[img_path]["score"] += contribution
+                combined[img_path]["point"].append(r)
+            else:
+                combined[img_path] = {"point": [r], "score": contribution}
+    return sorted(combined.values(), key=lambda x: x["score"], reverse=True)
+
+
+def query_text_collection(question, top_k=5, q_emb=None):
+    OVERHIT = 5
+    text_results = search_text_collection(question, top_k * OVERHIT, q_emb)
+    sorted_results = fuse_results([(text_results, 1.0)])
     return prepare_response(question, top_k, sorted_results)
 
 
-def query_image_and_text_collection(question, top_k=5, text_weight=0.5, image_weight=0.5):
+def query_image_and_text_collection(question, top_k=5, text_weight=0.5, image_weight=0.5, q_emb=None):
     OVERHIT = 5
-    image_results = search_image_collection(question, top_k)
-    text_results = search_text_collection(question, top_k * OVERHIT)
-
-    combined = {}
-    for r in image_results:
-        img_path = r.payload.get("image_path", "N/A")
-        combined[img_path] = {"point": [r], "score": r.score * text_weight}
-
-    for r in text_results:
-        img_path = r.payload.get("image_path", "N/A")
-        if img_path in combined:
-            combined[img_path]["score"] += r.score * image_weight
-            combined[img_path]["point"].append(r)
-        else:
-            combined[img_path] = {"point": [r], "score": r.score * image_weight}
-    sorted_results = sorted(combined.values(), key=lambda x: x["score"], reverse=True)
+    # Embed once and search both collections at the same time
+    if q_emb is None:
+        q_emb = embed_query(question)
+    image_future = submit(get_executor("search", SEARCH_THREADS), search_image_collection, question, top_k, q_emb)
+    text_results = search_text_collection(question, top_k * OVERHIT, q_emb)
+    image_results = image_future.result()
+
+    sorted_results = fuse_results([(image_results, image_weight), (text_results, text_weight)], HYBRID_FUSION)
     return prepare_response(question, top_k, sorted_results)
 
 
@@ -0,0 +1,106 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+# Opt-in log of /retrieve and /generate_program traffic, one JSON record per line, for scripts/replay_queries.py.
+# Every process writes its own rotating file, query-<pid>.log, in this directory; empty disables the log.
+QUERY_LOG_DIR = os.getenv("BAGATELLE_QUERY_LOG_DIR", "")
+QUERY_LOG_MAX_BYTES = int(os.getenv("BAGATELLE_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+QUERY_LOG_BACKUPS = int(os.getenv("BAGATELLE_QUERY_LOG_BACKUPS", "5"))
+# Free text (questions, workshop themes and audiences) is stored as a keyed hash unless this is set: repeated
+# queries stay recognizable for replay and cache analysis without the log revealing what users asked
+QUERY_LOG_TEXT = os.getenv("BAGATELLE_QUERY_LOG_TEXT", "").strip().lower() in ("1", "true", "yes")
+QUERY_LOG_SALT = os.getenv("BAGATELLE_QUERY_LOG_SALT") or os.getenv("BAGATELLE_SECRET_KEY", "")
+# Sent by the replay tool, whose requests are not logged again
+REPLAY_HEADER = "X-Bagatelle-Replay"
+
+_logger = None
+_logger_pid = None
+_logger_lock = threading.Lock()
+
+
+def get_query_logger():
+    """The process's query logger, None when the log is disabled."""
+    global _logger, _logger_pid
+    if not QUERY_LOG_DIR:
+        return None
+    logger = _logger
+    if logger is None or _logger_pid != os.getpid():
+        with _logger_lock:
+            if _logger is None or _logger_pid != os.getpid():
+                os.makedirs(QUERY_LOG_DIR, exist_ok=True)
+                logger = logging.getLogger(f"bagatelle.query_log.{os.getpid()}")
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                handler = RotatingFileHandler(os.path.join(QUERY_LOG_DIR, f"query-{os.getpid()}.log"),
+                                              maxBytes=QUERY_LOG_MAX_BYTES, backupCount=QUERY_LOG_BACKUPS,
+                                              encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.handlers = [handler]
+                _logger, _logger_pid = logger, os.getpid()
+            logger = _logger
+    return logger
+
+
+def _reset_after_fork():
+    global _logger_lock
+    _logger_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def text_field(value):
+    """The text itself when opted in, otherwise {"hash", "length"}."""
+    value = value if isinstance(value, str) else ""
+    if QUERY_LOG_TEXT:
+        return value
+    digest = hmac.new(QUERY_LOG_SALT.encode("utf-8"), value.strip().lower().encode("utf-8"), hashlib.sha256)
+    return {"hash": digest.hexdigest()[:16], "length": len(value)}
+
+
+def context_lines(context):
+    return context.strip().splitlines() if isinstance(context, str) else []
+
+
+def request_params(endpoint, data):
+    """The request parameters worth replaying; artwork paths are public gallery ids and kept as they are."""
+    if endpoint == "retrieve":
+        return {"question": text_field(data.get("question")), "k": data.get("k"), "weight": data.get("weight"),
+                "llm": data.get("llm"), "async": bool(data.get("async"))}
+    return {"num_days": data.get("num_days"), "theme": text_field(data.get("theme")),
+            "audience": text_field(data.get("audience")), "context": context_lines(data.get("context")),
+            "context_type": data.get("context_type"), "llm": data.get("llm"),
+            "async": bool(data.get("async")), "stream": bool(data.get("stream"))}
+
+
+def log_query(endpoint, data, status, seconds, stages, results=None, cache_hit=None):
+    """
+    Append one record: parameters, status, latency and per-stage milliseconds, and for synchronous /retrieve
+    responses the returned image paths. Failures to log never fail the request.
+    """
+    try:
+        logger = get_query_logger()
+        if logger is None or not isinstance(data, dict):
+            return
+        record = {
+            "ts": round(time.time(), 3),
+            "endpoint": endpoint,
+            "params": request_params(endpoint, data),
+            "status": status,
+            "latency_ms": round(seconds * 1000, 1),
+            "stages_ms": {f"{stage}/{provider}" if provider else stage: round(elapsed * 1000, 1)
+                          for (stage, provider), elapsed in stages.items()},
+        }
+        if results is not None:
+            record["results"] = results
+        if cache_hit is not None:
+            record["cache_hit"] = cache_hit
+        logger.info(json.dumps(record, separators=(",", ":"), default=str))
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"⚠️ Could not write query log record: {e}")
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from api.openai_client import ask_openai_llm
+from api.anthropic_client import ask_anthropic_llm
+from api.fake_llm_client import FAKE_LLM, ask_fake_llm
+from src.content_provider import get_full_paths
+from src.verdict_cache import VerdictCache, file_content_hash, verdict_key
+from src.concurrency import get_executor, submit
+from src.resilience import get_provider
+from src.hedging import HedgeStats, LatencyTracker, hedged_call
+from src.metrics import timed, count_cache
+
+# Larger result sets are split into chunks of this size and judged by concurrent LLM calls
+MAX_IMAGES_PER_CALL = int(os.getenv("BAGATELLE_REFINE_CHUNK_SIZE", "10"))
+# Concurrent refinement calls per provider and process, keeps bursts within the providers' rate limits
+REFINE_CONCURRENCY = {
+    "anthropic": int(os.getenv("BAGATELLE_REFINE_CONCURRENCY_ANTHROPIC", "4")),
+    "openai": int(os.getenv("BAGATELLE_REFINE_CONCURRENCY_OPENAI", "4")),
+}
+_provider_slots = {provider: threading.BoundedSemaphore(limit) for provider, limit in REFINE_CONCURRENCY.items()}
+
+# Opt-in hedging: a chunk the chosen provider has not answered within the HEDGE_PERCENTILE latency of its recent
+# calls also goes to the other provider, and the first valid verdict array wins
+HEDGE_REFINEMENT = os.getenv("BAGATELLE_REFINE_HEDGE", "").strip().lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("BAGATELLE_REFINE_HEDGE_PERCENTILE", "90"))
+# Used until enough calls of the provider were timed, and as the lower bound of the derived delay
+HEDGE_DEFAULT_DELAY = float(os.getenv("BAGATELLE_REFINE_HEDGE_DELAY", "8"))
+HEDGE_MIN_DELAY = float(os.getenv("BAGATELLE_REFINE_HEDGE_MIN_DELAY", "1"))
+provider_latency = {provider: LatencyTracker() for provider in REFINE_CONCURRENCY}
+hedge_stats = HedgeStats()
+
+REFINE_PROMPT = """
+You are an expert image analyst. Examine each of the following {NUM_IMAGES} images and determine 
+whether it match the search query. Answer strictly with a JSON array of "Yes" or "No" values, one per image, 
+in the same order as given.
+Example:
+["No", "Yes", "No"]    
+    """
+# Cached verdicts are only reused with the prompt that produced them
+PROMPT_VERSION = hashlib.sha256(REFINE_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+verdict_cache = VerdictCache(
+    os.getenv("BAGATELLE_VERDICT_CACHE_DB", os.path.join("data", "cache", "verdicts.sqlite")),
+    ttl=int(os.getenv("BAGATELLE_VERDICT_CACHE_TTL", str(30 * 24 * 3600)))
+)
+
+
+def get_refine_provider(llm_model):
+    return "openai" if llm_model == "gpt-5" else "anthropic"
+
+
+def get_refine_model(llm_model):
+    # Default LLM - claude-sonnet-4-20250514
+    return "gpt-5" if llm_model == "gpt-5" else "claude-sonnet-4-20250514"
+
+
+def get_backup_llm(llm_model):
+    """The refinement choice on the other provider, asked when hedging."""
+    return "claude-sonnet-4" if llm_model == "gpt-5" else "gpt-5"
+
+
+def get_hedge_delay(llm_model):
+    delay = provider_latency[get_refine_provider(llm_model)].percentile(HEDGE_PERCENTILE)
+    return HEDGE_DEFAULT_DELAY if delay is None else max(HEDGE_MIN_DELAY, delay)
+
+
+def parse_verdicts(answer):
+    answers = re.findall(r"\b(?:Image\s*\d+\s*[:\-]?\s*)?(Yes|No)\b", answer, flags=re.IGNORECASE)
+    return ["yes" in m.lower() for m in answers]
+
+
+def ask_verdicts(question, image_paths, llm_model):
+    prompt = REFINE_PROMPT.format(NUM_IMAGES=len(image_paths))
+    model = get_refine_model(llm_model)
+    if FAKE_LLM:
+        answer = ask_fake_llm(question, image_paths, prompt, model=model, provider=get_refine_provider(llm_model))
+    elif llm_model == "gpt-5":
+        answer = ask_openai_llm(question, image_paths, prompt, model=model)
+    else:
+        answer = ask_anthropic_llm(question, image_paths, prompt, model=model)
+    print("LLM response: ", answer)
+    return parse_verdicts(answer)
+
+
+def ask_provider_verdicts(question, image_paths, llm_model):
+    """Verdicts for one chunk, or None if the call failed or the reply does not have one verdict per image."""
+    provider = get_refine_provider(llm_model)
+    with _provider_slots[provider]:
+        started = time.monotonic()
+        try:
+            answers = ask_verdicts(question, image_paths, llm_model)
+        except Exception as e:
+            print(f"⚠️ Refinement of {len(image_paths)} images failed: {e}")
+            return None
+        if len(answers) != len(image_paths):
+            print(f"⚠️ Expected {len(image_paths)} verdicts, got {len(answers)}, keeping these images unfiltered")
+            return None
+        provider_latency[provider].record(time.monotonic() - started)
+    return answers
+
+
+def ask_chunk_verdicts(question, image_paths, llm_model):
+    """Verdicts for one chunk (None on failure) and the refinement choice that produced them."""
+    if not HEDGE_REFINEMENT:
+        return ask_provider_verdicts(question, image_paths, llm_model), llm_model
+
+    backup_llm = get_backup_llm(llm_model)
+    answers, winner, hedged = hedged_call(
+        get_executor("hedge", 2 * sum(REFINE_CONCURRENCY.values())),
+        lambda: ask_provider_verdicts(question, image_paths, llm_model),
+        lambda: ask_provider_verdicts(question, image_paths, backup_llm),
+        get_hedge_delay(llm_model),
+        is_valid=lambda result: result is not None
+    )
+    hedge_stats.add(
+        calls=1,
+        hedged=int(hedged),
+        backup_images=len(image_paths) if hedged else 0,
+        primary_wins=int(winner == "primary"),
+        backup_wins=int(winner == "backup"),
+        wasted_backups=int(hedged and winner != "backup"),
+        failed=int(winner is None)
+    )
+    return answers, backup_llm if winner == "backup" else llm_model
+
+
+@timed("refinement")
+def refine_images(question, image_paths, llm_model):
+    """
+    Keep the images the LLM judges relevant to the question.
+    Verdicts are cached per (question, image content, model, prompt), only unjudged images are sent to the LLM,
+    in chunks of MAX_IMAGES_PER_CALL that run concurrently. Images of a failed chunk are kept unfiltered.
+    With hedging, verdicts of the backup model are cached under that model and reused as well.
+    Returns the kept images in their original order and whether every image got a verdict.
+    """
+    if not image_paths or len(image_paths) == 0:
+        return image_paths, True
+
+    image_hashes = [file_content_hash(path) for path in get_full_paths(image_paths)]
+    llm_choices = [llm_model, get_backup_llm(llm_model)] if HEDGE_REFINEMENT else [llm_model]
+    keys = {choice: [verdict_key(question, image_hash, get_refine_model(choice), PROMPT_VERSION)
+                     for image_hash in image_hashes] for choice in llm_choices}
+    # Verdicts by image index
+    verdicts = {}
+    for choice in llm_choices:
+        missing = [i for i in range(len(image_hashes)) if i not in verdicts]
+        cached = verdict_cache.get_many([keys[choice][i] for i in missing])
+        verdicts.update({i: cached[keys[choice][i]] for i in missing if keys[choice][i] in cached})
+    pending = [i for i in range(len(image_hashes)) if i not in verdicts]
+    count_cache("verdict", hits=len(verdicts), misses=len(pending))
+    print(f"LLM verdicts cached for {len(image_paths) - len(pending)} of {len(image_paths)} images")
+
+    complete = True
+    if pending and not any(get_provider(get_refine_provider(choice)).available() for choice in llm_choices):
+        # Fail fast while the provider's circuit is open: only cached verdicts filter, the rest pass through
+        print(f"⚠️ {get_refine_provider(llm_model)} is unavailable, skipping refinement of {len(pending)} images")
+        complete = False
+    elif pending:
+        chunks = [pending[i:i + MAX_IMAGES_PER_CALL] for i in range(0, len(pending), MAX_IMAGES_PER_CALL)]
+        executor = get_executor("refine", sum(REFINE_CONCURRENCY.values()))
+        futures = [submit(executor, ask_chunk_verdicts, question, [image_paths[i] for i in chunk], llm_model)
+                   for chunk in chunks]
+        new_verdicts = {}
+        for chunk, future in zip(chunks, futures):
+            answers, choice = future.result()
+            if answers is None:
+                complete = False
+                continue
+            for i, verdict in zip(chunk, answers):
+                verdicts[i] = verdict
+                new_verdicts[keys[choice][i]] = verdict
+        verdict_cache.put_many(new_verdicts)
+
+    # Images without a verdict come from failed chunks and pass through
+    filtered = [path for i, path in enumerate(image_paths) if verdicts.get(i, True)]
+    print("LLM filter:", [verdicts.get(i) for i in range(len(image_paths))])
+    return filtered, complete
+
+
+def hedging_stats():
+    return {
+        "enabled": HEDGE_REFINEMENT,
+        **hedge_stats.stats(),
+        "latency_p50": {provider: tracker.percentile(50) for provider, tracker in provider_latency.items()},
+        f"latency_p{HEDGE_PERCENTILE:g}": {provider: tracker.percentile(HEDGE_PERCENTILE)
+                                           for provider, tracker in provider_latency.items()},
+    }
@@ -0,0 +1,263 @@
+import contextlib
+import contextvars
+import os
+import random
+import threading
+import time
+import logging
+from src.metrics import count_upstream_call
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Upstream call policy per provider, overridable as BAGATELLE_<PROVIDER>_<SETTING>, e.g. BAGATELLE_ANTHROPIC_RATE.
+# rate/burst: token bucket (calls per second) per process; timeout: longest single attempt in seconds;
+# attempts: tries including the first; failures/reset: consecutive transient failures that open the breaker and
+# seconds until it lets a probe call through.
+PROVIDER_DEFAULTS = {
+    "anthropic": {"rate": 2.0, "burst": 8, "timeout": 120, "attempts": 2, "failures": 5, "reset": 30},
+    "openai": {"rate": 2.0, "burst": 8, "timeout": 120, "attempts": 2, "failures": 5, "reset": 30},
+    "replicate": {"rate": 5.0, "burst": 10, "timeout": 30, "attempts": 3, "failures": 5, "reset": 30},
+    "qdrant": {"rate": 20.0, "burst": 40, "timeout": 10, "attempts": 2, "failures": 5, "reset": 15},
+}
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# Time budget of the current request or job; upstream attempts and retries never run past it
+REQUEST_BUDGET = float(os.getenv("BAGATELLE_REQUEST_BUDGET", "120"))
+JOB_BUDGET = float(os.getenv("BAGATELLE_JOB_BUDGET", "300"))
+
+_deadline = contextvars.ContextVar("bagatelle_deadline", default=None)
+
+
+class UpstreamUnavailable(Exception):
+    """The call was not attempted: the breaker is open, the rate limit or the deadline does not allow it."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+def remaining():
+    """Seconds left of the current deadline, None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Bound the enclosed calls to seconds from now; an enclosing shorter deadline still applies."""
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(new_deadline if current is None else min(current, new_deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting up to timeout seconds (forever if None). False if none became available."""
+        give_up = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if give_up is not None and now + wait > give_up:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. After `failures` consecutive failures it opens and rejects calls for `reset` seconds,
+    then lets a single probe through (half-open); the probe's outcome closes or re-opens it.
+    """
+
+    def __init__(self, failures, reset):
+        self.failure_threshold = failures
+        self.reset_timeout = reset
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def available(self):
+        """Whether a call would currently be let through, without claiming the half-open probe."""
+        with self._lock:
+            return self.state != "open" or time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._consecutive_failures = 0
+            self._probing = False
+
+    def release(self):
+        """End an attempt whose outcome says nothing about the service: a half-open breaker may probe again."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self.state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"⚠️ Circuit opened after {self._consecutive_failures} failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class Provider:
+    """Rate limit, circuit breaker and retries for the calls to one upstream service."""
+
+    def __init__(self, name, rate, burst, timeout, attempts, failures, reset):
+        self.name = name
+        self.timeout = timeout
+        self.attempts = attempts
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failures, reset)
+        self.counters = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+        count_upstream_call(self.name, counter)
+
+    def _admit(self):
+        """Check breaker, deadline and rate limit; returns the timeout for the attempt."""
+        if not self.breaker.available():
+            self._count("rejected")
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        left = remaining()
+        if left is not None and left <= 0:
+            self._count("rejected")
+            raise DeadlineExceeded(f"No time left for a {self.name} call")
+        if not self.bucket.acquire(timeout=left):
+            self._count("rejected")
+            raise DeadlineExceeded(f"{self.name} rate limit leaves no time for the call")
+        # Only now claim the call, a half-open breaker lets through a single probe
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        self._count("calls")
+        left = remaining()
+        return self.timeout if left is None else max(0.1, min(self.timeout, left))
+
+    @contextlib.contextmanager
+    def attempt(self, is_transient=lambda e: True):
+        """
+        A single guarded attempt for calls that cannot be retried transparently (streams).
+        Yields the timeout to use; transient exceptions raised inside count against the breaker.
+        """
+        timeout = self._admit()
+        try:
+            yield timeout
+        except BaseException as e:
+            if isinstance(e, Exception) and is_transient(e):
+                self._count("failures")
+                self.breaker.record_failure()
+            else:
+                # The request itself was at fault (4xx), or the caller stopped reading: neither shows the service
+                # to be healthy, so the failure count and a half-open state stay as they are
+                self.breaker.release()
+            raise
+        self._count("successes")
+        self.breaker.record_success()
+
+    def call(self, fn, is_transient=lambda e: True, on_retry=None):
+        """
+        Run fn(timeout) with up to `attempts` tries. Only transient exceptions are retried, after a jittered
+        exponential backoff that must fit into the deadline; others propagate at once.
+        """
+        for attempt in range(1, self.attempts + 1):
+            try:
+                with self.attempt(is_transient) as timeout:
+                    return fn(timeout)
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                if not is_transient(e) or attempt == self.attempts:
+                    raise
+                # Full jitter keeps retries of concurrent requests from arriving together
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+                left = remaining()
+                if left is not None and left <= delay:
+                    raise
+                logger.warning(f"⚠️ {self.name} call failed ({e}), retrying in {delay:.2f}s")
+                self._count("retries")
+                if on_retry is not None:
+                    on_retry(e)
+                time.sleep(delay)
+
+    def available(self):
+        return self.breaker.available()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {"state": self.breaker.state, **counters}
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def _setting(name, key, default):
+    value = os.getenv(f"BAGATELLE_{name.upper()}_{key.upper()}")
+    return default if value is None else type(default)(value)
+
+
+def get_provider(name):
+    with _providers_lock:
+        provider = _providers.get(name)
+        if provider is None:
+            defaults = PROVIDER_DEFAULTS[name]
+            provider = Provider(name, **{key: _setting(name, key, value) for key, value in defaults.items()})
+            _providers[name] = provider
+    return provider
+
+
+def provider_stats():
+    return {name: get_provider(name).stats() for name in PROVIDER_DEFAULTS}
+
+
+def _reset_after_fork():
+    global _providers_lock
+    _providers.clear()
+    _providers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from src.embedding_cache import normalize_query
+
+
+def response_cache_key(question, top_k, weight, llm_model):
+    """Split into the search parameters, which must match exactly, and the normalized question."""
+    return (top_k, round(float(weight), 2), llm_model or ""), normalize_query(question)
+
+
+class ResponseCache:
+    """
+    TTL- and size-bounded LRU of finished responses.
+    With a semantic_threshold above zero, an exact miss can still be served by a cached response whose
+    query embedding lies within that cosine similarity and whose search parameters are identical.
+    """
+
+    def __init__(self, max_size=512, ttl=3600, semantic_threshold=0.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _expire(self, now):
+        expired = [key for key, (expires, _, _) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            if self.semantic_threshold <= 0:
+                self.misses += 1
+            return None
+
+    def get_similar(self, key, embedding):
+        """Second-tier lookup, to be called after get() missed."""
+        if self.semantic_threshold <= 0:
+            return None
+        params = key[0]
+        q = _unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            candidates = [(k, e) for k, e in self._entries.items() if k[0] == params and e[2] is not None]
+            if candidates:
+                similarities = np.stack([e[2] for _, e in candidates]) @ q
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.semantic_threshold:
+                    best_key, best_entry = candidates[best]
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return best_entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, embedding=None):
+        expires = time.monotonic() + self.ttl
+        stored_embedding = _unit(embedding) if embedding is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value, stored_embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+
+def _unit(embedding):
+    v = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
@@ -0,0 +1,256 @@
+import functools
+import hashlib
+import os
+import pickle
+import threading
+import time
+import logging
+from src.resilience import remaining
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; calls are then only coalesced within a process
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Lock and result files that let gunicorn workers of one host coalesce identical calls; empty disables that
+SINGLEFLIGHT_DIR = os.getenv("BAGATELLE_SINGLEFLIGHT_DIR", os.path.join("data", "cache", "singleflight"))
+# Longest wait for another worker's call before making our own, shortened to what is left of the request deadline
+LOCK_TIMEOUT = float(os.getenv("BAGATELLE_SINGLEFLIGHT_TIMEOUT", "180"))
+LOCK_POLL_INTERVAL = 0.05
+# Files untouched for this long are removed by the periodic sweep
+FILE_MAX_AGE = 3600
+SWEEP_EVERY = 200
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller (the leader) runs the function and every
+    caller that arrives while it is in flight gets its result or exception. Nothing is cached afterwards.
+
+    Across processes the leader also holds an flock on a per-key file and leaves the result next to it; the
+    leader of another worker waiting on that lock takes a result written after it started waiting instead of
+    making the call again. Results must then be picklable; failures are not shared across processes.
+    """
+
+    def __init__(self, name, lock_dir=SINGLEFLIGHT_DIR):
+        self.name = name
+        self.lock_dir = lock_dir if fcntl is not None else ""
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._leader_calls = 0
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if self.lock_dir:
+                call.result = self._do_locked(key, fn)
+            else:
+                call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _do_locked(self, key, fn):
+        os.makedirs(self.lock_dir, exist_ok=True)
+        base = os.path.join(self.lock_dir, f"{self.name}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}")
+        started = time.time()
+        lock_file, locked = self._open_lock(base + ".lock")
+        with lock_file:
+            try:
+                result_file = base + ".result"
+                try:
+                    # Written while we waited, so by a call that was in flight together with ours
+                    if locked and os.path.getmtime(result_file) >= started:
+                        with open(result_file, "rb") as f:
+                            result = pickle.load(f)
+                        with self._lock:
+                            self.shared += 1
+                        return result
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    pass
+
+                result = fn()
+                if locked:
+                    self._write_result(result_file, result)
+                return result
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._maybe_sweep()
+
+    def _open_lock(self, lock_path):
+        """The open lock file and whether we hold its lock."""
+        while True:
+            lock_file = open(lock_path, "a+b")
+            locked = self._acquire(lock_file)
+            if not locked or _is_linked(lock_file, lock_path):
+                return lock_file, locked
+            # The sweep removed the file before we locked it; callers arriving now lock a new file at lock_path
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _acquire(self, lock_file):
+        left = remaining()
+        deadline = time.monotonic() + (LOCK_TIMEOUT if left is None else max(0, min(LOCK_TIMEOUT, left)))
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    logger.warning(f"⚠️ Gave up waiting for the in-flight {self.name} call of another worker")
+                    return False
+                time.sleep(LOCK_POLL_INTERVAL)
+
+    def _write_result(self, result_file, result):
+        try:
+            tmp_file = f"{result_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, result_file)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning(f"⚠️ Could not share the {self.name} result with other workers: {e}")
+
+    def _maybe_sweep(self):
+        with self._lock:
+            self._leader_calls += 1
+            if self._leader_calls % SWEEP_EVERY:
+                return
+        cutoff = time.time() - FILE_MAX_AGE
+        try:
+            entries = [entry for entry in os.scandir(self.lock_dir) if entry.name.startswith(self.name + "-")]
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if entry.name.endswith(".lock"):
+                    _remove_lock(entry.path)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+def _is_linked(lock_file, lock_path):
+    try:
+        return os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def _remove_lock(lock_path):
+    """Remove a lock file unless it is held: lock files are never written, their age says nothing about their use."""
+    with open(lock_path, "a+b") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        os.remove(lock_path)
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_single_flight(name):
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = SingleFlight(name)
+            _groups[name] = group
+    return group
+
+
+def single_flight(name, key):
+    """
+    Decorator coalescing concurrent calls of the function for which key(*args, **kwargs) is equal. The key should
+    be short (e.g. the model and a content_digest of the prompt): it stays in the in-flight map while the call runs.
+    """
+
+    def decorator(fn):
+        group = get_single_flight(name)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return group.do(key(*args, **kwargs), lambda: fn(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+def content_digest(value):
+    """
+    sha256 hex digest of a JSON-like value (dicts, lists, strings, numbers). Strings are hashed one by one, so
+    large ones such as base64 images are never joined into one copy of the whole payload.
+    """
+    digest = hashlib.sha256()
+    _feed(digest, value)
+    return digest.hexdigest()
+
+
+def _feed(digest, value):
+    # Every part is tagged with its type and length, so different structures cannot hash the same bytes
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        digest.update(b"s%d:" % len(data))
+        digest.update(data)
+    elif isinstance(value, bytes):
+        digest.update(b"b%d:" % len(value))
+        digest.update(value)
+    elif isinstance(value, dict):
+        digest.update(b"d%d:" % len(value))
+        for k in sorted(value, key=str):
+            _feed(digest, k)
+            _feed(digest, value[k])
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"l%d:" % len(value))
+        for item in value:
+            _feed(digest, item)
+    else:
+        data = repr(value).encode("utf-8")
+        digest.update(b"r%d:" % len(data))
+        digest.update(data)
+
+
+def single_flight_stats():
+    with _groups_lock:
+        return {name: group.stats() for name, group in _groups.items()}
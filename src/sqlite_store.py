@@ -0,0 +1,33 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    Connections to one SQLite file shared by all threads and gunicorn workers of a host.
+    sqlite3 connections must not cross threads or forked processes, so each thread of each process opens its own;
+    WAL mode lets readers proceed while another worker writes.
+    """
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        self._local = threading.local()
+        db_dir = os.path.dirname(path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self.connection()
+        for statement in schema:
+            conn.execute(statement)
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Output of scripts/generate_thumbnails.py; without it the gallery falls back to the original images
+THUMBS_DIR = os.getenv("BAGATELLE_THUMBS_DIR", os.path.join("static", "data", "thumbs"))
+MANIFEST_FILE = "manifest.json"
+THUMBS_URL = "/thumbs/"
+
+
+class ThumbnailManifest:
+    """Thumbnail variants per original image name; version changes whenever the manifest does."""
+
+    def __init__(self, images, version, stamp):
+        self.images = images
+        self.version = version
+        self.stamp = stamp
+        self.files = set()
+        for entry in images.values():
+            for fmt in ("webp", "jpeg"):
+                self.files.update(entry.get(fmt, {}).values())
+
+    @classmethod
+    def load(cls, file_name):
+        if not os.path.exists(file_name):
+            return cls({}, "none", None)
+        st = os.stat(file_name)
+        with open(file_name, "rb") as f:
+            content = f.read()
+        images = json.loads(content.decode("utf-8"))["images"]
+        logger.info(f"🖼️ Loaded thumbnail manifest with {len(images)} images")
+        return cls(images, hashlib.sha256(content).hexdigest()[:12], (st.st_size, st.st_mtime_ns))
+
+    def variants(self, name):
+        """
+        The attributes for a responsive <img>/<picture>: intrinsic size, JPEG src and srcset, WebP srcset.
+        None if the image has no thumbnails.
+        """
+        entry = self.images.get(name)
+        if entry is None:
+            return None
+
+        def srcset(fmt):
+            return ", ".join(f"{THUMBS_URL}{file} {width}w" for width, file in entry[fmt].items())
+
+        jpeg = entry["jpeg"]
+        # The smallest variant that still covers the 100 px high gallery tiles on a 2x display
+        src_width = min((w for w in jpeg if int(w) >= 320), key=int, default=max(jpeg, key=int))
+        return {
+            "width": entry["width"],
+            "height": entry["height"],
+            "src": THUMBS_URL + jpeg[src_width],
+            "srcset": srcset("jpeg"),
+            "webp_srcset": srcset("webp"),
+        }
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def _stamp(file_name):
+    try:
+        st = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def get_thumbnail_manifest(thumbs_dir=THUMBS_DIR):
+    """The process-wide manifest, reloaded when scripts/generate_thumbnails.py rewrites it."""
+    global _manifest
+    file_name = os.path.join(thumbs_dir, MANIFEST_FILE)
+    stamp = _stamp(file_name)
+    manifest = _manifest
+    if manifest is None or manifest.stamp != stamp:
+        with _manifest_lock:
+            if _manifest is None or _manifest.stamp != stamp:
+                _manifest = ThumbnailManifest.load(file_name)
+            manifest = _manifest
+    return manifest
@@ -0,0 +1,50 @@
+import threading
+from src.metrics import count_tokens
+
+# Prompt and completion tokens per (provider, model) of this worker, including the part of the prompt served
+# from the providers' prompt caches. input_tokens counts every prompt token, cached or not.
+_usage = {}
+_usage_lock = threading.Lock()
+
+_FIELDS = ("requests", "input_tokens", "cached_input_tokens", "cache_write_tokens", "output_tokens")
+
+
+def record_usage(provider, model, input_tokens=0, cached_input_tokens=0, cache_write_tokens=0, output_tokens=0):
+    with _usage_lock:
+        usage = _usage.setdefault((provider, model), dict.fromkeys(_FIELDS, 0))
+        usage["requests"] += 1
+        usage["input_tokens"] += input_tokens or 0
+        usage["cached_input_tokens"] += cached_input_tokens or 0
+        usage["cache_write_tokens"] += cache_write_tokens or 0
+        usage["output_tokens"] += output_tokens or 0
+    count_tokens(provider, model, input=input_tokens, cached_input=cached_input_tokens,
+                 cache_write=cache_write_tokens, output=output_tokens)
+
+
+def record_anthropic_usage(model, usage):
+    """Anthropic reports cache reads and writes separately from the uncached input_tokens."""
+    if usage is None:
+        return
+    cached = getattr(usage, "cache_read_input_tokens", None) or 0
+    written = getattr(usage, "cache_creation_input_tokens", None) or 0
+    record_usage("anthropic", model, input_tokens=(usage.input_tokens or 0) + cached + written,
+                 cached_input_tokens=cached, cache_write_tokens=written, output_tokens=usage.output_tokens)
+
+
+def record_openai_usage(model, usage):
+    """OpenAI's prompt_tokens include the cached ones, reported in prompt_tokens_details."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    record_usage("openai", model, input_tokens=usage.prompt_tokens,
+                 cached_input_tokens=getattr(details, "cached_tokens", None) or 0,
+                 output_tokens=usage.completion_tokens)
+
+
+def usage_stats():
+    with _usage_lock:
+        stats = {f"{provider}/{model}": dict(usage) for (provider, model), usage in _usage.items()}
+    for usage in stats.values():
+        usage["cached_ratio"] = round(usage["cached_input_tokens"] / usage["input_tokens"], 3) \
+            if usage["input_tokens"] else 0.0
+    return stats
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import logging
+from src.embedding_cache import normalize_query
+from src.sqlite_store import SQLiteStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def file_content_hash(path):
+    """sha256 of a file, memoized on (path, size, mtime) so unchanged images are read once per process."""
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _file_hashes_lock:
+        cached = _file_hashes.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    content_hash = digest.hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[path] = (stamp, content_hash)
+    return content_hash
+
+
+def verdict_key(question, image_hash, model, prompt_version):
+    raw = "\0".join([prompt_version, model, normalize_query(question), image_hash])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """Persistent Yes/No relevance verdicts of an LLM for (question, image) pairs."""
+
+    def __init__(self, db_path, ttl=30 * 24 * 3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._store = SQLiteStore(db_path, [
+            "CREATE TABLE IF NOT EXISTS verdicts "
+            "(key TEXT PRIMARY KEY, verdict INTEGER NOT NULL, created REAL NOT NULL)"
+        ])
+
+    def get_many(self, keys):
+        """Return {key: bool} for the keys with an unexpired verdict."""
+        if not keys:
+            return {}
+        found = {}
+        try:
+            placeholders = ",".join("?" * len(keys))
+            rows = self._store.execute(
+                f"SELECT key, verdict FROM verdicts WHERE created > ? AND key IN ({placeholders})",
+                (time.time() - self.ttl, *keys)).fetchall()
+            found = {key: bool(verdict) for key, verdict in rows}
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Verdict cache read failed: {e}")
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, verdicts):
+        if not verdicts:
+            return
+        now = time.time()
+        try:
+            self._store.execute("BEGIN")
+            self._store.connection().executemany(
+                "INSERT OR REPLACE INTO verdicts (key, verdict, created) VALUES (?, ?, ?)",
+                [(key, int(verdict), now) for key, verdict in verdicts.items()])
+            self._store.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Verdict cache write failed: {e}")
+            try:
+                self._store.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,110 @@
+import importlib
+import os
+import threading
+import time
+import logging
+from src.catalog import get_catalog
+from src.thumbnails import get_thumbnail_manifest
+from src.writeups import get_writeup_manifest
+from src.html_text_store import get_html_text_store
+from src.local_vector_index import get_local_collection
+from src.resilience import provider_stats
+from src.qdrant_bagatelle_store_client import VECTOR_BACKEND, EMBEDDING_PROVIDER, IMAGE_COLLECTION, TEXT_COLLECTION
+from api import anthropic_client, openai_client, qdrant_remote_client, replicate_client
+from api.fake_llm_client import FAKE_LLM
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Loads the read-only data requests depend on before the first one is served. app.py runs it on import, so with
+# gunicorn's preload_app it runs in the master and the forked workers share the loaded data copy-on-write and start
+# ready; without preload_app gunicorn.conf.py runs it in the master before the fork, which makes the call in the
+# workers a no-op. 0 leaves everything to load on first use.
+WARMUP_ENABLED = os.getenv("BAGATELLE_WARMUP", "1").strip().lower() in ("1", "true", "yes")
+
+_steps = None
+_lock = threading.Lock()
+
+
+def _load_local_index():
+    return ", ".join(f"{name}: {len(get_local_collection(name).ids)} points"
+                     for name in (IMAGE_COLLECTION, TEXT_COLLECTION))
+
+
+def _load_clip_encoder():
+    from api.local_clip_client import load_encoder, CLIP_MODEL
+    load_encoder()
+    return CLIP_MODEL
+
+
+def _warmup_steps(root_dir):
+    """(name, required, load) in order; load returns a short description of what it loaded."""
+    steps = [
+        ("catalog", True, lambda: f"{len(get_catalog().images)} images"),
+        ("thumbnails", False, lambda: f"{len(get_thumbnail_manifest().files)} files"),
+        ("writeups", False, lambda: f"version {get_writeup_manifest().version}"),
+        ("html_text", False, lambda: f"{get_html_text_store(root_dir).preload()} pages"),
+    ]
+    if VECTOR_BACKEND == "local":
+        steps.append(("local_index", True, _load_local_index))
+    if EMBEDDING_PROVIDER == "local":
+        steps.append(("clip_encoder", True, _load_clip_encoder))
+    # The provider SDKs take a while to import; doing it here spares the first request that needs them
+    sdks = [module for module, used in (
+        ("qdrant_client", VECTOR_BACKEND != "local" and qdrant_remote_client.is_configured()),
+        ("replicate", EMBEDDING_PROVIDER != "local" and replicate_client.is_configured()),
+        ("anthropic", not FAKE_LLM and anthropic_client.is_configured()),
+        ("openai", not FAKE_LLM and openai_client.is_configured()),
+    ) if used]
+    steps.append(("sdks", False, lambda: ", ".join(importlib.import_module(module).__name__ for module in sdks)))
+    return steps
+
+
+def warm_up(root_dir):
+    """Run the warm-up once per process tree; a failed step is logged and, if required, keeps /readyz failing."""
+    global _steps
+    with _lock:
+        if _steps is not None:
+            return _steps
+        steps = {}
+        if not WARMUP_ENABLED:
+            logger.info("🔥 Warm-up disabled, data loads on first use")
+            _steps = steps
+            return steps
+        started = time.perf_counter()
+        for name, required, load in _warmup_steps(root_dir):
+            step_started = time.perf_counter()
+            try:
+                steps[name] = {"ok": True, "loaded": load()}
+            except Exception as e:
+                logger.error(f"❌ Warm-up step {name} failed: {e}")
+                steps[name] = {"ok": False, "error": str(e)}
+            steps[name].update(required=required, seconds=round(time.perf_counter() - step_started, 3))
+        logger.info(f"🔥 Warm-up finished in {time.perf_counter() - started:.1f}s: " +
+                    ", ".join(f"{name} {'✅' if step['ok'] else '❌'}" for name, step in steps.items()))
+        _steps = steps
+        return steps
+
+
+def readiness():
+    """
+    (ready, details): the warm-up ran without failed required steps and the providers the retrieval path needs
+    are configured. Open circuits are reported but do not fail readiness: every worker shares the upstreams,
+    so taking workers out of rotation would not help.
+    """
+    steps = _steps
+    required = {}
+    if VECTOR_BACKEND != "local":
+        required["qdrant"] = qdrant_remote_client.is_configured()
+    if EMBEDDING_PROVIDER != "local":
+        required["replicate"] = replicate_client.is_configured()
+    optional = {} if FAKE_LLM else {"anthropic": anthropic_client.is_configured(),
+                                    "openai": openai_client.is_configured()}
+    circuits = {name: stats["state"] for name, stats in provider_stats().items()}
+    ready = steps is not None and all(step["ok"] for step in steps.values() if step["required"]) and \
+        all(required.values())
+    return ready, {
+        "warm_up": "pending" if steps is None else steps,
+        "providers": {name: {"configured": configured, "required": name in required,
+                             "circuit": circuits.get(name)} for name, configured in {**required, **optional}.items()},
+    }
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+import logging
+from src.verdict_cache import file_content_hash
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The LLM write-up sets; scripts/precompress_writeups.py stores .gz/.br siblings next to each page and a
+# manifest of content hashes that the gallery appends to its links as ?v=<hash>
+WRITEUP_DIR = os.path.join("static", "data")
+WRITEUP_SETS = ("html_claude-sonnet-4", "html_gpt-4o", "html_gpt-5")
+MANIFEST_FILE = os.path.join(WRITEUP_DIR, "writeups_manifest.json")
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class WriteupManifest:
+    def __init__(self, pages, version, stamp):
+        # {set: {file name: {"hash", "size", "mtime_ns"}}}
+        self.pages = pages
+        self.version = version
+        self.stamp = stamp
+
+    @classmethod
+    def load(cls, file_name):
+        if not os.path.exists(file_name):
+            return cls({}, "none", None)
+        st = os.stat(file_name)
+        with open(file_name, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        logger.info(f"📄 Loaded write-up manifest with {sum(len(p) for p in manifest['pages'].values())} pages")
+        return cls(manifest["pages"], manifest["version"], (st.st_size, st.st_mtime_ns))
+
+    def versions(self, file_name):
+        """{set: hash} of the write-ups for file_name, as recorded at build time."""
+        return {writeup_set: pages[file_name]["hash"]
+                for writeup_set, pages in self.pages.items() if file_name in pages}
+
+    def content_hash(self, writeup_set, file_name, path):
+        """Hash of the page as it is on disk; the recorded one is used only while the file is unchanged."""
+        entry = self.pages.get(writeup_set, {}).get(file_name)
+        st = os.stat(path)
+        if entry is not None and (entry["size"], entry["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+            return entry["hash"]
+        return file_content_hash(path)[:16]
+
+
+def select_encoding(path, accept_encodings):
+    """
+    The best precompressed sibling of path the client accepts, as (content encoding, file path).
+    Siblings older than the page are ignored; (None, path) means the page is sent as is.
+    """
+    mtime = os.path.getmtime(path)
+    for encoding, suffix in ENCODINGS:
+        if encoding not in accept_encodings:
+            continue
+        try:
+            if os.path.getmtime(path + suffix) >= mtime:
+                return encoding, path + suffix
+        except OSError:
+            continue
+    return None, path
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def _stamp(file_name):
+    try:
+        st = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def get_writeup_manifest(file_name=MANIFEST_FILE):
+    """The process-wide manifest, reloaded when scripts/precompress_writeups.py rewrites it."""
+    global _manifest
+    stamp = _stamp(file_name)
+    manifest = _manifest
+    if manifest is None or manifest.stamp != stamp:
+        with _manifest_lock:
+            if _manifest is None or _manifest.stamp != stamp:
+                _manifest = WriteupManifest.load(file_name)
+            manifest = _manifest
+    return manifest
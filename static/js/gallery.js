@@ -1,15 +1,18 @@
 import {initializeMagniview} from './magniview/main.js';
 
+// Images of the categories of the last update, all of them when none was selected
+function filterImages(images) {
+    return (activeCategories.length > 0) ? images.filter((image) =>
+        activeCategories.includes(image.category)
+    ) : [...images];
+}
+
 // Filter images by selected categories
 function updateImages() {
-    const selectedCategories = Array.from(
+    activeCategories = Array.from(
         document.querySelectorAll('#checkbox-container input[type="checkbox"]:checked')
     ).map((checkbox) => checkbox.value);
-
-    const filteredImages = (selectedCategories.length > 0) ? images.filter((image) =>
-        selectedCategories.includes(image.category)
-    ) : [...images];
-    displayImages(filteredImages);
+    displayImages(filterImages(images));
     clearSelected();
 }
 
@@ -21,7 +24,7 @@ function updateSelected(selectedImages, updateCheckboxes = true) {
     [...selectedImages].forEach(fileName => {
         const src = getImagePath(fileName);
         const link = fileName.replace(/\.[^/.]+$/, ".html");
-        let thumbnailFigure = createThumbnailFigure(src, fileName, link);
+        let thumbnailFigure = createThumbnailFigure(src, fileName, link, catalogEntries[fileName], SELECTED_THUMBNAIL_SIZES);
         selectedContainer.appendChild(thumbnailFigure);
 
         //Sync checkboxes
@@ -59,31 +62,61 @@ function getCheckboxName(src) {
     return "chb_" + getFileName(src).replace(/[^a-zA-Z0-9]/g, "_");
 }
 
-// Create a link for image caption
-function createLink(folder, filename, label) {
+// Create a link for image caption; the content hash of the page, if known, lets the browser cache it for good
+function createLink(folder, filename, label, version) {
     let link = document.createElement("a");
-    link.href = folder + filename;
+    link.href = folder + filename + (version ? "?v=" + version : "");
     link.target = "_blank";
     link.innerText = label;
     return link;
 }
 
-// Create a figure to show image and associated information
-function createThumbnailFigure(src, label, link) {
-    const maxLength = 30;
+// Create a tile image; with pre-generated thumbnails the browser picks the variant that fits the tile,
+// while data-full keeps the original for the Magniview lightbox and for selection
+function createThumbnailImage(src, thumbs, sizes) {
     const thumbnail = document.createElement("img");
-    thumbnail.src = src;
     thumbnail.classList.add("thumbnail");
     thumbnail.title = getFileName(src);
+    thumbnail.dataset.full = src;
+    thumbnail.loading = "lazy";
+    thumbnail.decoding = "async";
+    if (!thumbs) {
+        thumbnail.src = src;
+        return thumbnail;
+    }
+    // Catalogue tiles are THUMBNAIL_HEIGHT px high, so their rendered width follows from the aspect ratio
+    sizes = sizes || Math.ceil(THUMBNAIL_HEIGHT * thumbs.width / thumbs.height) + "px";
+    thumbnail.width = thumbs.width;
+    thumbnail.height = thumbs.height;
+    thumbnail.srcset = thumbs.srcset;
+    thumbnail.sizes = sizes;
+    thumbnail.src = thumbs.src;
+
+    const picture = document.createElement("picture");
+    const webp = document.createElement("source");
+    webp.type = "image/webp";
+    webp.srcset = thumbs.webp_srcset;
+    webp.sizes = sizes;
+    picture.appendChild(webp);
+    picture.appendChild(thumbnail);
+    return picture;
+}
+
+// Create a figure to show image and associated information
+function createThumbnailFigure(src, label, link, entry, sizes) {
+    const maxLength = 30;
+    const versions = (entry && entry.versions) || {};
+    const thumbnail = createThumbnailImage(src, entry && entry.thumbs, sizes);
     //Figure
     const thumbnailFigure = document.createElement("figure")
     const thumbnailCaption = document.createElement("figcaption")
 
     const linksContainer = document.createElement("div");
     linksContainer.classList.add("linkColumn");
-    linksContainer.appendChild(createLink("./static/data/html_claude-sonnet-4/", link, "Claude-sonnet-4"));
-    linksContainer.appendChild(createLink("./static/data/html_gpt-4o/", link, "GPT-4o"));
-    linksContainer.appendChild(createLink("./static/data/html_gpt-5/", link, "GPT-5"));
+    linksContainer.appendChild(createLink("./static/data/html_claude-sonnet-4/", link, "Claude-sonnet-4",
+        versions["html_claude-sonnet-4"]));
+    linksContainer.appendChild(createLink("./static/data/html_gpt-4o/", link, "GPT-4o", versions["html_gpt-4o"]));
+    linksContainer.appendChild(createLink("./static/data/html_gpt-5/", link, "GPT-5", versions["html_gpt-5"]));
 
     const labelElem = document.createElement("div");
     labelElem.innerText = label.length > maxLength ? label.slice(0, maxLength - 1) + "…" : label;
@@ -113,7 +146,7 @@ function createThumbnailFigure(src, label, link) {
 function toggleImageSelection(event) {
     event.preventDefault();
     const checkbox = event.target;
-    const src = checkbox.parentElement.querySelector('img').src;
+    const src = checkbox.parentElement.querySelector('img').dataset.full;
     const fileName = getFileName(src)
 
     const isChecked = checkbox.checked;
@@ -132,15 +165,26 @@ function toggleImageSelection(event) {
 function displayImages(images) {
     const imageContainer = document.getElementById("image-container");
     imageContainer.innerHTML = "";
+    appendImages(images, 0);
+    refreshMagniview();
+}
+
+// Add images to the catalogue, numbering them from startIndex
+function appendImages(images, startIndex) {
+    const imageContainer = document.getElementById("image-container");
     images.forEach((image, index) => {
-        let label = `Image ${index + 1}`
+        let label = `Image ${startIndex + index + 1}`
         if (image.category) {
             label += `(${categoryAcronyms[image.category]})`;
         }
         let thumbnailFigure = createThumbnailFigure(
-            'static/data/images/' + image.name, label, image.link);
+            'static/data/images/' + image.name, label, image.link, image);
         imageContainer.appendChild(thumbnailFigure);
     });
+}
+
+// Bind the Magniview lightbox to the thumbnails currently shown
+function refreshMagniview() {
     try {
         initializeMagniview();
     } catch (e) {
@@ -186,13 +230,42 @@ function loadCategories() {
         checkbox.type = "checkbox";
         checkbox.value = category;
         label.appendChild(checkbox);
-        const count = images.filter(image => image.category === category).length;
+        const count = categoryCounts[category];
         label.appendChild(document.createTextNode(category + " (" + categoryAcronyms[category] + ") - " + count));
         checkboxContainer.appendChild(label);
         checkboxContainer.appendChild(document.createElement("br"));
     });
 }
 
+// Fetch the catalogue page by page, showing every page as soon as it arrives. A category filter chosen meanwhile
+// applies to the pages still to come; Magniview is bound once, after the last page.
+async function loadCatalog() {
+    const imageContainer = document.getElementById("image-container");
+    let page = 1;
+    let pages = 1;
+    do {
+        const resp = await fetch(`/api/catalog?page=${page}&page_size=${CATALOG_PAGE_SIZE}`, {
+            credentials: 'same-origin',
+            headers: {'Accept': 'application/json'}
+        });
+        if (!resp.ok) {
+            throw new Error(`Failed to load catalogue: ${resp.status}`);
+        }
+        const data = await resp.json();
+        if (page === 1) {
+            categoryCounts = data["categories"];
+            categories = Object.keys(categoryCounts).sort();
+            loadCategories();
+        }
+        data["items"].forEach(image => catalogEntries[image.name] = image);
+        appendImages(filterImages(data["items"]), imageContainer.children.length);
+        images.push(...data["items"]);
+        pages = data["pages"];
+        page += 1;
+    } while (page <= pages);
+    refreshMagniview();
+}
+
 // Add message to the chat box
 function addMessageToRagChat(sender, message) {
     const chatBox = document.getElementById("rag-chat-box");
@@ -257,7 +330,7 @@ async function submitSearchRequest(ev) {
     // Top K images to extract
     let k = parseInt(document.getElementById('k-input').value, 10);
     if (Number.isNaN(k)) k = 1;
-    k = Math.max(1, Math.min(10, k));
+    k = Math.max(1, Math.min(50, k));
     // LLM version to cross-check image relevance
     let llmModel = null
     const llmOptions = document.querySelector('input[name="llm_refine_choice"]:checked');
@@ -280,14 +353,19 @@ async function submitSearchRequest(ev) {
                 'Content-Type': 'application/json',
                 'Accept': 'application/json'
             },
-            body: JSON.stringify({question: question, k: k, llm: llmModel, weight: rawWeight})
+            body: JSON.stringify({question: question, k: k, llm: llmModel, weight: rawWeight, async: true})
         });
 
         if (!resp.ok) {
             throw new Error(`Server returned ${resp.status} ${resp.statusText}`);
         }
 
-        const response = await resp.json();
+        // LLM refinement runs as a background job, plain searches answer right away
+        let response = await resp.json();
+        if (resp.status === 202) {
+            retrieveStatus.textContent = `Retrieving top ${k} images and checking them with ${llmModel}...`;
+            response = await waitForJob(response["job_id"]);
+        }
         const data = response["response"];
         if (!Array.isArray(data)) {
             throw new Error('Server response is not a JSON array of image URLs/paths.');
@@ -366,14 +444,15 @@ async function submitWorkshopForm(ev) {
     try {
         const resp = await fetch("/generate_program", {
             method: "POST",
-            headers: {"Content-Type": "application/json", "Accept": "application/json"},
+            headers: {"Content-Type": "application/json", "Accept": "text/event-stream"},
             body: JSON.stringify({
                 num_days: num_days,
                 theme: theme,
                 audience: audience,
                 context_type: context_type,
                 context: context,
-                llm: llm_model
+                llm: llm_model,
+                stream: true
             })
         });
 
@@ -382,9 +461,20 @@ async function submitWorkshopForm(ev) {
             throw new Error(`Server returned ${resp.status}: ${txt}`);
         }
 
-        const data = await resp.json();
-        const programText = data["response"] || JSON.stringify(data);
-        const prompt = data["prompt"] || "?"
+        // Streamed rather than run as a job: the first words show within about a second, without polling
+        let programText = "";
+        let prompt = "?";
+        statusEl.textContent = "Generating programme — receiving response...";
+        await readEventStream(resp, (event, data) => {
+            if (event === "start") {
+                prompt = data["content"] || prompt;
+            } else if (event === "error") {
+                throw new Error(data["details"] || data["error"] || "Model failed to run!");
+            } else if (event === "message") {
+                programText += data;
+                showWorkshopPreview(programText);
+            }
+        });
 
         statusEl.textContent = "Programme generated.";
         showWorkshopProgram(programText, prompt);
@@ -398,6 +488,63 @@ async function submitWorkshopForm(ev) {
     }
 }
 
+// Read a text/event-stream response and call onEvent(eventName, parsedData) for every event
+async function readEventStream(resp, onEvent) {
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+        const {value, done} = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, {stream: true});
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) >= 0) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = "message";
+            const dataLines = [];
+            rawEvent.split("\n").forEach(line => {
+                if (line.startsWith("event:")) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith("data:")) {
+                    dataLines.push(line.slice(5).trim());
+                }
+            });
+            if (dataLines.length > 0) {
+                onEvent(event, JSON.parse(dataLines.join("\n")));
+            }
+        }
+    }
+}
+
+// Poll a background job until it finishes; returns its result
+async function waitForJob(jobId) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+        const resp = await fetch(`/jobs/${jobId}`, {
+            credentials: 'same-origin',
+            headers: {'Accept': 'application/json'}
+        });
+        if (!resp.ok) {
+            throw new Error(`Server returned ${resp.status} ${resp.statusText}`);
+        }
+        const job = await resp.json();
+        if (job["status"] === "done") {
+            return job["result"];
+        }
+        if (job["status"] === "failed" || job["status"] === "cancelled") {
+            throw new Error(job["error"] || `Job ${job["status"]}`);
+        }
+    }
+}
+
+// Render the partial programme while it streams in, dropping the (possibly unterminated) ```html fence
+function showWorkshopPreview(partialText) {
+    const wContent = document.getElementById('workshop-result-content');
+    if (!wContent) return;
+    wContent.innerHTML = partialText.replace(/^\s*```html\n?/i, "").replace(/```\s*$/, "");
+}
+
 // Call this after receiving `programText` from the server
 function showWorkshopProgram(responseText, prompt) {
     const wToolbar = document.getElementById('workshop-result-toolbar');
@@ -494,7 +641,17 @@ function clearSelected(){
 // Global definitions and controls
 
 const retrieveStatus = document.getElementById('retrieve-status');
-const categories = Array.from(new Set(images.map(img => img["category"]))).sort();
+const CATALOG_PAGE_SIZE = 100;
+const THUMBNAIL_HEIGHT = 100;
+const JOB_POLL_INTERVAL = 1000;
+// Matches the max-width of the selected images in gallery_style.css
+const SELECTED_THUMBNAIL_SIZES = "(max-width: 768px) 120px, 150px";
+let images = [];
+let categories = [];
+let categoryCounts = {};
+let catalogEntries = {};
+// Categories the gallery is filtered by, also applied to catalogue pages that arrive later
+let activeCategories = [];
 const categoryAcronyms = {};
 let selectedImages = new Set();
 
@@ -512,6 +669,5 @@ settingContainer.style.marginRight = "20px";
 settingContainer.style.minWidth = "300px";
 
 // Initial setup
-loadCategories();
-displayImages(images);
+loadCatalog().catch(err => console.error(err));
 
@@ -21,7 +21,9 @@ export function getMediaSrc(item) {
 
     const imgElement = item.tagName && item.tagName.toLowerCase() === 'img' ? item : item.querySelector('img');
     const videoElement = item.tagName && item.tagName.toLowerCase() === 'video' ? item.querySelector('source') : item.querySelector('video source');
-    const mediaSrc = imgElement ? imgElement.src : videoElement ? videoElement.src : null;
+    // Tiles showing a thumbnail keep the full-size image in data-full
+    const imgSrc = imgElement && imgElement.dataset.full ? new URL(imgElement.dataset.full, document.baseURI).href : imgElement && imgElement.src;
+    const mediaSrc = imgElement ? imgSrc : videoElement ? videoElement.src : null;
     return mediaSrc;
 
 }